@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import OrderedDict
+from aiogram import Bot
+from config import ADMIN_CACHE_TTL, ADMIN_CACHE_MAX_CHATS, ADMIN_CACHE_FAILURE_TTL
+from logger import logger
+
+ADMIN_STATUSES = ('creator', 'administrator')
+
+
+class AdminCache:
+    """
+    Per-chat cache of administrator ids with TTL and bounded size. Chats whose
+    list can't be loaded are remembered for failure_ttl and checked member by member.
+    """
+
+    def __init__(self, ttl: float = ADMIN_CACHE_TTL, max_chats: int = ADMIN_CACHE_MAX_CHATS,
+                 failure_ttl: float = ADMIN_CACHE_FAILURE_TTL):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.failure_ttl = failure_ttl
+        self.hits = 0
+        self.misses = 0
+        # chat_id -> (admin ids, expiry time), least recently used first
+        self._chats = OrderedDict()
+        # chat_id -> in-flight warm-up task, so concurrent misses share one call
+        self._pending = {}
+        # chat_id -> time until which loading the admin list is not retried, oldest first
+        self._failed = {}
+
+    def __len__(self):
+        return len(self._chats)
+
+    def _lookup(self, chat_id: int):
+        """Return cached admin ids for a chat or None if missing/expired"""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return None
+        admin_ids, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._chats[chat_id]
+            return None
+        self._chats.move_to_end(chat_id)
+        return admin_ids
+
+    def _store(self, chat_id: int, admin_ids: frozenset):
+        self._chats[chat_id] = (admin_ids, time.monotonic() + self.ttl)
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def _store_failure(self, chat_id: int, error: Exception):
+        """Remember a failed load, logging it once per failure_ttl however many checks wait on it"""
+        now = time.monotonic()
+        if self._failed.get(chat_id, 0) > now:
+            return
+        self._failed.pop(chat_id, None)
+        self._failed[chat_id] = now + self.failure_ttl
+        while len(self._failed) > self.max_chats:
+            del self._failed[next(iter(self._failed))]
+        logger.error("Error loading chat administrators: %s, chat_id=%s, checking members one by one for %s s",
+                     error, chat_id, self.failure_ttl)
+
+    async def warm(self, bot: Bot, chat_id: int) -> frozenset:
+        """Load the full administrator list of a chat with a single API call"""
+        admins = await bot.get_chat_administrators(chat_id)
+        admin_ids = frozenset(member.user.id for member in admins)
+        self._store(chat_id, admin_ids)
+        self._failed.pop(chat_id, None)
+        return admin_ids
+
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        """Check whether user is a creator or administrator of the chat"""
+        admin_ids = self._lookup(chat_id)
+        if admin_ids is not None:
+            self.hits += 1
+            return user_id in admin_ids
+
+        self.misses += 1
+        if self._failed.get(chat_id, 0) <= time.monotonic():
+            task = self._pending.get(chat_id)
+            if task is None:
+                task = asyncio.ensure_future(self.warm(bot, chat_id))
+                self._pending[chat_id] = task
+                task.add_done_callback(lambda _: self._pending.pop(chat_id, None))
+            try:
+                admin_ids = await asyncio.shield(task)
+                return user_id in admin_ids
+            except Exception as e:
+                # Private chats and some group types don't expose the admin list
+                self._store_failure(chat_id, e)
+        chat_member = await bot.get_chat_member(chat_id, user_id)
+        return chat_member.status in ADMIN_STATUSES
+
+    def member_updated(self, chat_id: int, user_id: int, old_status: str, new_status: str):
+        """Apply a membership change to the cached admin list, ordinary joins and leaves leave it alone"""
+        was_admin = old_status in ADMIN_STATUSES
+        is_admin = new_status in ADMIN_STATUSES
+        if was_admin == is_admin:
+            return
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            return
+        admin_ids, expires_at = entry
+        admin_ids = admin_ids | {user_id} if is_admin else admin_ids - {user_id}
+        self._chats[chat_id] = (admin_ids, expires_at)
+
+    def invalidate(self, chat_id: int):
+        """Drop cached admin list of a chat"""
+        self._chats.pop(chat_id, None)
+        self._failed.pop(chat_id, None)
+
+    def clear(self):
+        self._chats.clear()
+        self._failed.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'chats': len(self._chats)}
+
+
+# Shared cache instance
+admin_cache = AdminCache()
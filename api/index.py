@@ -0,0 +1,164 @@
+"""
+Vercel serverless entry point, one webhook request per invocation.
+
+Nothing heavy is imported until the first update arrives. The Bot, its
+session, the Dispatcher and the event loop they run on are then kept for
+the warm invocations that follow. The webhook is set once with
+
+    python -m api.index [https://your-app.vercel.app]
+
+instead of on every cold start.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler
+
+# Vercel runs this file from api/, the bot modules live one level up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault('SERVERLESS', '1')
+
+from config import BOT_TOKEN, SERVERLESS_DRAIN_TIMEOUT, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET  # noqa: E402
+from logger import logger  # noqa: E402
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def webhook_secret(token: str = BOT_TOKEN, secret: str = WEBHOOK_SECRET) -> str:
+    """
+    WEBHOOK_SECRET, or one derived from the bot token: every instance must
+    know it without state, so it can't be random like bot.py's.
+    None when there is no real token to derive it from.
+    """
+    if secret:
+        return secret
+    if not token or ':' not in token:
+        return None
+    return hmac.new(token.encode(), b'webhook', hashlib.sha256).hexdigest()
+
+
+class Runtime:
+    """The bot of this instance, started on the first update and kept while the instance is warm"""
+
+    def __init__(self):
+        from aiogram import types
+        from handlers import create_dispatcher
+        from joins import join_coalescer
+        from outbound import outbound
+        from scheduler import deletion_scheduler
+        from session import create_bot
+        from storage import state_store
+
+        started = time.perf_counter()
+        self._validate = types.Update.model_validate
+        self._joins = join_coalescer
+        self._outbound = outbound
+        self._scheduler = deletion_scheduler
+        self._store = state_store
+        self._flushing = None  # deletion of due messages started by the last invocation
+        self.loop = asyncio.new_event_loop()
+        self.bot = create_bot()
+        self.dp = create_dispatcher()
+        self.loop.run_until_complete(self.dp.emit_startup(bot=self.bot, dispatcher=self.dp))
+        logger.info("Cold start took %.0f ms", (time.perf_counter() - started) * 1000)
+
+    async def _process(self, data: dict):
+        # Notices and welcomes deleted after a delay are only removed once some
+        # update reaches this instance after it, whatever is due goes out with
+        # this one. Batches the drain doesn't get through stay in the store.
+        self._flushing = asyncio.ensure_future(self._scheduler.flush_due())
+        update = self._validate(data, context={'bot': self.bot})
+        await self.dp.feed_update(self.bot, update)
+        # The instance may be frozen as soon as the response is sent, so
+        # nothing is left to timers. Sends over a chat's rate limit would hold
+        # the invocation for seconds, they go out during a later one.
+        self._joins.flush_all()
+        if not await self._outbound.drain(SERVERLESS_DRAIN_TIMEOUT, throttled_sends=False):
+            logger.info("%s outbound requests wait for the next invocation", len(self._outbound))
+        await self._store.flush()
+
+    def process(self, data: dict):
+        self.loop.run_until_complete(self._process(data))
+
+
+_runtime = None
+
+
+def get_runtime() -> Runtime:
+    global _runtime
+    if _runtime is None:
+        _runtime = Runtime()
+    return _runtime
+
+
+class handler(BaseHTTPRequestHandler):
+    """Request handler in the form the Vercel Python runtime calls"""
+
+    def _reply(self, status: int, body: bytes = b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Health check, answered without loading the bot"""
+        self._reply(200, b'Bot is running')
+
+    def do_POST(self):
+        # The route is public, a forged update could have the bot delete any message
+        secret = webhook_secret()
+        if secret is None:
+            logger.error("Neither WEBHOOK_SECRET nor a bot token is configured, rejecting webhook request")
+            self._reply(503)
+            return
+        if not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), secret):
+            self._reply(401)
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            logger.error("Received non-JSON webhook request")
+            self._reply(400)
+            return
+        try:
+            get_runtime().process(data)
+        except Exception as e:
+            # Answer 200 anyway, Telegram would redeliver the update forever
+            logger.error("Error processing webhook update %s: %s", data.get('update_id'), e, exc_info=True)
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        """The platform logs requests itself"""
+
+
+async def set_webhook(base_url: str):
+    from handlers import create_dispatcher
+    from session import create_bot
+
+    bot = create_bot()
+    try:
+        await bot.set_webhook(f"{base_url.rstrip('/')}{WEBHOOK_PATH}", secret_token=webhook_secret(),
+                              allowed_updates=create_dispatcher().resolve_used_update_types())
+    finally:
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else WEBHOOK_BASE_URL
+    if not url:
+        sys.exit("usage: python -m api.index https://your-app.vercel.app")
+    if webhook_secret() is None:
+        sys.exit("no bot token to derive the webhook secret from, set BOT_TOKEN or WEBHOOK_SECRET")
+    if not WEBHOOK_SECRET:
+        logger.info("WEBHOOK_SECRET is not set, using one derived from the bot token")
+    asyncio.run(set_webhook(url))
+    logger.info("Webhook set to %s%s", url.rstrip('/'), WEBHOOK_PATH)
@@ -0,0 +1,271 @@
+import argparse
+import csv
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from config import DUPLICATE_THRESHOLD, RULES_FILE
+from duplicates import DuplicateIndex, signature
+from rules import REASON_COOLDOWN, REASON_DUPLICATE, RuleEngine
+
+# Bytes read from the export at a time
+READ_SIZE = 1 << 20
+# Messages per task sent to a worker process
+BATCH_SIZE = 2000
+# Start of a messages array in single-chat and full Telegram Desktop exports
+_MESSAGES_RE = re.compile(r'"messages"\s*:\s*\[')
+_SPACE_RE = re.compile(r'[\s,]*')
+# Chat of the messages array that follows, Telegram writes "name", "type" and "id" before it
+_CHAT_ID_RE = re.compile(r'"id"\s*:\s*(-?\d+)')
+_CHAT_NAME_RE = re.compile(r'"name"\s*:\s*("(?:[^"\\]|\\.)*"|null)')
+# Characters kept between reads while looking for "messages", longer than a chat header key
+_TAIL = 256
+
+REPORT_FIELDS = ('chat_id', 'chat', 'id', 'date', 'from_id', 'from', 'verdict', 'price', 'text')
+
+# RuleEngine of the worker process, set by _init_worker
+_engine = None
+
+
+def _message_text(text) -> str:
+    """Plain text of an exported message, whose text is a string or a list of entities"""
+    if isinstance(text, str):
+        return text
+    return ''.join(part if isinstance(part, str) else part.get('text', '') for part in text)
+
+
+def _chat_header(text: str, chat: tuple) -> tuple:
+    """(id, name) of a chat updated with the last keys found in text"""
+    chat_id, name = chat
+    for match in _CHAT_ID_RE.finditer(text):
+        chat_id = int(match.group(1))
+    for match in _CHAT_NAME_RE.finditer(text):
+        name = json.loads(match.group(1))
+    return chat_id, name
+
+
+def iter_messages(path: str, read_size: int = READ_SIZE):
+    """
+    Yield (chat, message) for the message objects of a Telegram Desktop JSON
+    export one at a time, chat being (id, name) of the chat they belong to;
+    a full export holds several. Objects are decoded from a sliding buffer,
+    the file is never loaded whole.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        in_array = False
+        eof = False
+        chat = (None, None)
+        while True:
+            if not in_array:
+                match = _MESSAGES_RE.search(buffer, pos)
+                if match:
+                    chat = _chat_header(buffer[pos:match.start()], chat)
+                    pos = match.end()
+                    in_array = True
+                    continue
+                # Keep a tail in case a key is split between reads, cut after a complete value
+                keep = max(pos, len(buffer) - _TAIL)
+                comma = buffer.rfind(',', pos, keep)
+                if comma != -1:
+                    keep = comma
+                chat = _chat_header(buffer[pos:keep], chat)
+                buffer = buffer[keep:]
+                pos = 0
+            else:
+                pos = _SPACE_RE.match(buffer, pos).end()
+                if pos < len(buffer):
+                    if buffer[pos] == ']':
+                        pos += 1
+                        in_array = False
+                        chat = (None, None)
+                        continue
+                    try:
+                        message, end = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        # Incomplete object, read more unless the file is done
+                        if eof:
+                            raise
+                    else:
+                        pos = end
+                        yield chat, message
+                        continue
+                buffer = buffer[pos:]
+                pos = 0
+            if eof:
+                return
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer += chunk
+
+
+def iter_batches(path: str, batch_size: int = BATCH_SIZE):
+    """Text messages of an export as batches of (id, unix time, from_id, from, text, chat_id, chat) tuples"""
+    batch = []
+    for (chat_id, chat), message in iter_messages(path):
+        if message.get('type') != 'message':
+            continue
+        text = _message_text(message.get('text', ''))
+        if not text:
+            continue
+        date = message.get('date_unixtime')
+        # Older exports only have the local ISO date
+        date = int(date) if date else int(datetime.fromisoformat(message['date']).timestamp())
+        batch.append((message.get('id'), date, message.get('from_id'), message.get('from'), text, chat_id, chat))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _init_worker(hashtags: tuple, min_price: int, sale_hashtag: str):
+    global _engine
+    _engine = RuleEngine(hashtags, min_price, sale_hashtag)
+
+
+def check_batch(batch: list, duplicates: bool = True) -> list:
+    """Run the rule checks on a batch, return (message, reason or None, price, signature) per message"""
+    check = _engine.check
+    results = []
+    for item in batch:
+        verdict = check(item[4])
+        sig = signature(item[4]) if duplicates and verdict.allowed else None
+        results.append((item, verdict.reason, verdict.price, sig))
+    return results
+
+
+def _ordered_results(executor: ProcessPoolExecutor, batches, duplicates: bool, in_flight: int):
+    """Results of batches in input order, with at most in_flight batches submitted at once"""
+    pending = deque()
+    for batch in batches:
+        pending.append(executor.submit(check_batch, batch, duplicates))
+        if len(pending) >= in_flight:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+class Replay:
+    """
+    The order-dependent part of handle_resale_message: post limits per user
+    and near-duplicate lookups, replayed with message dates as the clock.
+    State is kept per chat, like the bot keeps it per topic; exports don't
+    say which topic a message was posted in. Assumes every chat's messages
+    are in chronological order, as Telegram writes them.
+    """
+
+    def __init__(self, settings, cooldown: bool = True, duplicates: bool = True):
+        self.settings = settings
+        self.cooldown = cooldown
+        self.duplicates = duplicates
+        self._posts = {}    # (chat_id, from_id) -> deque of accepted post dates
+        self._indexes = {}  # chat_id -> DuplicateIndex
+
+    def verdict(self, item: tuple, reason: str, sig: bytes) -> str:
+        message_id, date, from_id, chat_id = item[0], item[1], item[2], item[5]
+        if self.cooldown:
+            posts = self._posts.get((chat_id, from_id))
+            if posts is None:
+                posts = self._posts[(chat_id, from_id)] = deque()
+            while posts and posts[0] <= date - self.settings.cooldown_seconds:
+                posts.popleft()
+            if len(posts) >= self.settings.max_messages:
+                return REASON_COOLDOWN
+        if reason is None and sig is not None and self.duplicates:
+            index = self._indexes.get(chat_id)
+            if index is None:
+                index = self._indexes[chat_id] = DuplicateIndex(threshold=DUPLICATE_THRESHOLD)
+            if index.find(sig, now=date) is not None:
+                reason = REASON_DUPLICATE
+            else:
+                index.add(sig, from_id, message_id, now=date)
+        if reason is None and self.cooldown:
+            # Deleted posts don't count towards the limit
+            posts.append(date)
+        return reason or 'allowed'
+
+
+class ReportWriter:
+    """Verdict rows as CSV or JSON lines, chosen by the file extension"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._csv = None
+        if not path.endswith('.jsonl'):
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(REPORT_FIELDS)
+
+    def write(self, row: tuple):
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(dict(zip(REPORT_FIELDS, row)), ensure_ascii=False) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def audit(path: str, output: str, settings, workers: int = None, removed_only: bool = False,
+          cooldown: bool = True, duplicates: bool = True) -> Counter:
+    """Check every text message of an export against TopicSettings, return counts per verdict"""
+    workers = workers or os.cpu_count() or 1
+    # Signatures use hash(), workers have to agree on its seed even when spawned
+    os.environ.setdefault('PYTHONHASHSEED', str(random.randrange(2**32)))
+    replay = Replay(settings, cooldown, duplicates)
+    counts = Counter()
+    writer = ReportWriter(output) if output else None
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(settings.hashtags, settings.min_price, settings.sale_hashtag)) as executor:
+            for item, reason, price, sig in _ordered_results(executor, iter_batches(path), duplicates, workers * 2):
+                verdict = replay.verdict(item, reason, sig)
+                counts[verdict] += 1
+                if writer is not None and not (removed_only and verdict == 'allowed'):
+                    writer.write((item[5], item[6], *item[:4], verdict, price, item[4]))
+    finally:
+        if writer is not None:
+            writer.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check a Telegram Desktop JSON export against the moderation rules without deleting anything')
+    parser.add_argument('export', help='result.json of a chat or full export')
+    parser.add_argument('--output', help='report file, .csv or .jsonl')
+    parser.add_argument('--rules-file', default=RULES_FILE, help='TOML or JSON rules file, as the bot uses')
+    parser.add_argument('--rules', default='',
+                        help='rule overrides as for /resale_topic, e.g. "min_price=5000 hashtags=#продам,#куплю"')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--removed-only', action='store_true', help='report only messages that would be removed')
+    parser.add_argument('--no-cooldown', action='store_true', help='skip the post limit per user')
+    parser.add_argument('--no-duplicates', action='store_true', help='skip near-duplicate detection')
+    args = parser.parse_args()
+    # Imported here so spawned workers don't load aiogram with the topics module
+    from ruleset import load_rules
+    try:
+        settings = load_rules(args.rules_file).defaults.with_args(args.rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    counts = audit(args.export, args.output, settings, args.workers, args.removed_only,
+                   not args.no_cooldown, not args.no_duplicates)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"{total:,} messages in {elapsed:.1f} s ({total / elapsed if elapsed else 0:,.0f}/s), rules: {settings}",
+          file=sys.stderr)
+    for verdict, count in counts.most_common():
+        print(f"{verdict:<10} {count:>10,}  {count / total:6.1%}")
+
+
+if __name__ == '__main__':
+    main()
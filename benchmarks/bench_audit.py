@@ -0,0 +1,78 @@
+"""
+Audit throughput and memory over a synthetic Telegram Desktop export.
+
+    python -m benchmarks.bench_audit [--messages 1000000] [--workers 1,2,4]
+
+Writes an export of --messages listings (about 450 bytes each, with
+service messages and entity-formatted texts mixed in) to a temporary
+directory, then audits it with each worker count. Memory is the peak RSS
+of the auditing process and of its largest worker; it should not grow with
+the size of the export.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from audit import audit
+from benchmarks.bench_rules import make_corpus
+from topics import TopicSettings
+
+
+def write_export(path: str, count: int, seed: int = 1):
+    rnd = random.Random(seed)
+    corpus = make_corpus(min(count, 50_000), seed)
+    date = 1_700_000_000
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{\n "name": "Барахолка",\n "type": "public_supergroup",\n "id": 1000000000,\n "messages": [\n')
+        for i in range(count):
+            date += rnd.randrange(1, 60)
+            user_id = rnd.randrange(20_000)
+            if i % 50 == 0:
+                message = {'id': i + 1, 'type': 'service', 'date_unixtime': str(date), 'actor': f"User {user_id}",
+                           'actor_id': f"user{user_id}", 'action': 'invite_members', 'text': ''}
+            else:
+                text = corpus[rnd.randrange(len(corpus))]
+                if i % 3 == 0:
+                    # Formatted messages are exported as a list of entities
+                    tag, _, rest = text.partition(' ')
+                    text = [{'type': 'hashtag', 'text': tag}, ' ' + rest] if tag.startswith('#') else text
+                message = {'id': i + 1, 'type': 'message', 'date': '2023-11-14T22:13:20',
+                           'date_unixtime': str(date), 'from': f"User {user_id}", 'from_id': f"user{user_id}",
+                           'reply_to_message_id': 7, 'text': text,
+                           'text_entities': [{'type': 'plain', 'text': text if isinstance(text, str) else ''}]}
+            f.write('  ' + json.dumps(message, ensure_ascii=False) + (',\n' if i < count - 1 else '\n'))
+        f.write(' ]\n}\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}",
+                        type=lambda value: sorted({int(item) for item in value.split(',')}))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-audit-') as tmp:
+        path = os.path.join(tmp, 'result.json')
+        started = time.perf_counter()
+        write_export(path, args.messages)
+        size = os.path.getsize(path)
+        print(f"export of {args.messages:,} messages, {size / 2**20:,.0f} MB, "
+              f"written in {time.perf_counter() - started:.1f} s, {os.cpu_count()} CPUs")
+        settings = TopicSettings()
+        for workers in args.workers:
+            started = time.perf_counter()
+            counts = audit(path, os.path.join(tmp, 'report.csv'), settings, workers, removed_only=True)
+            elapsed = time.perf_counter() - started
+            total = sum(counts.values())
+            own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            removed = ', '.join(f"{verdict} {count:,}" for verdict, count in counts.most_common() if verdict != 'allowed')
+            print(f"{workers:>2} workers  {total / elapsed:>9,.0f} messages/s  {elapsed:6.1f} s  "
+                  f"peak RSS {own:.0f} MB + worker {children:.0f} MB  removed: {removed}")
+
+
+if __name__ == '__main__':
+    main()
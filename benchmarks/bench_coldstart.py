@@ -0,0 +1,158 @@
+"""
+Cold start of the serverless entry point (api/index.py).
+
+    python -m benchmarks.bench_coldstart [--warm 50] [--budget-ms 15000]
+
+Starts benchmarks.fake_bot_api, then a fresh interpreter under
+`python -X importtime` that imports api.index, serves its handler on a
+local port and times:
+
+  import     importing api.index, what every cold start pays
+  health     the first GET, answered without loading the bot
+  first      the first update: heavy imports, Bot, Dispatcher and startup
+  warm       later updates on the same instance, p50 and max; a quarter
+             of them break the hashtag rule and are deleted with a notice
+
+The modules that took longest to import during the run are listed after.
+With --budget-ms the exit status is 1 when the first update takes longer,
+for use as a regression check.
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ADMIN_ID = 1  # benchmarks.fake_bot_api reports this user as an administrator
+CHAT_ID = -1001000000000
+THREAD_ID = 7
+
+
+def message_update(update_id: int, user_id: int, text: str, command: bool = False) -> dict:
+    message = {
+        'message_id': update_id, 'date': int(time.time()), 'message_thread_id': THREAD_ID, 'is_topic_message': True,
+        'chat': {'id': CHAT_ID, 'type': 'supergroup', 'title': 'Chat', 'is_forum': True},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"},
+        'text': text,
+    }
+    if command:
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def invoke(warm: int):
+    """Child process: import the entry point and time requests to it"""
+    started = time.perf_counter()
+    from api import index
+    import_ms = (time.perf_counter() - started) * 1000
+
+    from http.server import HTTPServer
+    import threading
+    server = HTTPServer(('127.0.0.1', 0), index.handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+    def request(method: str, body: dict = None) -> float:
+        started = time.perf_counter()
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'}
+        headers[index.SECRET_HEADER] = index.webhook_secret()
+        conn.request(method, '/webhook', payload, headers)
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        return (time.perf_counter() - started) * 1000
+
+    health_ms = request('GET')
+    first_ms = request('POST', message_update(1, ADMIN_ID, '/resale_topic', command=True))
+    # Every fourth listing lacks the hashtag and is deleted with a notice
+    warm_ms = sorted(request('POST', message_update(2 + i, 1000 + i, f"{'' if i % 4 == 0 else '#продам '}"
+                                                                   f"iPhone 13, ціна {5000 + i} грн"))
+                     for i in range(warm))
+    server.shutdown()
+    with urllib.request.urlopen(f"{os.environ['BOT_API_URL']}/stats") as response:
+        methods = json.load(response)['methods']
+    print(json.dumps({'import_ms': import_ms, 'health_ms': health_ms, 'first_ms': first_ms,
+                      'warm_p50_ms': statistics.median(warm_ms) if warm_ms else 0.0,
+                      'warm_max_ms': warm_ms[-1] if warm_ms else 0.0,
+                      'api_calls': {method: stats['calls'] for method, stats in methods.items()}}))
+
+
+def slowest_imports(stderr: str, count: int = 10) -> list:
+    """(module, cumulative ms) of the slowest top-level imports in -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def wait_for(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--warm', type=int, default=50, help='updates sent after the first one')
+    parser.add_argument('--budget-ms', type=float, help='fail when the first update takes longer')
+    parser.add_argument('--invoke', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.invoke:
+        invoke(args.warm)
+        return
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    api = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_bot_api', '--port', str(port)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        api_url = f"http://127.0.0.1:{port}"
+        wait_for(f"{api_url}/stats")
+        with tempfile.TemporaryDirectory(prefix='bench-coldstart-') as tmp:
+            env = {**os.environ, 'SERVERLESS': '1', 'BOT_TOKEN': '123456:COLDSTART', 'BOT_API_URL': api_url,
+                   'STATE_DB_PATH': os.path.join(tmp, 'state.db'), 'RULES_FILE': os.path.join(tmp, 'rules.toml')}
+            started = time.perf_counter()
+            child = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'benchmarks.bench_coldstart',
+                                    '--invoke', '--warm', str(args.warm)],
+                                   env=env, capture_output=True, text=True)
+            total_ms = (time.perf_counter() - started) * 1000
+    finally:
+        api.terminate()
+        api.wait()
+    if child.returncode != 0:
+        sys.exit(f"invocation failed:\n{child.stderr[-3000:]}")
+
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    print(f"import     {result['import_ms']:8.1f} ms")
+    print(f"health     {result['health_ms']:8.1f} ms")
+    print(f"first      {result['first_ms']:8.1f} ms")
+    print(f"warm       {result['warm_p50_ms']:8.1f} ms p50, {result['warm_max_ms']:.1f} ms max over {args.warm}")
+    print(f"process    {total_ms:8.1f} ms from spawn to exit")
+    print("api calls  " + ', '.join(f"{method} {calls}" for method, calls in result['api_calls'].items()))
+    print("slowest imports:")
+    for name, ms in slowest_imports(child.stderr):
+        print(f"  {name:<40} {ms:8.1f} ms")
+    if args.budget_ms is not None and result['first_ms'] > args.budget_ms:
+        sys.exit(f"first update took {result['first_ms']:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Update de-duplication overhead.
+
+    python -m benchmarks.bench_dedup [--updates 1000000] [--duplicates 0.05]
+
+Window: UpdateWindow.seen() on a stream of increasing update_ids with a
+share of redelivered ones, ns per update. Middleware: what
+UpdateDedupMiddleware adds to every update over calling the next handler
+directly, without and with a (memory) store for the handled mark, next to
+an empty middleware for the cost of the extra coroutine alone.
+"""
+import argparse
+import asyncio
+import random
+import time
+from aiogram import BaseMiddleware, Bot, types
+from dedup import UpdateDedupMiddleware, UpdateWindow
+from storage import MemoryStore
+
+TOKEN = '123456:BENCH'
+
+
+def update_stream(count: int, duplicates: float, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    ids = []
+    update_id = 100_000
+    for _ in range(count):
+        if ids and rnd.random() < duplicates:
+            # Redelivery of a recent update, as after a slow webhook answer
+            ids.append(ids[-rnd.randrange(1, min(len(ids), 100) + 1)])
+        else:
+            update_id += 1
+            ids.append(update_id)
+    return ids
+
+
+def bench_window(ids: list) -> tuple:
+    window = UpdateWindow()
+    seen = window.seen
+    started = time.perf_counter()
+    dropped = sum(1 for update_id in ids if seen(update_id))
+    return (time.perf_counter() - started) / len(ids) * 1e9, dropped
+
+
+class PassThrough(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        return await handler(event, data)
+
+
+async def bench_middleware(ids: list) -> tuple:
+    """ns per update added by an empty middleware and by UpdateDedupMiddleware without and with a store"""
+    data = {'bot': Bot(TOKEN)}
+    updates = [types.Update(update_id=update_id) for update_id in ids]
+
+    async def handler(event, data):
+        return None
+
+    async def timed(middleware) -> float:
+        started = time.perf_counter()
+        for update in updates:
+            await middleware(handler, update, data)
+        return (time.perf_counter() - started) / len(updates) * 1e9
+
+    direct = await timed(lambda handler, event, data: handler(event, data))
+    empty = await timed(PassThrough())
+    dedup = await timed(UpdateDedupMiddleware())
+    persisted = await timed(UpdateDedupMiddleware(store=MemoryStore()))
+    return empty - direct, dedup - direct, persisted - direct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=1_000_000)
+    parser.add_argument('--duplicates', type=float, default=0.05, help='share of redelivered updates')
+    args = parser.parse_args()
+
+    ids = update_stream(args.updates, args.duplicates)
+    ns, dropped = bench_window(ids)
+    print(f"window    {ns:6.0f} ns/update  {dropped:,} of {len(ids):,} dropped as duplicates")
+
+    # Without duplicates here, dropping one logs a record
+    empty, dedup, persisted = asyncio.run(bench_middleware(sorted(set(ids))))
+    print(f"middleware {dedup:5.0f} ns/update over calling the handler directly, {persisted:.0f} ns "
+          f"keeping the mark in a store; an empty middleware adds {empty:.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Near-duplicate lookup latency and memory at 10k, 100k and 1M stored signatures.
+
+    python -m benchmarks.bench_duplicates [--sizes 10000,100000,1000000] [--queries 2000]
+
+Each index is filled with signatures of distinct synthetic listings, then
+queried with edited reposts of indexed listings (hits) and with new
+listings (misses). "signature" is the per-message cost of computing a
+signature, "lookup" the cost of DuplicateIndex.find(). Memory is the
+traced allocation of the filled index.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from duplicates import DuplicateIndex, signature
+
+ITEMS = ('iPhone 13', 'PlayStation 5', 'Xbox Series X', 'MacBook Air M1', 'AirPods Pro', 'Samsung S22',
+         'велосипед Trek', 'монітор Dell', 'кросівки Nike', 'куртка North Face', 'GoPro Hero 10', 'Nintendo Switch')
+STATES = ('новий', 'б/у', 'в ідеальному стані', 'з коробкою', 'без подряпин', 'гарантія 6 місяців')
+CITIES = ('Київ', 'Львів', 'Одеса', 'Дніпро', 'Харків', 'Вінниця', 'доставка Новою поштою')
+WORDS = 'терміново торг можливий обмін фото в лс пишіть оригінал комплект чек повний відправка сьогодні'.split()
+
+
+def make_listing(rnd: random.Random) -> str:
+    extra = ' '.join(rnd.sample(WORDS, 3))
+    return (f"#продам {rnd.choice(ITEMS)} {rnd.choice(STATES)}, {rnd.choice(CITIES)}. "
+            f"Ціна {rnd.randrange(3000, 60000)} грн, {extra}, тел 0{rnd.randrange(10**8, 10**9)}")
+
+
+def edit(text: str, rnd: random.Random) -> str:
+    """Small edits resellers make when reposting: a changed word and punctuation"""
+    words = text.split()
+    words[rnd.randrange(1, len(words))] = rnd.choice(WORDS)
+    return ' '.join(words).replace(',', rnd.choice(('', ' ;', ' -'))) + rnd.choice(('', '!', ' 🔥'))
+
+
+def percentile(values: list, share: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * share))]
+
+
+def timed(call, items: list) -> list:
+    timings = []
+    for item in items:
+        started = time.perf_counter()
+        call(item)
+        timings.append((time.perf_counter() - started) * 1e6)
+    return timings
+
+
+def bench(size: int, queries: int, rnd: random.Random) -> dict:
+    listings = [make_listing(rnd) for _ in range(min(size, 20_000))]
+    signatures = [signature(text) for text in listings]
+    tracemalloc.start()
+    index = DuplicateIndex(max_entries=size, window=10**9)
+    for i in range(size):
+        # Past the synthetic listings the fill continues with random signatures,
+        # which spread over the buckets like signatures of unrelated texts
+        sig = signatures[i] if i < len(signatures) else rnd.randbytes(len(signatures[0]))
+        index.add(sig, i, i, now=0)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    reposts = [signature(edit(listings[rnd.randrange(len(listings))], rnd)) for _ in range(queries)]
+    fresh = [signature(make_listing(rnd)) for _ in range(queries)]
+    hit_timings = timed(lambda sig: index.find(sig, now=1), reposts)
+    miss_timings = timed(lambda sig: index.find(sig, now=1), fresh)
+    found = sum(index.find(sig, now=1) is not None for sig in reposts)
+    false_positives = sum(index.find(sig, now=1) is not None for sig in fresh)
+    sig_timings = timed(signature, listings[:queries])
+    return {
+        'memory_mb': memory / 2**20,
+        'bytes_per_entry': memory / size,
+        'signature_us': percentile(sig_timings, 0.5),
+        'hit_p50_us': percentile(hit_timings, 0.5),
+        'hit_p99_us': percentile(hit_timings, 0.99),
+        'miss_p50_us': percentile(miss_timings, 0.5),
+        'miss_p99_us': percentile(miss_timings, 0.99),
+        'detected': found / queries,
+        'false_positives': false_positives / queries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        type=lambda value: [int(item) for item in value.split(',')])
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+    rnd = random.Random(1)
+    for size in args.sizes:
+        r = bench(size, args.queries, rnd)
+        print(f"{size:>9,} signatures  {r['memory_mb']:7.1f} MB ({r['bytes_per_entry']:.0f} B each)  "
+              f"signature {r['signature_us']:5.1f} us  "
+              f"lookup hit p50 {r['hit_p50_us']:5.1f} / p99 {r['hit_p99_us']:5.1f} us  "
+              f"miss p50 {r['miss_p50_us']:5.1f} / p99 {r['miss_p99_us']:5.1f} us  "
+              f"detected {r['detected']:.1%}  false positives {r['false_positives']:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Logging overhead per moderated message.
+
+    python -m benchmarks.bench_logging [--updates 100000] [--deleted-share 0.3]
+
+Replays the log calls the resale handler makes per message against a log
+file in a temporary directory:
+  before   f-strings, synchronous StreamHandler, every message logged twice
+  queue    the same lines through the QueueHandler/QueueListener pipeline
+  after    queue, %-style, one structured line per message with the
+           configured sampling and rate limits
+  json     as after, written as JSON lines
+"on loop" is the time spent in logging calls, i.e. what the event loop pays;
+"total" also includes writing out the queue on the listener thread.
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from config import LOG_SAMPLING, LOG_RATE_LIMITS
+from logger import setup_logger, stop_logger
+
+
+def make_messages(count: int, deleted_share: float, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    return [(-1001000000000 - rnd.randrange(20), 7, 1000 + rnd.randrange(5000), i,
+             'price' if rnd.random() < deleted_share else 'allowed') for i in range(count)]
+
+
+def log_before(logger: logging.Logger, messages: list):
+    for chat_id, thread_id, user_id, message_id, verdict in messages:
+        logger.info(f"Processing message in resale topic: user_id={user_id}, message_id={message_id}")
+        if verdict != 'allowed':
+            logger.info(f"Message deleted - {verdict}: user_id={user_id}, message_id={message_id}")
+
+
+def log_after(logger: logging.Logger, messages: list):
+    for chat_id, thread_id, user_id, message_id, verdict in messages:
+        started = time.perf_counter()
+        logger.debug("Processing message in resale topic: user_id=%s, message_id=%s", user_id, message_id)
+        logger.info("Message %s: user_id=%s, message_id=%s", verdict, user_id, message_id, extra={
+            'event': 'message_allowed' if verdict == 'allowed' else 'message_deleted',
+            'chat_id': chat_id,
+            'thread_id': thread_id,
+            'user_id': user_id,
+            'verdict': verdict,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+def measure(name: str, directory: str, log, messages: list, **options) -> dict:
+    path = os.path.join(directory, f"{name}.log")
+    with open(path, 'w', encoding='utf-8') as stream:
+        logger = setup_logger(f"bench.{name}", stream=stream, **options)
+        started = time.perf_counter()
+        log(logger, messages)
+        on_loop = time.perf_counter() - started
+        stop_logger(f"bench.{name}")
+        total = time.perf_counter() - started
+    with open(path, encoding='utf-8') as f:
+        lines = sum(1 for _ in f)
+    return {'on_loop_us': on_loop / len(messages) * 1e6, 'total_us': total / len(messages) * 1e6, 'lines': lines}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=100_000)
+    parser.add_argument('--deleted-share', type=float, default=0.3)
+    args = parser.parse_args()
+
+    messages = make_messages(args.updates, args.deleted_share)
+    limits = {'sampling': LOG_SAMPLING, 'rate_limits': LOG_RATE_LIMITS}
+    unlimited = {'sampling': None, 'rate_limits': None}
+    with tempfile.TemporaryDirectory(prefix='bench-logging-') as tmp:
+        results = {
+            'before': measure('before', tmp, log_before, messages, use_queue=False, json_lines=False, **unlimited),
+            'queue': measure('queue', tmp, log_before, messages, use_queue=True, json_lines=False, **unlimited),
+            'after': measure('after', tmp, log_after, messages, use_queue=True, json_lines=False, **limits),
+            'json': measure('json', tmp, log_after, messages, use_queue=True, json_lines=True, **limits),
+        }
+    print(f"{args.updates:,} messages, {args.deleted_share:.0%} deleted")
+    for name, result in results.items():
+        print(f"{name:<8} on loop {result['on_loop_us']:6.2f} us/update  "
+              f"total {result['total_us']:6.2f} us/update  lines {result['lines']:>7,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the hashtag/price rule check.
+
+Compares the compiled RuleEngine with the previous per-message logic
+(repeated lowercasing, substring hashtag checks and the old extract_price).
+
+    python -m benchmarks.bench_rules [--messages 50000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import time
+from config import REQUIRED_HASHTAGS, MIN_PRICE
+from rules import RuleEngine, extract_price
+
+ITEMS = ['iPhone 13 128GB', 'кросівки Nike Air Max 42р', 'PlayStation 5', 'велосипед Trek',
+         'куртка The North Face M', 'MacBook Air M1', 'коляска Cybex', 'AirPods Pro 2']
+PRICES = ['3000', '3 000 грн', '3к', '3.5k', '3,500', '2500 грн', '15 000₴', '800', '1,5к', '5 тис']
+CONTACTS = ['', 'тел +380 67 123 45 67', 'пишіть в ПП', '067 123 45 67', 'Київ, самовивіз']
+TAGS = ['#продам', '#куплю', '#ПРОДАМ', '#обмін', '']
+
+
+def make_corpus(size: int, seed: int = 42) -> list:
+    """Generate listing-like messages with a realistic mix of formats"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        parts = [rnd.choice(TAGS), rnd.choice(ITEMS), 'стан ідеальний' if rnd.random() < 0.5 else '',
+                 f"ціна {rnd.choice(PRICES)}", rnd.choice(CONTACTS)]
+        if rnd.random() < 0.2:
+            parts.append('Торг доречний. Відправка Новою Поштою по всій Україні, оплата при отриманні.')
+        rnd.shuffle(parts[1:])
+        corpus.append(' '.join(part for part in parts if part))
+    return corpus
+
+
+def legacy_extract_price(text: str) -> int:
+    """extract_price as it was before the rule engine"""
+    text = text.lower().replace(' ', '')
+    k_match = re.search(r'(\d+)[kкК]', text)
+    if k_match:
+        return int(k_match.group(1)) * 1000
+    price_match = re.search(r'(\d+)(?:грн|uah)?', text)
+    if price_match:
+        return int(price_match.group(1))
+    return 0
+
+
+def legacy_check(text: str):
+    """Hashtag and price checks as they were done in handle_resale_message"""
+    if not any(tag.lower() in text.lower() for tag in REQUIRED_HASHTAGS):
+        return 'hashtags'
+    if '#продам' in text.lower():
+        if legacy_extract_price(text) < MIN_PRICE:
+            return 'price'
+    return None
+
+
+def measure(func, corpus: list, repeat: int) -> float:
+    """Best messages/sec over several runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return len(corpus) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    engine = RuleEngine()
+
+    results = {
+        'legacy extract_price': measure(legacy_extract_price, corpus, args.repeat),
+        'extract_price': measure(extract_price, corpus, args.repeat),
+        'legacy full check': measure(legacy_check, corpus, args.repeat),
+        'RuleEngine.check': measure(engine.check, corpus, args.repeat),
+    }
+    for name, rate in results.items():
+        print(f"{name:<22} {rate:>12,.0f} msg/s")
+
+    disagreements = sum(1 for text in corpus if legacy_check(text) != engine.check(text).reason)
+    # Differences come from misparses fixed by the tokenizer (phones, merged digits, "3 000")
+    print(f"verdicts differing from legacy: {disagreements}/{len(corpus)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Bot API session benchmark: request latency and connections opened per
+1,000 API calls, with and without connection pooling.
+
+    python -m benchmarks.bench_session [--calls 1000] [--concurrency 1,20] [--latency-ms 20]
+
+Calls go to benchmarks.fake_bot_api over plain HTTP, so connection setup
+is only a TCP handshake on the loopback; against api.telegram.org every
+new connection also costs a DNS lookup and a TLS handshake of several
+round trips, which pooling saves as well. Sessions compared:
+
+  fresh      a new session per call, as a cold serverless invocation pays
+  no-reuse   one session whose connector closes every connection
+  pooled     TunedSession with keep-alive and the retry middleware
+
+--error-rate answers that share of calls with 429 retry_after=1; the
+pooled session retries them, the others report them as failed.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from session import TunedSession, api_server  # noqa: E402
+
+TOKEN = '123456:BENCH'
+
+
+class FreshSession(AiohttpSession):
+    """Closes without the 250 ms grace period aiogram waits for TLS connections"""
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+async def measure(name: str, api: FakeBotAPI, url: str, calls: int, concurrency: int) -> dict:
+    api.reset()
+    latencies = []
+    failed = 0
+    shared = None
+    if name == 'pooled':
+        shared = Bot(TOKEN, session=TunedSession(api=api_server(url)))
+    elif name == 'no-reuse':
+        session = AiohttpSession(api=api_server(url))
+        session._connector_init['force_close'] = True
+        shared = Bot(TOKEN, session=session)
+
+    async def call(index: int):
+        nonlocal failed
+        bot = shared or Bot(TOKEN, session=FreshSession(api=api_server(url)))
+        started = time.perf_counter()
+        try:
+            await bot.delete_message(chat_id=-1001000000000, message_id=index + 1)
+        except Exception:
+            failed += 1
+        latencies.append(time.perf_counter() - started)
+        if shared is None:
+            await bot.session.close()
+
+    async def client(indexes: range):
+        for index in indexes:
+            await call(index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(range(i, calls, concurrency)) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    if shared is not None:
+        await shared.session.close()
+    latencies.sort()
+    return {
+        'calls_per_s': calls / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'connections_per_1k': api.connections * 1000 / calls,
+        'failed': failed,
+    }
+
+
+async def run(args):
+    api = FakeBotAPI(args.latency_ms / 1000, error_rate=args.error_rate, seed=1)
+    url = await api.start()
+    try:
+        for concurrency in args.concurrency:
+            print(f"{args.calls:,} deleteMessage calls, concurrency {concurrency}, "
+                  f"{args.latency_ms:g} ms API latency")
+            for name in ('fresh', 'no-reuse', 'pooled'):
+                result = await measure(name, api, url, args.calls, concurrency)
+                print(f"  {name:<9} {result['calls_per_s']:>8,.0f} calls/s  p50 {result['p50_ms']:6.2f} ms  "
+                      f"p99 {result['p99_ms']:7.2f} ms  {result['connections_per_1k']:6.0f} connections/1k  "
+                      f"failed {result['failed']}")
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--concurrency', default='1,20', type=lambda value: [int(item) for item in value.split(',')])
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with 429')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Sharded mode scaling: updates/s with 1..N worker processes.
+
+    python -m benchmarks.bench_sharding [--workers 1,2,4] [--updates 50000] [--chats 200]
+
+The fake Bot API runs in its own process. Generated updates are dispatched
+in getUpdates-sized batches of 100 and the clock stops once every worker
+has processed its share; worker start-up is not measured.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('BOT_TOKEN', '123456:SHARDING')
+os.environ['METRICS_PORT'] = '0'
+
+from aiohttp import ClientSession  # noqa: E402
+from benchmarks.loadtest import generate_updates  # noqa: E402
+from sharding import ShardCoordinator  # noqa: E402
+
+BATCH = 100
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_api(url: str):
+    async with ClientSession() as session:
+        for _ in range(300):
+            try:
+                async with session.get(f"{url}/stats"):
+                    return
+            except OSError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError('fake Bot API did not start')
+
+
+async def measure(workers: int, updates: list, api_url: str) -> dict:
+    # Fresh state per run, inherited by the spawned workers
+    os.environ['STATE_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bench-sharding-'), 'state.db')
+    coordinator = ShardCoordinator(workers, api_url)
+    await coordinator.start()
+    started = time.perf_counter()
+    for i in range(0, len(updates), BATCH):
+        await coordinator.dispatch(updates[i:i + BATCH])
+    processed = await coordinator.drain()
+    elapsed = time.perf_counter() - started
+    await coordinator.join()
+    return {'elapsed_s': elapsed, 'throughput_ups': len(updates) / elapsed, 'per_worker': processed}
+
+
+async def run(args):
+    updates = list(generate_updates(args.updates, args.chats, args.users))
+    port = free_port()
+    api_url = f"http://127.0.0.1:{port}"
+    api = subprocess.Popen([sys.executable, '-m', 'benchmarks.fake_bot_api', '--port', str(port),
+                            '--latency-ms', str(args.latency_ms)])
+    try:
+        await wait_for_api(api_url)
+        baseline = None
+        for workers in args.workers:
+            result = await measure(workers, updates, api_url)
+            baseline = baseline or result['throughput_ups']
+            shares = ', '.join(str(result['per_worker'][index]) for index in sorted(result['per_worker']))
+            print(f"{workers:>2} workers  {result['throughput_ups']:>9,.0f} updates/s  "
+                  f"x{result['throughput_ups'] / baseline:.2f}  per worker [{shares}]")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default=f"1,2,{os.cpu_count() or 1}",
+                        type=lambda value: sorted({int(item) for item in value.split(',')}))
+    parser.add_argument('--updates', type=int, default=50_000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"{args.updates:,} updates in {args.chats} chats, {os.cpu_count()} CPUs")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
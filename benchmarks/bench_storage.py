@@ -0,0 +1,140 @@
+"""
+State store benchmark: write throughput and restart-to-ready time.
+
+    python -m benchmarks.bench_storage [--records 1000000] [--writes 200000]
+
+Writes: time spent in put() on the event loop (what a handler pays) and
+the time until the write-behind buffer is committed, compared with one
+commit per write. Restart: a database holding --records rate limiter
+entries is reopened; "ready" is the point where topics and pending
+deletions are loaded and updates can be handled, the rate limiter entries
+are then restored in the background while the loop lag is sampled.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from rate_limiter import NAMESPACE as RATE_NAMESPACE, RateLimiter
+from scheduler import DeletionScheduler
+from storage import SqliteStore
+from topics import TopicRegistry, TopicSettings
+
+
+async def bench_writes(path: str, writes: int, batch_size: int) -> dict:
+    store = SqliteStore(path, flush_interval=1, batch_size=batch_size)
+    await store.start()
+    now = time.time()
+    started = time.perf_counter()
+    for i in range(writes):
+        store.put(RATE_NAMESPACE, f"-100{i % 50}:7:{i}", [now])
+        if i % 1000 == 999:
+            # Give the writer task a chance to run, as handlers would
+            await asyncio.sleep(0)
+    put_elapsed = time.perf_counter() - started
+    await store.stop()
+    total_elapsed = time.perf_counter() - started
+    return {'put_us': put_elapsed / writes * 1e6, 'committed_per_s': writes / total_elapsed}
+
+
+def bench_commit_per_write(path: str, writes: int) -> float:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('CREATE TABLE state (namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                 'PRIMARY KEY (namespace, key)) WITHOUT ROWID')
+    value = json.dumps([time.time()])
+    started = time.perf_counter()
+    for i in range(writes):
+        conn.execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)', (RATE_NAMESPACE, f"-100{i % 50}:7:{i}", value))
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return writes / elapsed
+
+
+def populate(path: str, records: int, topics: int = 50):
+    store = SqliteStore(path)
+    store.open()
+    conn = store._writer
+    now = time.time()
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO state VALUES (?, ?, ?)', (
+        (RATE_NAMESPACE, f"-100{i % topics}:7:{i}", json.dumps([now - 60, now - 30]))
+        for i in range(records)
+    ))
+    conn.executemany('INSERT INTO state VALUES (?, ?, ?)', (
+        ('topics', f"-100{i}:7", json.dumps(TopicSettings().to_dict())) for i in range(topics)
+    ))
+    conn.executemany('INSERT INTO state VALUES (?, ?, ?)', (
+        ('deletions', f"-100{i % topics}:{i}", now + 10) for i in range(1000)
+    ))
+    conn.execute('COMMIT')
+    conn.close()
+    store._reader.close()
+
+
+async def bench_restart(path: str, records: int) -> dict:
+    started = time.perf_counter()
+    store = SqliteStore(path)
+    await store.start()
+    registry = TopicRegistry(store)
+    registry.load()
+    scheduler = DeletionScheduler(store)
+    scheduler.load()
+    ready = time.perf_counter() - started
+
+    limiter = RateLimiter(max_keys=records, store=store)
+    max_lag = 0.0
+
+    async def probe():
+        nonlocal max_lag
+        while True:
+            tick = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - tick - 0.001)
+
+    probe_task = asyncio.create_task(probe())
+    restore_started = time.perf_counter()
+    await limiter.restore()
+    restored = time.perf_counter() - restore_started
+    probe_task.cancel()
+    await store.stop()
+    return {
+        'ready_ms': ready * 1000,
+        'topics': len(registry),
+        'deletions': len(scheduler),
+        'restore_s': restored,
+        'restored': len(limiter),
+        'max_loop_lag_ms': max_lag * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1_000_000)
+    parser.add_argument('--writes', type=int, default=200_000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-storage-') as tmp:
+        writes = asyncio.run(bench_writes(os.path.join(tmp, 'writes.db'), args.writes, args.batch_size))
+        direct = bench_commit_per_write(os.path.join(tmp, 'direct.db'), min(args.writes, 20_000))
+        print(f"put() on the loop      {writes['put_us']:.2f} us/write")
+        print(f"write-behind commits   {writes['committed_per_s']:,.0f} writes/s")
+        print(f"commit per write       {direct:,.0f} writes/s")
+
+        path = os.path.join(tmp, 'restart.db')
+        started = time.perf_counter()
+        populate(path, args.records)
+        print(f"populated {args.records:,} records in {time.perf_counter() - started:.1f} s")
+        restart = asyncio.run(bench_restart(path, args.records))
+        print(f"ready after            {restart['ready_ms']:.1f} ms "
+              f"({restart['topics']} topics, {restart['deletions']} pending deletions)")
+        print(f"background restore     {restart['restore_s']:.2f} s for {restart['restored']:,} entries, "
+              f"max loop lag {restart['max_loop_lag_ms']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
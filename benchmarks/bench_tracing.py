@@ -0,0 +1,122 @@
+"""
+Per-update tracing overhead.
+
+    python -m benchmarks.bench_tracing [--updates 100000]
+
+Span: entering and leaving tracing.span() outside of an update, where it
+is a no-op, and inside one, ns per span. Middleware: TracingMiddleware
+around an empty handler, the trace and the slowest-updates buffer.
+Dispatcher: feed_update of a plain message to a handler opening three
+spans, the way handle_resale_message does, on a Dispatcher without and
+with setup_tracing(), ns per update.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from aiogram import Bot, Dispatcher, Router, types
+from tracing import SlowestTraces, Trace, TracingMiddleware, activate, deactivate, setup_tracing, span
+
+TOKEN = '123456:BENCH'
+SPANS = 100_000
+ROUND = 500  # updates per alternating dispatcher round
+
+
+def bench_span() -> tuple:
+    """ns per span without and with a current trace"""
+    started = time.perf_counter()
+    for _ in range(SPANS):
+        with span('rules.check'):
+            pass
+    idle = (time.perf_counter() - started) / SPANS * 1e9
+
+    trace = Trace(types.Update(update_id=1))
+    token = activate(trace)
+    started = time.perf_counter()
+    for _ in range(SPANS):
+        with span('rules.check'):
+            pass
+    traced = (time.perf_counter() - started) / SPANS * 1e9
+    deactivate(token)
+    return idle, traced
+
+
+def dispatcher(traced: bool) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def handle(message: types.Message):
+        with span('admin_check'):
+            pass
+        with span('rules.check'):
+            pass
+        with span('duplicates.check'):
+            pass
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    if traced:
+        setup_tracing(dp, enabled=True)
+    return dp
+
+
+def fastest(rounds: list) -> float:
+    """Median of the fastest quarter of rounds"""
+    return statistics.median(sorted(rounds)[:len(rounds) // 4 + 1])
+
+
+async def bench_dispatcher(count: int) -> tuple:
+    bot = Bot(TOKEN)
+    updates = [types.Update.model_validate({'update_id': i, 'message': {
+        'message_id': i, 'date': 0, 'chat': {'id': -100, 'type': 'supergroup'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'User'}, 'text': 'iPhone 13, ціна 5000 грн'}})
+        for i in range(count)]
+
+    async def timed(dp: Dispatcher, batch: list) -> float:
+        started = time.perf_counter()
+        for update in batch:
+            await dp.feed_update(bot, update)
+        return (time.perf_counter() - started) / len(batch) * 1e9
+
+    plain, traced = dispatcher(False), dispatcher(True)
+    # Short alternating rounds: the difference is a few percent, well below
+    # the drift of a shared machine over a long run
+    results = {False: [], True: []}
+    for start in range(0, count, ROUND):
+        batch = updates[start:start + ROUND]
+        results[False].append(await timed(plain, batch))
+        results[True].append(await timed(traced, batch))
+    await bot.session.close()
+    return fastest(results[False]), fastest(results[True])
+
+
+async def bench_buffer(count: int) -> float:
+    """ns per update spent keeping the slowest ones"""
+    buffer = SlowestTraces()
+    middleware = TracingMiddleware(buffer)
+
+    async def handler(event, data):
+        return None
+
+    updates = [types.Update(update_id=i) for i in range(count)]
+    started = time.perf_counter()
+    for update in updates:
+        await middleware(handler, update, {})
+    return (time.perf_counter() - started) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=100_000)
+    args = parser.parse_args()
+
+    idle, traced = bench_span()
+    print(f"span        {idle:6.0f} ns outside of an update, {traced:.0f} ns inside one")
+    print(f"middleware  {asyncio.run(bench_buffer(args.updates)):6.0f} ns/update for the trace and the slowest buffer")
+    plain, traced = asyncio.run(bench_dispatcher(args.updates))
+    print(f"dispatcher  {plain:6.0f} ns/update untraced, {traced:.0f} ns traced "
+          f"(+{traced - plain:.0f} ns, {100 * (traced - plain) / plain:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Local stand-in for the Telegram Bot API.
+
+Answers the methods the bot uses with plausible payloads, records the
+number and handling time of calls per method and can inject latency and
+429 "Too Many Requests" responses.
+
+    python -m benchmarks.fake_bot_api [--port 8081] [--latency-ms 50] [--error-rate 0.01]
+
+Point a Bot at it with
+    AiohttpSession(api=TelegramAPIServer.from_base('http://127.0.0.1:8081'))
+GET /stats returns the recorded counters as JSON, POST /stats/reset clears them.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import defaultdict
+from aiohttp import web
+
+# Users with these ids are reported as chat administrators
+ADMIN_IDS = (1,)
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+class MethodStats:
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_ms': self.total_time / self.calls * 1000 if self.calls else 0.0,
+            'max_ms': self.max_time * 1000,
+        }
+
+
+class FakeBotAPI:
+    """aiohttp application emulating the Bot API methods used by the bot"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.stats = defaultdict(MethodStats)
+        # Client (host, port) pairs seen, one per TCP connection
+        self._peers = set()
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1_000_000)
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle_method)
+        self.app.router.add_get('/stats', self.handle_stats)
+        self.app.router.add_post('/stats/reset', self.handle_reset)
+
+    @property
+    def connections(self) -> int:
+        return len(self._peers)
+
+    def reset(self):
+        self.stats.clear()
+        self._peers.clear()
+
+    def summary(self) -> dict:
+        return {method: stats.as_dict() for method, stats in sorted(self.stats.items())}
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'methods': self.summary(), 'connections': self.connections})
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({'ok': True})
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        started = time.perf_counter()
+        method = request.match_info['method'].lower()
+        if request.transport is not None:
+            self._peers.add(request.transport.get_extra_info('peername'))
+        params = dict(await request.post())
+        stats = self.stats[method]
+        stats.calls += 1
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            stats.errors += 1
+            response = web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        else:
+            response = web.json_response({'ok': True, 'result': self.result(method, params)})
+
+        elapsed = time.perf_counter() - started
+        stats.total_time += elapsed
+        if elapsed > stats.max_time:
+            stats.max_time = elapsed
+        return response
+
+    def result(self, method: str, params: dict):
+        """Build a minimal valid result for the called method"""
+        if method == 'getme':
+            return {**_user(42), 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method == 'getchatmember':
+            user_id = int(params.get('user_id', 0))
+            status = 'administrator' if user_id in ADMIN_IDS else 'member'
+            member = {'status': status, 'user': _user(user_id)}
+            if status == 'administrator':
+                member.update(can_be_edited=False, is_anonymous=False, can_manage_chat=True,
+                              can_delete_messages=True, can_manage_video_chats=True,
+                              can_restrict_members=True, can_promote_members=False,
+                              can_change_info=True, can_invite_users=True,
+                              can_post_stories=False, can_edit_stories=False, can_delete_stories=False)
+            return member
+        if method == 'getchatadministrators':
+            return [{'status': 'creator', 'user': _user(user_id), 'is_anonymous': False}
+                    for user_id in ADMIN_IDS]
+        if method in ('sendmessage', 'editmessagetext'):
+            chat_id = int(params.get('chat_id', 0))
+            message = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Fake chat'},
+                'from': {**_user(42), 'is_bot': True},
+                'text': params.get('text', ''),
+            }
+            if params.get('message_thread_id'):
+                message['message_thread_id'] = int(params['message_thread_id'])
+            if params.get('reply_parameters'):
+                reply_to = json.loads(params['reply_parameters']).get('message_id')
+                message['reply_to_message'] = {'message_id': reply_to, 'date': int(time.time()),
+                                               'chat': message['chat']}
+            return message
+        if method == 'getupdates':
+            return []
+        # deleteMessage, deleteMessages, setWebhook, deleteWebhook and friends
+        return True
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Start serving in the current event loop, return the base URL"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets
+        port = sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with 429')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+    web.run_app(api.app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
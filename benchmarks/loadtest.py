@@ -0,0 +1,244 @@
+"""
+Offline load test: replay Update objects through the Dispatcher from main.py.
+
+Updates are read from a JSONL file (one Update per line, as returned by
+getUpdates) or generated, and fed with dp.feed_update at a fixed rate.
+The Bot talks to benchmarks.fake_bot_api, so no request reaches Telegram.
+
+    python -m benchmarks.loadtest --generate 20000 --chats 20 --rate 2000 --latency-ms 30
+    python -m benchmarks.loadtest --updates recorded.jsonl --rate 0
+    python -m benchmarks.loadtest --generate 20000 --rate 0 --pipeline
+    python -m benchmarks.loadtest --generate 5000 --save synthetic.jsonl
+    python -m benchmarks.loadtest --generate 5000 --join-share 0.5  # join raid
+
+--rate 0 feeds updates as fast as possible. Pass --api-url to use an already
+running fake API (python -m benchmarks.fake_bot_api) instead of an in-process one.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# main.py builds its Bot at import time, the token only has to look valid
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+# Keep state of the run out of the working directory
+os.environ.setdefault('STATE_DB_PATH', os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'state.db'))
+
+from aiohttp import ClientSession  # noqa: E402
+from aiogram import types  # noqa: E402
+from benchmarks.bench_rules import make_corpus  # noqa: E402
+from benchmarks.fake_bot_api import ADMIN_IDS, FakeBotAPI  # noqa: E402
+from session import TunedSession, api_server  # noqa: E402
+
+THREAD_ID = 7
+
+
+def generate_updates(count: int, chats: int = 10, users: int = 1000, join_share: float = 0.02, seed: int = 1):
+    """Yield synthetic updates: /resale_topic per chat first, then listings and joins"""
+    rnd = random.Random(seed)
+    corpus = make_corpus(min(count, 10_000), seed)
+    now = int(time.time())
+    update_id = 0
+    message_id = 0
+
+    def message(chat_id: int, user_id: int, **fields) -> dict:
+        nonlocal update_id, message_id
+        update_id += 1
+        message_id += 1
+        return {'update_id': update_id, 'message': {
+            'message_id': message_id,
+            'date': now,
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Chat {chat_id}", 'is_forum': True},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"},
+            **fields,
+        }}
+
+    chat_ids = [-1001000000000 - i for i in range(chats)]
+    for chat_id in chat_ids:
+        yield message(chat_id, ADMIN_IDS[0], text='/resale_topic', message_thread_id=THREAD_ID,
+                      is_topic_message=True, entities=[{'type': 'bot_command', 'offset': 0, 'length': 13}])
+
+    for i in range(max(0, count - chats)):
+        chat_id = rnd.choice(chat_ids)
+        user_id = 1000 + rnd.randrange(users)
+        if rnd.random() < join_share:
+            member = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+            yield message(chat_id, user_id, new_chat_members=[member])
+        else:
+            yield message(chat_id, user_id, text=corpus[i % len(corpus)], message_thread_id=THREAD_ID,
+                          is_topic_message=True)
+
+
+def read_updates(path: str):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def run(args, updates: list) -> dict:
+    import main
+    from pipeline import ChatLanes, update_chat_id
+
+    api = None
+    api_url = args.api_url
+    if not api_url:
+        api = FakeBotAPI(args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, seed=1)
+        api_url = await api.start()
+
+    bot = main.bot
+    await bot.session.close()
+    bot.session = TunedSession(api=api_server(api_url))
+    await main.dp.emit_startup(bot=bot)
+
+    latencies = []
+    peak_tasks = 0
+    interval = 1 / args.rate if args.rate else 0.0
+
+    async def feed(data: dict, started: float = None):
+        started = time.perf_counter() if started is None else started
+        try:
+            update = types.Update.model_validate(data, context={'bot': bot})
+            await main.dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"update {data.get('update_id')} failed: {e}", file=sys.stderr)
+        latencies.append(time.perf_counter() - started)
+
+    async def monitor():
+        nonlocal peak_tasks
+        while True:
+            peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.01)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    monitor_task = asyncio.create_task(monitor())
+    tasks = set()
+    # With --pipeline updates go through per-chat lanes like main.py polling,
+    # latency includes the wait in the lane
+    lanes = ChatLanes(lambda item: feed(*item)) if args.pipeline else None
+    started = time.perf_counter()
+    for i, data in enumerate(updates):
+        if interval:
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if lanes is not None:
+            # Backpressure: polling would not fetch more while the lanes are full
+            await lanes.wait_for_room()
+            lanes.submit(update_chat_id(data), (data, time.perf_counter()))
+        else:
+            task = asyncio.create_task(feed(data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if not interval and i % 100 == 99:
+            # Let handlers make progress when feeding without a rate limit
+            await asyncio.sleep(0)
+    while tasks:
+        await asyncio.gather(*tasks)
+    if lanes is not None:
+        await lanes.join()
+    elapsed = time.perf_counter() - started
+    monitor_task.cancel()
+    peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    tracemalloc.stop()
+
+    await main.dp.emit_shutdown(bot=bot)
+    if api is not None:
+        api_stats = {'methods': api.summary(), 'connections': api.connections}
+        await api.stop()
+    else:
+        async with ClientSession() as session:
+            async with session.get(f"{api_url}/stats") as response:
+                api_stats = await response.json()
+    await bot.session.close()
+
+    latencies.sort()
+    return {
+        'updates': len(updates),
+        'elapsed_s': elapsed,
+        'throughput_ups': len(updates) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'mean': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            'max': latencies[-1] * 1000 if latencies else 0.0,
+        },
+        'peak_tasks': peak_tasks,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_traced_mb': peak_traced / 1e6 if peak_traced is not None else None,
+        'api': api_stats,
+    }
+
+
+def print_report(report: dict):
+    latency = report['latency_ms']
+    print(f"updates        {report['updates']}")
+    print(f"elapsed        {report['elapsed_s']:.2f} s")
+    print(f"throughput     {report['throughput_ups']:,.0f} updates/s")
+    print(f"latency        p50 {latency['p50']:.2f} ms  p95 {latency['p95']:.2f} ms  "
+          f"p99 {latency['p99']:.2f} ms  max {latency['max']:.2f} ms")
+    print(f"peak tasks     {report['peak_tasks']}")
+    print(f"peak RSS       {report['peak_rss_mb']:.1f} MB")
+    if report['peak_traced_mb'] is not None:
+        print(f"peak traced    {report['peak_traced_mb']:.1f} MB")
+    print(f"api conns      {report['api'].get('connections')}")
+    for method, stats in report['api']['methods'].items():
+        print(f"  {method:<24} calls {stats['calls']:>7}  429s {stats['errors']:>5}  "
+              f"avg {stats['avg_ms']:.2f} ms  max {stats['max_ms']:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--updates', help='JSONL file with one Update per line')
+    source.add_argument('--generate', type=int, help='number of synthetic updates')
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--join-share', type=float, default=0.02, help='share of generated updates that are joins')
+    parser.add_argument('--save', help='write the generated updates to this JSONL file and exit')
+    parser.add_argument('--rate', type=float, default=1000, help='updates/s, 0 for unlimited')
+    parser.add_argument('--pipeline', action='store_true', help='feed through per-chat lanes with backpressure')
+    parser.add_argument('--api-url', help='use an external fake Bot API instead of an in-process one')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of API calls answered with 429')
+    parser.add_argument('--tracemalloc', action='store_true', help='report peak Python heap (slower)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    if args.updates:
+        updates = list(read_updates(args.updates))
+    else:
+        updates = list(generate_updates(args.generate, args.chats, args.users, args.join_share))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            for data in updates:
+                f.write(json.dumps(data, ensure_ascii=False) + '\n')
+        print(f"saved {len(updates)} updates to {args.save}")
+        return
+
+    report = asyncio.run(run(args, updates))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,70 @@
 import os
 import logging
+from dotenv import load_dotenv
 
-# Bot configuration
-BOT_TOKEN = os.getenv('BOT_TOKEN', 'your-bot-token-here')
+# Load environment variables from .env
+load_dotenv()
 
-# Message templates
+# Bot configuration (TELEGRAM_TOKEN is the name used by the Vercel deployment)
+BOT_TOKEN = os.getenv('BOT_TOKEN') or os.getenv('TELEGRAM_TOKEN', 'your-bot-token-here')
+
+# Webhook mode (bot.py)
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL') or (f"https://{os.getenv('VERCEL_URL')}" if os.getenv('VERCEL_URL') else None)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # random per process if not set, derived from the token in serverless mode
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', 3000))
+WEBHOOK_QUEUE_SIZE = 1000  # updates waiting for a worker
+WEBHOOK_WORKERS = 8
+WEBHOOK_DROP_POLICY = 'drop_oldest'  # when the queue is full: drop_oldest, drop_new or reject
+
+# Serverless mode (api/index.py), on by default on Vercel. Instances are frozen between
+# invocations, so there are no background threads and queued work finishes before the response.
+SERVERLESS = os.getenv('SERVERLESS', '1' if os.getenv('VERCEL') else '').lower() in ('1', 'true', 'yes')
+SERVERLESS_DRAIN_TIMEOUT = 8  # seconds an invocation waits for queued sends and deletes
+
+# Bot API HTTP session (session.py)
+BOT_API_URL = os.getenv('BOT_API_URL')  # self-hosted Bot API server, e.g. http://127.0.0.1:8081
+BOT_API_LOCAL = os.getenv('BOT_API_LOCAL', '').lower() in ('1', 'true', 'yes')  # the server runs with --local
+SESSION_POOL_SIZE = int(os.getenv('SESSION_POOL_SIZE', '100'))  # open connections to the Bot API
+SESSION_KEEPALIVE = 60  # seconds an idle connection is kept for reuse
+SESSION_DNS_TTL = 3600  # seconds resolved addresses are cached
+SESSION_TIMEOUT = 30  # seconds, for methods not in SESSION_METHOD_TIMEOUTS
+SESSION_METHOD_TIMEOUTS = {
+    'deleteMessage': 10,
+    'deleteMessages': 15,
+    'getChatMember': 10,
+    'getChatAdministrators': 10,
+    'sendMessage': 15,
+}
+SESSION_MAX_RETRIES = 2
+SESSION_BACKOFF = 0.3  # seconds, doubled on every retry, with jitter
+SESSION_MAX_RETRY_AFTER = 5  # seconds, longer flood waits are left to the caller
+
+# Message templates, defaults when not set in RULES_FILE
 WELCOME_MESSAGE = """👋 Вітаємо, {username}! Ознайомтеся з правилами, щоб уникнути непорозумінь. Приємного спілкування!"""
 
+# Violation notices as (single user, several users) templates. Notices of the
+# same kind in one topic are merged, {usernames} lists everyone affected.
+NOTICE_TEMPLATES = {
+    'cooldown': (
+        "{usernames}, ви перевищили ліміт повідомлень у цій гілці: {max_messages} за {cooldown_minutes} хв.",
+        "{usernames}, ви перевищили ліміт повідомлень у цій гілці: {max_messages} за {cooldown_minutes} хв.",
+    ),
+    'hashtags': (
+        "{usernames}, ваше повідомлення було видалено, оскільки воно не містить необхідних хештегів {hashtags}.",
+        "{usernames}, ваші повідомлення було видалено, оскільки вони не містять необхідних хештегів {hashtags}.",
+    ),
+    'price': (
+        "{usernames}, ваше повідомлення було видалено. Мінімальна ціна для продажу - {min_price} грн.",
+        "{usernames}, ваші повідомлення було видалено. Мінімальна ціна для продажу - {min_price} грн.",
+    ),
+    'duplicate': (
+        "{usernames}, ваше повідомлення було видалено, оскільки таке оголошення вже опубліковано в цій гілці.",
+        "{usernames}, ваші повідомлення було видалено, оскільки такі оголошення вже опубліковано в цій гілці.",
+    ),
+}
+
 RULES_TEXT = """
 📜 Правила групи:
 1. Поважайте інших учасників
@@ -16,14 +74,112 @@ RULES_TEXT = """
 5. Заборонено спам та рекламу
 """
 
-# Topic monitoring
+# Rules file (TOML or JSON) overriding the topic defaults and message templates, reloaded on change
+RULES_FILE = os.getenv('RULES_FILE', 'rules.toml')
+RULES_RELOAD_INTERVAL = 0 if SERVERLESS else 5  # seconds between checks of the file, 0 to only reload with /reload_rules
+
+# Topic monitoring, defaults when not set in RULES_FILE
 REQUIRED_HASHTAGS = ['#продам', '#куплю']
+SALE_HASHTAG = '#продам'  # Posts with this tag must meet MIN_PRICE
 MIN_PRICE = 3000  # Minimum price in UAH
 MESSAGE_COOLDOWN_MINUTES = 60
 MAX_MESSAGES_BEFORE_COOLDOWN = 3
 NOTIFICATION_DELETE_DELAY = 10  # seconds
 WELCOME_MESSAGE_DELETE_DELAY = 15  # seconds
+RATE_LIMIT_MAX_KEYS = 200_000  # (chat, topic, user) entries kept in memory
+
+# Joins (joins.py)
+JOIN_COALESCE_WINDOW = 5  # seconds joins of one chat are collected into one welcome
+JOIN_RAID_THRESHOLD = 20  # joins per minute that switch a chat to raid mode
+JOIN_RAID_COOLDOWN = 300  # seconds without welcomes after the last burst of a raid
+JOIN_MAX_CHATS = 10000  # chats with recent joins kept in memory
+
+# Near-duplicate listings (duplicates.py)
+DUPLICATE_ACTION = os.getenv('DUPLICATE_ACTION', 'flag')  # 'flag' (log only), 'delete' or 'off'
+DUPLICATE_THRESHOLD = 0.7  # estimated Jaccard similarity of text shingles
+DUPLICATE_WINDOW_HOURS = 24  # how long a listing is remembered
+DUPLICATE_MAX_ENTRIES = 5000  # listings remembered per topic, ~1 KB each
+DUPLICATE_MIN_LENGTH = 30  # shorter texts (after normalization) are not compared
+
+# Deferred deletions
+DELETE_BATCH_SIZE = 100  # deleteMessages accepts up to 100 ids per call
+DELETE_RETRY_BACKOFF = 5  # seconds before a failed batch is retried, doubled on every retry
+DELETE_MAX_RETRIES = 5
+
+# Persistent state: 'sqlite' or 'memory'
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', '/tmp/state.db' if SERVERLESS else 'state.db')  # /tmp is the only writable path on Vercel
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '1'))  # seconds between batched commits
+STATE_BATCH_SIZE = int(os.getenv('STATE_BATCH_SIZE', '5000'))  # buffered changes that trigger an early commit
+STATE_SYNCHRONOUS = os.getenv('STATE_SYNCHRONOUS', 'NORMAL')  # NORMAL fsyncs on WAL checkpoints, FULL on every commit
+
+# Outbound requests (Telegram allows ~30 messages/s overall and ~20/min per group)
+OUTBOUND_GLOBAL_RATE = 30  # messages per second
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_DELETE_RATE = 30  # deletes per second, a budget of their own so they don't hold back messages
+OUTBOUND_DELETE_BURST = 30
+OUTBOUND_CHAT_RATE = 20 / 60  # messages per second in one chat
+OUTBOUND_CHAT_BURST = 5
+OUTBOUND_WORKERS = 4  # concurrent API requests
+OUTBOUND_MAX_RETRIES = 3
+OUTBOUND_BACKOFF = 0.5  # seconds, doubled on every retry
+OUTBOUND_MAX_CHATS = 10000  # per-chat buckets kept in memory
+NOTICE_COALESCE_WINDOW = 5  # seconds notices of one kind are collected per topic
+NOTICE_MAX_USERNAMES = 10  # usernames listed in one notice
+
+# Admin status cache
+ADMIN_CACHE_TTL = 300  # seconds
+ADMIN_CACHE_MAX_CHATS = 1000
+ADMIN_CACHE_FAILURE_TTL = 60  # seconds a chat whose admin list failed to load goes straight to getChatMember
+
+# Update processing (pipeline.py): per-chat lanes with a global handler limit
+PIPELINE_CONCURRENCY = int(os.getenv('PIPELINE_CONCURRENCY', '64'))  # handlers running at once
+PIPELINE_MAX_PENDING = 1000  # queued updates that pause getUpdates
+PIPELINE_MAX_LANE_DEPTH = 100  # queued updates of one chat that pause getUpdates
+
+# Update de-duplication (dedup.py)
+DEDUP_WINDOW = 10000  # recent update_ids remembered per bot
+DEDUP_PERSIST = os.getenv('DEDUP_PERSIST', '1').lower() in ('1', 'true', 'yes')  # keep the handled update_id mark in the state store
+
+# Sharded mode (sharding.py)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', os.cpu_count() or 1))  # worker processes
+SHARD_REPLICAS = 100  # points per worker on the hash ring
+SHARD_INBOX_SIZE = 10  # update batches queued per worker before polling pauses
+
+# Metrics endpoint, METRICS_PORT=0 keeps metrics in memory without serving them
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0' if SERVERLESS else '1').lower() in ('1', 'true', 'yes')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9110'))
+METRICS_LOOP_LAG_INTERVAL = 0.5  # seconds between event loop lag samples
+
+# Per-update tracing (tracing.py) and on-demand profiling (profiling.py)
+# User ids allowed to run /profile, /traces and /reload_rules, comma separated; chat admins are
+# not enough, the commands see or change the whole process. Empty disables these commands.
+BOT_ADMIN_IDS = frozenset(int(user_id) for user_id in os.getenv('BOT_ADMIN_IDS', '').replace(',', ' ').split())
+TRACE_ENABLED = os.getenv('TRACE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+TRACE_SLOWEST = int(os.getenv('TRACE_SLOWEST', '50'))  # slowest updates kept with their span trees
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles' if SERVERLESS else 'profiles')  # where reports are written
+PROFILE_DEFAULT_SECONDS = 30  # profiling run started by SIGUSR1 or a bare /profile
+PROFILE_MAX_SECONDS = 600
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples in 'sample' mode
 
 # Logging configuration
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-LOG_LEVEL = logging.INFO
\ No newline at end of file
+LOG_LEVEL = logging.INFO
+LOG_JSON = os.getenv('LOG_JSON', '').lower() in ('1', 'true', 'yes')  # JSON lines instead of LOG_FORMAT
+LOG_QUEUE = not SERVERLESS  # write log records on a background thread
+# Share of records kept per event type
+LOG_SAMPLING = {
+    'message_allowed': 0.1,
+    'admin_message': 0.1,
+}
+# Records per second kept per event type
+LOG_RATE_LIMITS = {
+    'message_deleted': 20,
+    'member_joined': 10,
+    'raid_started': 5,
+    'duplicate_found': 10,
+    'outbound_failed': 10,
+    'update_dropped': 5,
+    'update_duplicate': 5,
+}
\ No newline at end of file
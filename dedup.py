@@ -0,0 +1,152 @@
+from heapq import heappop, heappush
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from config import DEDUP_WINDOW, DEDUP_PERSIST
+from logger import logger
+from metrics import metrics
+from storage import StateStore, state_store
+
+NAMESPACE = 'updates'
+
+
+class UpdateWindow:
+    """
+    The last `size` update_ids seen, in a ring buffer with a set for lookups.
+    `floor` is the handled mark of a previous run: ids up to `size` below it
+    were handled and count as seen.
+
+    Updates of different chats finish out of order, so `handled` is a
+    contiguous mark: just below the lowest unfinished update, or the latest
+    finished one while none is unfinished.
+    """
+    __slots__ = ('size', 'floor', 'handled', 'latest', '_ring', '_ids', '_pos', '_unfinished', '_heap')
+
+    def __init__(self, size: int = DEDUP_WINDOW, floor: int = None):
+        self.size = size
+        self.floor = floor
+        self.handled = self.latest = floor if floor is not None else -1
+        self._ring = [None] * size
+        self._ids = set()
+        self._pos = 0
+        self._unfinished = {}  # update_id -> times started and not finished
+        self._heap = []  # unfinished update_ids, finished ones removed lazily
+
+    def __len__(self):
+        return len(self._ids)
+
+    def seen(self, update_id: int) -> bool:
+        """Whether the update was seen before, remembering it if not"""
+        ids = self._ids
+        if update_id in ids:
+            return True
+        floor = self.floor
+        if floor is not None and floor - self.size < update_id <= floor:
+            return True
+        pos = self._pos
+        oldest = self._ring[pos]
+        if oldest is not None:
+            ids.discard(oldest)
+        self._ring[pos] = update_id
+        ids.add(update_id)
+        pos += 1
+        self._pos = pos if pos < self.size else 0
+        return False
+
+    def begin(self, update_id: int):
+        """Hold the handled mark below the update until finish()"""
+        count = self._unfinished.get(update_id, 0)
+        if not count:
+            heappush(self._heap, update_id)
+        self._unfinished[update_id] = count + 1
+
+    def finish(self, update_id: int) -> bool:
+        """Release an update begun before, return whether the handled mark moved"""
+        unfinished = self._unfinished
+        count = unfinished.pop(update_id) - 1
+        if count:
+            unfinished[update_id] = count
+        latest = self.latest
+        # update_ids restart from a random value after a week without updates
+        if update_id > latest or update_id <= latest - self.size:
+            self.latest = latest = update_id
+        heap = self._heap
+        while heap and heap[0] not in unfinished:
+            heappop(heap)
+        mark = min(latest, heap[0] - 1) if heap else latest
+        if mark == self.handled:
+            return False
+        self.handled = mark
+        return True
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """
+    Outer update middleware dropping updates Telegram delivers again, after
+    a slow webhook answer or a polling restart, before any handler or API
+    call runs. With a store the handled mark of each bot is kept across
+    restarts; updates queued before they reach the middleware hold it back
+    once announced with expect().
+    """
+
+    def __init__(self, size: int = DEDUP_WINDOW, store: StateStore = None):
+        self.size = size
+        self.store = store
+        self._windows = {}  # bot token -> (UpdateWindow, store key)
+        self._expected = {}  # bot token -> update_ids begun by expect() and not fed yet
+
+    async def _open(self, bot) -> tuple:
+        key = str(bot.id)
+        floor = await self.store.fetch(NAMESPACE, key) if self.store is not None else None
+        # Another update of the bot may have opened it meanwhile
+        return self._windows.setdefault(bot.token, (UpdateWindow(self.size, floor), key))
+
+    async def expect(self, bot, update_ids: list):
+        """Announce received updates that wait in a queue, so handled ones after them don't pass them in the mark"""
+        if self.store is None:
+            return
+        window, _ = self._windows.get(bot.token) or await self._open(bot)
+        expected = self._expected.setdefault(bot.token, set())
+        for update_id in update_ids:
+            if update_id not in expected:
+                expected.add(update_id)
+                window.begin(update_id)
+
+    def _finish(self, window: UpdateWindow, key: str, update_id: int):
+        if window.finish(update_id):
+            self.store.put(NAMESPACE, key, window.handled)
+
+    async def __call__(self, handler, event, data):
+        bot = data['bot']
+        window, key = self._windows.get(bot.token) or await self._open(bot)
+        update_id = event.update_id
+        if self.store is not None:
+            expected = self._expected.get(bot.token)
+            if expected and update_id in expected:
+                expected.discard(update_id)
+            else:
+                window.begin(update_id)
+        if window.seen(update_id):
+            metrics.updates_duplicate.inc()
+            logger.info("Dropped duplicate update %s", update_id, extra={'event': 'update_duplicate'})
+            if self.store is not None:
+                self._finish(window, key, update_id)
+            return UNHANDLED
+        if self.store is None:
+            return await handler(event, data)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            # Failed updates are not retried either; cancelled ones keep holding the mark and are, after a restart
+            self._finish(window, key, update_id)
+            raise
+        self._finish(window, key, update_id)
+        return result
+
+
+def setup_dedup(dp: Dispatcher, persist: bool = DEDUP_PERSIST) -> UpdateDedupMiddleware:
+    """Drop redelivered updates in front of every other middleware of the dispatcher"""
+    middleware = UpdateDedupMiddleware(store=state_store if persist else None)
+    dp.update.outer_middleware(middleware)
+    # Found by the polling pipeline to announce queued updates
+    dp['update_dedup'] = middleware
+    return middleware
@@ -0,0 +1,175 @@
+import re
+import time
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+from config import (
+    DUPLICATE_THRESHOLD, DUPLICATE_WINDOW_HOURS, DUPLICATE_MAX_ENTRIES, DUPLICATE_MIN_LENGTH
+)
+
+# Signature layout: BINS one-permutation MinHash values split into BANDS bands of
+# ROWS values. Two posts become candidates when any band matches, which happens
+# with probability 1 - (1 - s^ROWS)^BANDS for Jaccard similarity s
+# (~0.89 at s=0.7, ~0.06 at s=0.3).
+BINS = 32
+BANDS = 8
+ROWS = BINS // BANDS
+SHINGLE = 5  # characters per shingle
+
+_BIN_BITS = BINS.bit_length() - 1
+_BIN_MASK = BINS - 1
+_VALUE_MASK = 0xFFFFFFFF
+_EMPTY = _VALUE_MASK + 1
+_BAND_BYTES = ROWS * array('I').itemsize
+
+# Hashtags are shared by every listing and say nothing about its content
+_NOISE_RE = re.compile(r'#\w+|[\W_]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase text without hashtags, punctuation and repeated whitespace"""
+    return ' '.join(_NOISE_RE.sub(' ', text.lower()).split())
+
+
+def signature(text: str) -> bytes:
+    """
+    One-permutation MinHash of the character shingles of text: each shingle
+    hash goes to one of BINS bins, each bin keeps its minimum. Empty bins
+    borrow from the next filled one. Returns None for texts too short to compare.
+    """
+    text = normalize(text)
+    if len(text) < DUPLICATE_MIN_LENGTH:
+        return None
+    mins = [_EMPTY] * BINS
+    for i in range(len(text) - SHINGLE + 1):
+        value = hash(text[i:i + SHINGLE])
+        index = value & _BIN_MASK
+        value = (value >> _BIN_BITS) & _VALUE_MASK
+        if value < mins[index]:
+            mins[index] = value
+    for index in range(BINS):
+        if mins[index] == _EMPTY:
+            for step in range(1, BINS):
+                donor = mins[(index + step) % BINS]
+                if donor != _EMPTY:
+                    # Offset by distance so borrowed values differ from the donor bin
+                    mins[index] = (donor + step * 0x9E3779B1) & _VALUE_MASK
+                    break
+    return array('I', mins).tobytes()
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    first = array('I', first)
+    second = array('I', second)
+    return sum(a == b for a, b in zip(first, second)) / BINS
+
+
+class Match(NamedTuple):
+    """Earlier listing a post duplicates"""
+    similarity: float
+    user_id: int
+    message_id: int
+
+
+class DuplicateIndex:
+    """
+    LSH index of recent listing signatures for one topic. Holds at most
+    max_entries signatures no older than window seconds; each band bucket
+    remembers only the newest entry that landed in it.
+    """
+
+    def __init__(self, max_entries: int = DUPLICATE_MAX_ENTRIES,
+                 window: float = DUPLICATE_WINDOW_HOURS * 3600, threshold: float = DUPLICATE_THRESHOLD):
+        self.max_entries = max_entries
+        self.window = window
+        self.threshold = threshold
+        # entry id -> (added_at, signature, user_id, message_id), oldest first
+        self._entries = OrderedDict()
+        self._buckets = [{} for _ in range(BANDS)]
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(sig: bytes):
+        for band in range(BANDS):
+            yield hash(sig[band * _BAND_BYTES:(band + 1) * _BAND_BYTES])
+
+    def _evict(self):
+        entry_id, (_, sig, _, _) = self._entries.popitem(last=False)
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            if bucket.get(key) == entry_id:
+                del bucket[key]
+
+    def expire(self, now: float = None):
+        """Drop entries older than the window"""
+        cutoff = (time.monotonic() if now is None else now) - self.window
+        entries = self._entries
+        while entries and next(iter(entries.values()))[0] <= cutoff:
+            self._evict()
+
+    def find(self, sig: bytes, now: float = None) -> Match:
+        """Most similar indexed listing at or above the threshold, None if there is none"""
+        cutoff = (time.monotonic() if now is None else now) - self.window
+        best = None
+        checked = set()
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            entry_id = bucket.get(key)
+            if entry_id is None or entry_id in checked:
+                continue
+            checked.add(entry_id)
+            added_at, other, user_id, message_id = self._entries[entry_id]
+            if added_at <= cutoff:
+                continue
+            score = similarity(sig, other)
+            if score >= self.threshold and (best is None or score > best.similarity):
+                best = Match(score, user_id, message_id)
+        return best
+
+    def add(self, sig: bytes, user_id: int, message_id: int, now: float = None):
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (now, sig, user_id, message_id)
+        for bucket, key in zip(self._buckets, self._band_keys(sig)):
+            bucket[key] = entry_id
+        if len(self._entries) > self.max_entries:
+            self._evict()
+
+
+class DuplicateDetector:
+    """Near-duplicate listing detection with one index per (chat_id, thread_id)"""
+
+    def __init__(self, max_entries: int = DUPLICATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._indexes = {}
+
+    def __len__(self):
+        return sum(len(index) for index in self._indexes.values())
+
+    def check(self, chat_id: int, thread_id: int, text: str, user_id: int, message_id: int) -> Match:
+        """
+        Return the earlier listing this one duplicates. Unique listings are
+        added to the index, duplicates are not.
+        """
+        sig = signature(text)
+        if sig is None:
+            return None
+        index = self._indexes.get((chat_id, thread_id))
+        if index is None:
+            index = self._indexes[(chat_id, thread_id)] = DuplicateIndex(self.max_entries)
+        match = index.find(sig)
+        if match is None:
+            index.add(sig, user_id, message_id)
+        return match
+
+    def forget(self, chat_id: int, thread_id: int):
+        """Drop the index of a topic"""
+        self._indexes.pop((chat_id, thread_id), None)
+
+
+# Shared detector instance
+duplicate_detector = DuplicateDetector()
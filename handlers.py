@@ -1,2 +1,365 @@
-# This file is deprecated.
-# All handler functionality has been moved to main.py using aiogram implementation.
\ No newline at end of file
+import asyncio
+import logging
+import time
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.filters import Command, CommandObject, CommandStart
+from config import (
+    NOTIFICATION_DELETE_DELAY, DUPLICATE_ACTION, DEDUP_PERSIST, METRICS_PORT, PROFILE_DEFAULT_SECONDS, BOT_ADMIN_IDS
+)
+from logger import logger
+from admin_cache import admin_cache
+from scheduler import deletion_scheduler
+from outbound import outbound
+from rate_limiter import rate_limiter
+from topics import ModeratedTopic, TopicSettings, topic_registry
+from rules import REASON_COOLDOWN, REASON_DUPLICATE
+from duplicates import duplicate_detector
+from joins import join_coalescer
+from ruleset import rulebook
+from storage import state_store
+from metrics import metrics, setup_metrics
+from dedup import setup_dedup
+from tracing import setup_tracing, slowest_traces, span
+from profiling import dump_traces, install_signal_handlers, profiler
+
+# Handlers shared by every entry point: polling (main.py), webhook (bot.py), sharded and serverless
+router = Router(name='moderation')
+
+@router.message(CommandStart())
+async def start_command(message: types.Message):
+    """Handle /start command"""
+    outbound.send(message.chat.id, "Привіт! Я бот для модерації чату.", reply_to=message.message_id)
+
+@router.message(Command(commands=['resale_topic']))
+async def set_resale_topic(message: types.Message, command: CommandObject):
+    """Set topic for monitoring resale messages"""
+
+    try:
+        logger.info("Processing /resale_topic command from user %s", message.from_user.id)
+
+        # Get topic ID from command message
+        if not message.message_thread_id:
+            logger.info("Command used outside of topic")
+            outbound.send(
+                message.chat.id,
+                "Будь ласка, використовуйте цю команду в темі, яку хочете модерувати.",
+                reply_to=message.message_id,
+                delete_after=NOTIFICATION_DELETE_DELAY
+            )
+            outbound.delete(message.chat.id, message.message_id)
+            return
+
+        # Check admin rights
+        is_admin = await admin_cache.is_admin(message.bot, message.chat.id, message.from_user.id)
+        logger.info("User is admin: %s", is_admin)
+
+        # Delete command message first
+        outbound.delete(message.chat.id, message.message_id)
+
+        if not is_admin:
+            logger.info("Non-admin user attempted to use /resale_topic command")
+            outbound.send(
+                message.chat.id,
+                "❌ Ця команда доступна тільки адміністраторам.",
+                message.message_thread_id,
+                delete_after=NOTIFICATION_DELETE_DELAY
+            )
+            return
+
+        # Optional per-topic overrides of the rules file, e.g. "/resale_topic min_price=5000 cooldown=30"
+        overrides = topic_registry.overrides(message.chat.id, message.message_thread_id)
+        try:
+            overrides.update(TopicSettings.parse_args(command.args))
+            settings = topic_registry.set(message.chat.id, message.message_thread_id, overrides)
+        except ValueError as e:
+            logger.info("Invalid /resale_topic arguments: %s", e)
+            outbound.send(
+                message.chat.id,
+                f"❌ Невірні параметри: {e}",
+                message.message_thread_id,
+                delete_after=NOTIFICATION_DELETE_DELAY
+            )
+            return
+
+        logger.info("Admin user set resale topic: chat_id=%s, thread_id=%s, settings=%s",
+                    message.chat.id, message.message_thread_id, settings)
+
+        # Send success notification for admins
+        outbound.send(
+            message.chat.id,
+            "✅ Бот тепер контролює цю гілку на відповідність правилам.",
+            message.message_thread_id,
+            delete_after=NOTIFICATION_DELETE_DELAY
+        )
+
+        logger.info("Moderated topics: %s", len(topic_registry))
+    except Exception as e:
+        logger.error("Error setting resale topic: %s", e)
+        try:
+            outbound.send(
+                message.chat.id,
+                "Виникла помилка при встановленні теми для модерації.",
+                message.message_thread_id,
+                delete_after=NOTIFICATION_DELETE_DELAY
+            )
+        except Exception as inner_e:
+            logger.error("Error sending error notification: %s", inner_e)
+
+def describe_changes(changes: list) -> str:
+    """Human readable list of rule changes, long texts are only named"""
+    lines = []
+    for name, old, new in changes:
+        if isinstance(new, str) and (len(new) > 40 or '\n' in new):
+            lines.append(f"• {name}: змінено")
+        else:
+            lines.append(f"• {name}: {old} → {new}")
+    return '\n'.join(lines)
+
+def is_operator(message: types.Message, command: str) -> bool:
+    """
+    Whether the sender is an operator of the bot, listed in BOT_ADMIN_IDS, telling them if not.
+    For commands acting on the whole bot rather than one chat: an admin of one group
+    must not see or change the others.
+    """
+    if message.from_user.id in BOT_ADMIN_IDS:
+        return True
+    logger.info("User %s not in BOT_ADMIN_IDS attempted to use /%s command", message.from_user.id, command)
+    outbound.send(
+        message.chat.id,
+        "❌ Ця команда доступна тільки операторам бота.",
+        message.message_thread_id,
+        delete_after=NOTIFICATION_DELETE_DELAY
+    )
+    return False
+
+@router.message(Command(commands=['reload_rules']))
+async def reload_rules(message: types.Message):
+    """Reload the rules file and report what changed"""
+    try:
+        outbound.delete(message.chat.id, message.message_id)
+        # The rules file holds the defaults of every moderated chat
+        if not is_operator(message, 'reload_rules'):
+            return
+
+        try:
+            changes = rulebook.reload()
+        except ValueError as e:
+            logger.error("Rules reload requested by %s failed: %s", message.from_user.id, e)
+            text = f"❌ Правила не оновлено, діють попередні: {e}"
+        else:
+            logger.info("Rules reloaded by %s, %s changes", message.from_user.id, len(changes))
+            text = f"✅ Правила оновлено:\n{describe_changes(changes)}" if changes else "Правила не змінилися."
+        outbound.send(message.chat.id, text, message.message_thread_id, delete_after=NOTIFICATION_DELETE_DELAY)
+    except Exception as e:
+        logger.error("Error reloading rules: %s", e)
+
+# Longest /traces reply, Telegram cuts messages at 4096 characters
+TRACES_REPLY_LIMIT = 4000
+
+@router.message(Command(commands=['profile']))
+async def profile_command(message: types.Message, command: CommandObject):
+    """Profile the bot for a few seconds, e.g. "/profile 60 sample", and report where the file is"""
+    try:
+        outbound.delete(message.chat.id, message.message_id)
+        if not is_operator(message, 'profile'):
+            return
+
+        args = (command.args or '').split()
+        try:
+            seconds = float(args[0]) if args else PROFILE_DEFAULT_SECONDS
+            mode = args[1] if len(args) > 1 else 'cprofile'
+            run = profiler.start(seconds, mode)
+        except (ValueError, RuntimeError) as e:
+            outbound.send(message.chat.id, f"❌ Профілювання не запущено: {e}", message.message_thread_id,
+                          delete_after=NOTIFICATION_DELETE_DELAY)
+            return
+        logger.info("Profiling (%s, %s s) started by %s", mode, seconds, message.from_user.id)
+        outbound.send(message.chat.id, f"⏱ Профілювання ({mode}) на {seconds:g} с…", message.message_thread_id,
+                      delete_after=NOTIFICATION_DELETE_DELAY)
+
+        # The handler doesn't wait, updates of this chat would queue up behind it
+        def report(task):
+            if task.cancelled():
+                return
+            error = task.exception()
+            text = f"❌ Профілювання не вдалося: {error}" if error else f"✅ Звіт профілювання: {task.result()}"
+            outbound.send(message.chat.id, text, message.message_thread_id, delete_after=NOTIFICATION_DELETE_DELAY)
+        run.add_done_callback(report)
+    except Exception as e:
+        logger.error("Error starting profiling: %s", e)
+
+@router.message(Command(commands=['traces']))
+async def traces_command(message: types.Message, command: CommandObject):
+    """Show the slowest recent updates with their spans, all of them are written to a file"""
+    try:
+        outbound.delete(message.chat.id, message.message_id)
+        if not is_operator(message, 'traces'):
+            return
+
+        if not len(slowest_traces):
+            outbound.send(message.chat.id, "Трейсів ще немає.", message.message_thread_id,
+                          delete_after=NOTIFICATION_DELETE_DELAY)
+            return
+        count = int(command.args) if command.args and command.args.strip().isdigit() else 3
+        # Written on a thread like the profiler reports, from a snapshot taken here
+        path = await asyncio.to_thread(dump_traces, slowest_traces.slowest())
+        text = '\n\n'.join(trace.render() for trace in slowest_traces.slowest(count))
+        if len(text) > TRACES_REPLY_LIMIT:
+            text = text[:TRACES_REPLY_LIMIT] + '…'
+        outbound.send(message.chat.id, f"{text}\n\nУсі {len(slowest_traces)}: {path}", message.message_thread_id,
+                      delete_after=NOTIFICATION_DELETE_DELAY)
+    except Exception as e:
+        logger.error("Error reporting traces: %s", e)
+
+@router.message(lambda message: message.new_chat_members is not None)
+async def handle_new_member(message: types.Message):
+    """Welcome new members, one welcome per chat for all joins of a short window"""
+    try:
+        usernames = []
+        anonymous = 0
+        for new_member in message.new_chat_members:
+            if new_member.is_bot:
+                continue
+            if new_member.username:
+                usernames.append(f"@{new_member.username}")
+            else:
+                anonymous += 1
+            logger.info("New member joined: %s", new_member.id,
+                        extra={'event': 'member_joined', 'chat_id': message.chat.id, 'user_id': new_member.id})
+
+        # The system message about users joining is deleted with the others of the window
+        join_coalescer.add(message.chat.id, message.message_thread_id, message.message_id, usernames, anonymous)
+    except Exception as e:
+        logger.error("Error handling new member: %s", e)
+
+# Log event of each verdict, violations are 'message_deleted'
+VERDICT_EVENTS = {'allowed': 'message_allowed', 'admin': 'admin_message'}
+
+def log_verdict(message: types.Message, verdict: str, started: float):
+    """One structured line per moderated message, sampled or rate limited by event type"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info("Message %s: user_id=%s, message_id=%s", verdict, message.from_user.id, message.message_id, extra={
+        'event': VERDICT_EVENTS.get(verdict, 'message_deleted'),
+        'chat_id': message.chat.id,
+        'thread_id': message.message_thread_id,
+        'user_id': message.from_user.id,
+        'verdict': verdict,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 3),
+    })
+
+@router.message(ModeratedTopic())
+async def handle_resale_message(message: types.Message, topic: TopicSettings):
+    """Handle messages in resale topic"""
+    started = time.perf_counter()
+    try:
+        # Skip admin messages
+        with span('admin_check'):
+            is_admin = await admin_cache.is_admin(message.bot, message.chat.id, message.from_user.id)
+        if is_admin:
+            log_verdict(message, 'admin', started)
+            return
+
+        user_id = message.from_user.id
+        rate_key = (message.chat.id, message.message_thread_id, user_id)
+
+        logger.debug("Processing message in resale topic: user_id=%s, message_id=%s", user_id, message.message_id)
+
+        # Allow topic.max_messages posts per topic.cooldown_minutes window
+        if rate_limiter.hit(rate_key, topic.max_messages, topic.cooldown_seconds):
+            # Check hashtag and minimum price rules in a single pass
+            with span('rules.check'):
+                verdict = topic.rules.check(message.text)
+            reason = verdict.reason
+            if verdict.allowed and DUPLICATE_ACTION != 'off':
+                # Reposts of a recent listing, usually slightly edited and from another account
+                with span('duplicates.check'):
+                    match = duplicate_detector.check(message.chat.id, message.message_thread_id, message.text,
+                                                     user_id, message.message_id)
+                if match is not None:
+                    logger.info("Near-duplicate of message %s by user %s (similarity %.2f): message_id=%s",
+                                match.message_id, match.user_id, match.similarity, message.message_id, extra={
+                                    'event': 'duplicate_found',
+                                    'chat_id': message.chat.id,
+                                    'user_id': user_id,
+                                    'original_message_id': match.message_id,
+                                    'original_user_id': match.user_id,
+                                })
+                    if DUPLICATE_ACTION == 'delete':
+                        reason = REASON_DUPLICATE
+                    else:
+                        metrics.duplicates_flagged.inc()
+            if reason is None:
+                log_verdict(message, 'allowed', started)
+                return
+            # Deleted messages don't count towards the limit
+            rate_limiter.refund(rate_key)
+        else:
+            reason = REASON_COOLDOWN
+
+        outbound.delete(message.chat.id, message.message_id)
+        metrics.deletions.inc(reason)
+        log_verdict(message, reason, started)
+
+        # Users removed for the same reason in this topic share one notice
+        username = f"@{message.from_user.username}" if message.from_user.username else "користувач"
+        outbound.notify(
+            message.chat.id,
+            message.message_thread_id,
+            reason,
+            username,
+            **topic.notice_params
+        )
+
+    except Exception as e:
+        logger.error("Error handling resale message: %s, user_id=%s",
+                     e, message.from_user.id if message.from_user else 'unknown')
+
+@router.chat_member()
+async def handle_chat_member_update(update: types.ChatMemberUpdated):
+    """Keep the cached admin list in step with promotions and demotions, plain joins and leaves don't touch it"""
+    admin_cache.member_updated(update.chat.id, update.new_chat_member.user.id,
+                               update.old_chat_member.status, update.new_chat_member.status)
+
+@router.my_chat_member()
+async def handle_my_chat_member_update(update: types.ChatMemberUpdated):
+    """Invalidate cached admin list when the bot's own membership changes"""
+    admin_cache.invalidate(update.chat.id)
+
+@router.startup()
+async def on_startup(bot: Bot, owns_chat=None):
+    """
+    Load persisted state and start background services.
+    In sharded mode owns_chat(chat_id) tells which chats this process handles.
+    """
+    await state_store.start()
+    # Rules come first, topics are built on their defaults
+    rulebook.start()
+    topic_registry.load()
+    outbound.start(bot)
+    deletion_scheduler.start(outbound.delete_messages, owns_chat)
+    # Topics are ready now, post counters catch up in the background
+    longest_cooldown = max((settings.cooldown_seconds for _, settings in topic_registry), default=None)
+    rate_limiter.start_restore(longest_cooldown, owns_chat)
+    # SIGUSR1 profiles the process, SIGUSR2 writes the slowest updates
+    install_signal_handlers()
+
+@router.shutdown()
+async def on_shutdown():
+    """Stop background services and persist their state"""
+    join_coalescer.stop()
+    await rulebook.stop()
+    await rate_limiter.stop()
+    await deletion_scheduler.stop()
+    await outbound.stop()
+    await state_store.stop()
+
+def create_dispatcher(persist_updates: bool = DEDUP_PERSIST, metrics_port: int = METRICS_PORT) -> Dispatcher:
+    """Dispatcher with the moderation handlers and middlewares, as every entry point runs it"""
+    dp = Dispatcher()
+    dp.include_router(router)
+    # Redelivered updates are dropped before anything else sees them
+    setup_dedup(dp, persist_updates)
+    setup_tracing(dp, loop_lag=metrics.loop_lag)
+    setup_metrics(dp, port=metrics_port)
+    return dp
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from config import (
+    WELCOME_MESSAGE_DELETE_DELAY, NOTICE_MAX_USERNAMES, DELETE_BATCH_SIZE,
+    JOIN_COALESCE_WINDOW, JOIN_RAID_THRESHOLD, JOIN_RAID_COOLDOWN, JOIN_MAX_CHATS
+)
+from logger import logger
+from metrics import metrics
+from outbound import outbound, PRIORITY_MODERATION
+from ruleset import rulebook
+
+# Seconds over which joins are counted against JOIN_RAID_THRESHOLD
+RAID_WINDOW = 60
+
+
+class _ChatJoins:
+    __slots__ = ('thread_id', 'usernames', 'anonymous', 'message_ids', 'recent', 'recent_total',
+                 'raid_until', 'last_join')
+
+    def __init__(self):
+        self.thread_id = None
+        self.usernames = []
+        self.anonymous = 0
+        self.message_ids = []
+        self.recent = deque()  # (time, joins) per service message within RAID_WINDOW
+        self.recent_total = 0
+        self.raid_until = 0.0
+        self.last_join = 0.0
+
+
+class JoinCoalescer:
+    """
+    Collects joins per chat over `window` seconds, then sends one welcome
+    for everyone and deletes the service messages in bulk. A chat with more
+    than `raid_threshold` joins per minute is in raid mode for `raid_cooldown`
+    seconds after the last burst: service messages are still deleted, nobody
+    is welcomed.
+    """
+
+    def __init__(self, window: float = JOIN_COALESCE_WINDOW, raid_threshold: int = JOIN_RAID_THRESHOLD,
+                 raid_cooldown: float = JOIN_RAID_COOLDOWN, max_chats: int = JOIN_MAX_CHATS):
+        self.window = window
+        self.raid_threshold = raid_threshold
+        self.raid_cooldown = raid_cooldown
+        self.max_chats = max_chats
+        # chat_id -> _ChatJoins, least recent join first
+        self._chats = OrderedDict()
+        self._timers = {}  # chat_id -> pending flush
+
+    def __len__(self):
+        return len(self._chats)
+
+    def in_raid(self, chat_id: int) -> bool:
+        state = self._chats.get(chat_id)
+        return state is not None and state.raid_until > time.monotonic()
+
+    def _expire(self, now: float):
+        """Forget chats without recent joins, pending welcomes or an active raid"""
+        chats = self._chats
+        while chats:
+            chat_id, state = next(iter(chats.items()))
+            if (len(chats) <= self.max_chats and state.last_join > now - RAID_WINDOW) \
+                    or chat_id in self._timers or state.raid_until > now:
+                break
+            del chats[chat_id]
+
+    def add(self, chat_id: int, thread_id: int, message_id: int, usernames: list, anonymous: int = 0):
+        """Record a join service message with the usernames it announces"""
+        now = time.monotonic()
+        self._expire(now)
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatJoins()
+        else:
+            self._chats.move_to_end(chat_id)
+        state.last_join = now
+
+        joins = len(usernames) + anonymous
+        state.recent.append((now, joins))
+        state.recent_total += joins
+        while state.recent[0][0] <= now - RAID_WINDOW:
+            state.recent_total -= state.recent.popleft()[1]
+        if state.recent_total > self.raid_threshold:
+            if state.raid_until <= now:
+                metrics.join_raids.inc()
+                logger.warning("Join raid in chat %s: %s joins in the last minute, welcomes paused",
+                               chat_id, state.recent_total, extra={'event': 'raid_started', 'chat_id': chat_id})
+            state.raid_until = now + self.raid_cooldown
+
+        state.message_ids.append(message_id)
+        if state.raid_until > now:
+            metrics.joins.inc('raid', amount=joins)
+            # Welcomes collected before the raid was detected are dropped too
+            state.usernames.clear()
+            state.anonymous = 0
+        else:
+            metrics.joins.inc('welcomed', amount=joins)
+            state.thread_id = thread_id
+            for username in usernames:
+                if username not in state.usernames:
+                    state.usernames.append(username)
+            state.anonymous += anonymous
+
+        if chat_id not in self._timers:
+            self._timers[chat_id] = asyncio.get_running_loop().call_later(self.window, self.flush, chat_id)
+
+    def flush(self, chat_id: int):
+        """Send the collected welcome and delete the collected service messages"""
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        state = self._chats.get(chat_id)
+        if state is None:
+            return
+        message_ids, state.message_ids = state.message_ids, []
+        for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+            outbound.delete_many(chat_id, message_ids[start:start + DELETE_BATCH_SIZE], priority=PRIORITY_MODERATION)
+
+        names = state.usernames[:NOTICE_MAX_USERNAMES]
+        hidden = len(state.usernames) - len(names)
+        if state.anonymous:
+            names.append("новий учасник" if state.anonymous == 1 else "нові учасники")
+        if hidden > 0:
+            names.append(f"та ще {hidden}")
+        state.usernames = []
+        state.anonymous = 0
+        if names:
+            text = rulebook.current.welcome_message.format(username=', '.join(names))
+            outbound.send(chat_id, text, state.thread_id, delete_after=WELCOME_MESSAGE_DELETE_DELAY)
+
+    def flush_all(self):
+        """Flush every pending chat"""
+        for chat_id in list(self._timers):
+            self.flush(chat_id)
+
+    def stop(self):
+        self.flush_all()
+
+
+# Shared coalescer instance
+join_coalescer = JoinCoalescer()
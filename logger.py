@@ -1,24 +1,119 @@
+import atexit
+import json
 import logging
-from config import LOG_FORMAT, LOG_LEVEL
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_FORMAT, LOG_LEVEL, LOG_JSON, LOG_QUEUE, LOG_SAMPLING, LOG_RATE_LIMITS
 
-def setup_logger():
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_FIELDS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+# Running queue listeners by logger name
+_listeners = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the `extra` fields of the record at the top level"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class EventFilter(logging.Filter):
+    """
+    Sampling and rate limits for records tagged with extra={'event': ...}.
+    sampling maps an event to the share of records kept, rate_limits to the
+    number kept per second. The first record let through after a throttled
+    second carries the number of dropped ones as `suppressed`.
+    """
+
+    def __init__(self, sampling: dict = None, rate_limits: dict = None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self.rate_limits = rate_limits or {}
+        self._windows = {}  # event -> [second, kept, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if event is None:
+            return True
+        share = self.sampling.get(event)
+        if share is not None:
+            if random.random() >= share:
+                return False
+            record.sampled = share
+        limit = self.rate_limits.get(event)
+        if limit is not None:
+            second = int(record.created)
+            window = self._windows.get(event)
+            if window is None or window[0] != second:
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                window = self._windows[event] = [second, 0, 0]
+            if window[1] >= limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class _LocalQueueHandler(QueueHandler):
+    """Enqueue records as they are, formatting happens on the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logger(name: str = 'TelegramBot', json_lines: bool = LOG_JSON, use_queue: bool = LOG_QUEUE,
+                 sampling: dict = LOG_SAMPLING, rate_limits: dict = LOG_RATE_LIMITS, stream=None):
     """Configure and return logger instance"""
     # Create logger
-    logger = logging.getLogger('TelegramBot')
+    logger = logging.getLogger(name)
     logger.setLevel(LOG_LEVEL)
+    logger.addFilter(EventFilter(sampling, rate_limits))
 
     # Create console handler and set level
-    console_handler = logging.StreamHandler()
+    console_handler = logging.StreamHandler(stream)
     console_handler.setLevel(LOG_LEVEL)
+    console_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
 
-    # Create formatter
-    formatter = logging.Formatter(LOG_FORMAT)
-    console_handler.setFormatter(formatter)
-
-    # Add console handler to logger
-    logger.addHandler(console_handler)
+    if use_queue:
+        # Writes happen on a listener thread, the event loop only enqueues
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+        listener.start()
+        _listeners[name] = listener
+        logger.addHandler(_LocalQueueHandler(log_queue))
+    else:
+        logger.addHandler(console_handler)
 
     return logger
 
+
+def stop_logger(name: str = 'TelegramBot'):
+    """Write out queued records and stop the listener thread"""
+    listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
+
+
+@atexit.register
+def _stop_listeners():
+    for name in list(_listeners):
+        stop_logger(name)
+
+
 # Create logger instance
 logger = setup_logger()
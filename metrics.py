@@ -0,0 +1,294 @@
+import asyncio
+import time
+from bisect import bisect_left
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT, METRICS_LOOP_LAG_INTERVAL
+from logger import logger
+from outbound import outbound
+from rules import REASON_COOLDOWN, REASON_DUPLICATE, REASON_HASHTAGS, REASON_PRICE
+from scheduler import deletion_scheduler
+
+# Histogram bucket upper bounds in seconds
+HANDLER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+API_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+LANE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Updates queued in a chat lane, counting the new one
+LANE_DEPTH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+INF_LABEL = 'le="+Inf"'
+
+# Handlers whose latency series exist before their first call
+HANDLERS = ('handle_resale_message', 'handle_new_member', 'set_resale_topic')
+DELETION_REASONS = (REASON_COOLDOWN, REASON_HASHTAGS, REASON_PRICE, REASON_DUPLICATE)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label values"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), initial: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> count, pre-created for known values so they export as 0
+        self._values = {values: 0 for values in initial}
+
+    def inc(self, *values, amount: float = 1):
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def get(self, *values) -> float:
+        return self._values.get(values, 0)
+
+    def samples(self):
+        for values, count in self._values.items():
+            yield f"{self.name}{_labels(self.labels, values)} {_number(count)}"
+
+
+class Gauge:
+    """Current value, either set directly or read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, callback=None):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self):
+        value = self.callback() if self.callback is not None else self.value
+        yield f"{self.name} {_number(value)}"
+
+
+class Histogram:
+    """
+    Bucketed observations per label values. Each series is a preallocated
+    list of per-bucket counts; observe() is a bisect and two additions.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = (), initial: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = tuple(sorted(buckets))
+        # label values -> [count per bucket..., count above the last bound, sum]
+        self._series = {}
+        for values in initial:
+            self._series[values] = [0] * (len(self.bounds) + 2)
+
+    def observe(self, value: float, *values):
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [0] * (len(self.bounds) + 2)
+        series[bisect_left(self.bounds, value)] += 1
+        series[-1] += value
+
+    def count(self, *values) -> int:
+        series = self._series.get(values)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}"
+            cumulative += series[-2]
+            yield f"{self.name}_bucket{_labels(self.labels, values, INF_LABEL)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {cumulative}"
+
+
+class BotMetrics:
+    """All bot metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self.updates_received = Counter(
+            'bot_updates_received_total', 'Updates received', ('type',))
+        self.updates_handled = Counter(
+            'bot_updates_handled_total', 'Updates that matched a handler', ('type',))
+        self.updates_duplicate = Counter(
+            'bot_updates_duplicate_total', 'Redelivered updates dropped before any handler ran', initial=((),))
+        self.handler_duration = Histogram(
+            'bot_handler_duration_seconds', 'Handler run time', HANDLER_BUCKETS,
+            ('handler',), tuple((name,) for name in HANDLERS))
+        self.handlers_in_flight = Gauge(
+            'bot_handlers_in_flight', 'Handler coroutines currently running')
+        self.api_requests = Counter(
+            'bot_api_requests_total', 'Bot API requests', ('method', 'status'))
+        self.api_duration = Histogram(
+            'bot_api_request_duration_seconds', 'Bot API request time', API_BUCKETS, ('method',))
+        self.deletions = Counter(
+            'bot_deletions_total', 'Messages removed by moderation', ('reason',),
+            tuple((reason,) for reason in DELETION_REASONS))
+        self.duplicates_flagged = Counter(
+            'bot_duplicates_flagged_total', 'Near-duplicate listings kept because DUPLICATE_ACTION is flag',
+            initial=((),))
+        self.joins = Counter(
+            'bot_joins_total', 'Members joined, by whether they were welcomed', ('mode',),
+            (('welcomed',), ('raid',)))
+        self.join_raids = Counter(
+            'bot_join_raids_total', 'Chats switched to raid mode', initial=((),))
+        self.scheduled_deletions = Gauge(
+            'bot_scheduled_deletions', 'Bot messages waiting for deletion', lambda: len(deletion_scheduler))
+        self.outbound_queue = Gauge(
+            'bot_outbound_queue', 'Sends and deletes waiting to be executed', lambda: len(outbound))
+        self.pipeline_pending = Gauge(
+            'bot_pipeline_pending', 'Updates queued or being processed in chat lanes')
+        self.lane_depth = Histogram(
+            'bot_lane_depth', 'Chat lane depth when an update is queued', LANE_DEPTH_BUCKETS)
+        self.lane_wait = Histogram(
+            'bot_lane_wait_seconds', 'Time an update waits in its chat lane before processing', LANE_WAIT_BUCKETS)
+        self.polling_paused = Counter(
+            'bot_polling_paused_seconds_total', 'Time getUpdates was held back by saturated lanes',
+            initial=((),))
+        self.loop_lag = Gauge(
+            'bot_event_loop_lag_seconds', 'Latest event loop lag')
+        self.loop_lag_histogram = Histogram(
+            'bot_event_loop_lag_distribution_seconds', 'Event loop lag', LAG_BUCKETS)
+        self._metrics = [value for value in vars(self).values() if hasattr(value, 'samples')]
+        self._monitor = None
+        self._runner = None
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    async def _monitor_loop(self, interval: float):
+        """Measure how late the loop wakes a sleeping task"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            self.loop_lag.set(lag)
+            self.loop_lag_histogram.observe(lag)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.render().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def start(self, host: str = METRICS_HOST, port: int = METRICS_PORT,
+                    lag_interval: float = METRICS_LOOP_LAG_INTERVAL):
+        """Start the loop lag monitor and serve /metrics on host:port"""
+        if self._monitor is None:
+            self._monitor = asyncio.create_task(self._monitor_loop(lag_interval))
+        if self._runner is None and port:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            try:
+                await web.TCPSite(self._runner, host, port).start()
+                logger.info("Metrics available at http://%s:%s/metrics", host, port)
+            except OSError as e:
+                logger.error("Error starting metrics server: %s", e)
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Shared metrics instance
+metrics = BotMetrics()
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware counting received and handled updates per type"""
+
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type
+        metrics.updates_received.inc(update_type)
+        result = await handler(event, data)
+        if result is not UNHANDLED:
+            metrics.updates_handled.inc(update_type)
+        return result
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware timing every handler call"""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        in_flight = metrics.handlers_in_flight
+        in_flight.value += 1
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.handler_duration.observe(time.perf_counter() - started, name)
+            in_flight.value -= 1
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Session middleware counting and timing Bot API requests per method"""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await make_request(bot, method)
+            status = 'ok'
+            return response
+        except TelegramRetryAfter:
+            status = 'retry_after'
+            raise
+        finally:
+            metrics.api_duration.observe(time.perf_counter() - started, name)
+            metrics.api_requests.inc(name, status)
+
+
+def setup_metrics(dp: Dispatcher, port: int = METRICS_PORT):
+    """Register metric middlewares and start the endpoint with the dispatcher"""
+    if not METRICS_ENABLED:
+        return
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ('update', 'error'):
+            observer.middleware(handler_middleware)
+
+    async def on_startup(bot: Bot):
+        # The session may have been replaced after import, instrument the one in use
+        if not any(isinstance(middleware, ApiMetricsMiddleware) for middleware in bot.session.middleware):
+            bot.session.middleware(ApiMetricsMiddleware())
+        await metrics.start(port=port)
+
+    async def on_shutdown():
+        await metrics.stop()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
@@ -0,0 +1,366 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import OrderedDict
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.types import ReplyParameters
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_BURST, OUTBOUND_DELETE_RATE, OUTBOUND_DELETE_BURST,
+    OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES, OUTBOUND_BACKOFF, OUTBOUND_MAX_CHATS,
+    NOTICE_COALESCE_WINDOW, NOTICE_MAX_USERNAMES, NOTIFICATION_DELETE_DELAY
+)
+from logger import logger
+from ruleset import rulebook
+from scheduler import deletion_scheduler
+from tracing import activate, current_trace, deactivate
+
+# Job priorities, lower runs first
+PRIORITY_MODERATION = 0  # deleting posts that break the rules
+PRIORITY_REPLY = 1       # direct answers to commands and joins
+PRIORITY_NOTICE = 2      # coalesced violation notices
+PRIORITY_CLEANUP = 3     # removing expired bot messages
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Pause the bucket, e.g. for a retry_after answer"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'per_chat', 'attempts', 'future', 'delete_after',
+                 'message_ids', 'trace')
+
+    def __init__(self, priority, seq, chat_id, call, per_chat, delete_after, message_ids):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.per_chat = per_chat
+        self.attempts = 0
+        self.future = asyncio.get_running_loop().create_future()
+        self.delete_after = delete_after
+        # Messages a delete job removes, handed to the deletion scheduler if it doesn't run before stop()
+        self.message_ids = message_ids
+        # Trace of the update that queued the job, its API calls are added to it
+        self.trace = current_trace()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundDispatcher:
+    """
+    Single path for all outgoing sends and deletes. Jobs run in priority order,
+    sends through the global message bucket and a per-chat one, deletes through
+    a bucket of their own, so a backlog of deletes doesn't hold back sends.
+    retry_after answers pause the affected bucket and the job is retried.
+    Violation notices are coalesced per (chat, topic, reason) over a short window.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, global_burst: float = OUTBOUND_GLOBAL_BURST,
+                 delete_rate: float = OUTBOUND_DELETE_RATE, delete_burst: float = OUTBOUND_DELETE_BURST,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: float = OUTBOUND_CHAT_BURST,
+                 workers: int = OUTBOUND_WORKERS, max_retries: int = OUTBOUND_MAX_RETRIES,
+                 coalesce_window: float = NOTICE_COALESCE_WINDOW):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.coalesce_window = coalesce_window
+        self.stats = {'sent': 0, 'deleted': 0, 'retries': 0, 'failed': 0, 'coalesced': 0}
+        self._global = TokenBucket(global_rate, global_burst)
+        self._deletes = TokenBucket(delete_rate, delete_burst)
+        self._chats = OrderedDict()
+        self._seq = itertools.count()
+        self._ready_sends = []    # heap of jobs
+        self._ready_deletes = []  # heap of jobs
+        self._delayed = []  # heap of (ready_at, job) waiting for a chat bucket or backoff
+        self._notices = {}  # (chat_id, thread_id, kind) -> (usernames, params)
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._running = set()  # jobs being executed
+        self._bot = None
+
+    def __len__(self):
+        return len(self._ready_sends) + len(self._ready_deletes) + len(self._delayed)
+
+    def set_global_rate(self, rate: float, burst: float):
+        """Change the global message limit, e.g. to split it between shard processes"""
+        self._global = TokenBucket(rate, burst)
+
+    def set_delete_rate(self, rate: float, burst: float):
+        """Change the limit of deletes"""
+        self._deletes = TokenBucket(rate, burst)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chats) > OUTBOUND_MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _push_ready(self, job: _Job):
+        heapq.heappush(self._ready_sends if job.per_chat else self._ready_deletes, job)
+
+    def _submit(self, priority: int, chat_id: int, call, per_chat: bool, delete_after: float = None,
+                message_ids: list = None) -> asyncio.Future:
+        job = _Job(priority, next(self._seq), chat_id, call, per_chat, delete_after, message_ids)
+        self._push_ready(job)
+        self._wakeup.set()
+        return job.future
+
+    # Public API, none of these need to be awaited by handlers
+
+    def send(self, chat_id: int, text: str, thread_id: int = None, reply_to: int = None,
+             priority: int = PRIORITY_REPLY, delete_after: float = None) -> asyncio.Future:
+        """Queue a text message, optionally deleting it delete_after seconds after sending"""
+        reply_parameters = None
+        if reply_to is not None:
+            reply_parameters = ReplyParameters(message_id=reply_to, allow_sending_without_reply=True)
+
+        def call(bot: Bot):
+            return bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id,
+                                    reply_parameters=reply_parameters)
+        return self._submit(priority, chat_id, call, True, delete_after)
+
+    def delete(self, chat_id: int, message_id: int, priority: int = PRIORITY_MODERATION) -> asyncio.Future:
+        """Queue deletion of a single message"""
+        return self._submit(priority, chat_id, lambda bot: bot.delete_message(chat_id, message_id), False,
+                            message_ids=[message_id])
+
+    def delete_many(self, chat_id: int, message_ids: list, priority: int = PRIORITY_CLEANUP) -> asyncio.Future:
+        """Queue one bulk deleteMessages call for up to 100 messages of a chat"""
+        message_ids = list(message_ids)
+        return self._submit(priority, chat_id, lambda bot: bot.delete_messages(chat_id, message_ids), False,
+                            message_ids=message_ids)
+
+    async def delete_messages(self, chat_id: int, message_ids: list):
+        """Deleter for the deletion scheduler, returns once the messages are deleted"""
+        await self.delete_many(chat_id, message_ids)
+
+    def notify(self, chat_id: int, thread_id: int, kind: str, username: str, **params):
+        """Add user to the pending notice of this kind for the topic"""
+        key = (chat_id, thread_id, kind)
+        pending = self._notices.get(key)
+        if pending is None:
+            pending = self._notices[key] = ([], params)
+            asyncio.get_running_loop().call_later(self.coalesce_window, self._flush_notice, key)
+        else:
+            self.stats['coalesced'] += 1
+        if username not in pending[0]:
+            pending[0].append(username)
+
+    def _flush_notice(self, key):
+        pending = self._notices.pop(key, None)
+        if pending is None:
+            return
+        usernames, params = pending
+        chat_id, thread_id, kind = key
+        single, multiple = rulebook.current.notices[kind]
+        shown = ', '.join(usernames[:NOTICE_MAX_USERNAMES])
+        if len(usernames) > NOTICE_MAX_USERNAMES:
+            shown += f" та ще {len(usernames) - NOTICE_MAX_USERNAMES}"
+        template = single if len(usernames) == 1 else multiple
+        self.send(chat_id, template.format(usernames=shown, **params), thread_id,
+                  priority=PRIORITY_NOTICE, delete_after=NOTIFICATION_DELETE_DELAY)
+
+    # Workers
+
+    def _take(self, ready: list, bucket: TokenBucket, now: float) -> tuple:
+        """
+        (job, None) for the first job of the ready heap the buckets allow now,
+        else (None, seconds until the bucket has a token or None if nothing is ready)
+        """
+        while ready:
+            wait = bucket.delay(now)
+            if wait > 0:
+                return None, wait
+            job = heapq.heappop(ready)
+            if job.per_chat:
+                chat_bucket = self._chat_bucket(job.chat_id)
+                chat_wait = chat_bucket.delay(now)
+                if chat_wait > 0:
+                    # Let other chats go ahead while this one is throttled
+                    heapq.heappush(self._delayed, (now + chat_wait, job))
+                    continue
+                chat_bucket.consume()
+            bucket.consume()
+            return job, None
+        return None, None
+
+    async def _next_job(self) -> _Job:
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._push_ready(heapq.heappop(self._delayed)[1])
+
+            # Moderation deletes go first when both budgets allow
+            timeout = None
+            for ready, bucket in ((self._ready_deletes, self._deletes), (self._ready_sends, self._global)):
+                job, wait = self._take(ready, bucket, now)
+                if job is not None:
+                    return job
+                if wait is not None:
+                    timeout = wait if timeout is None else min(timeout, wait)
+            if self._delayed:
+                delayed = self._delayed[0][0] - now
+                timeout = delayed if timeout is None else min(timeout, delayed)
+
+            self._wakeup.clear()
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+    async def _execute(self, job: _Job):
+        token = activate(job.trace)
+        try:
+            result = await job.call(self._bot)
+        except TelegramRetryAfter as e:
+            # Flood control on sends is per chat, on deletes it's for all of them
+            bucket = self._chat_bucket(job.chat_id) if job.per_chat else self._deletes
+            bucket.block(e.retry_after)
+            self._retry(job, e.retry_after, e)
+            return
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if job.per_chat:
+                # The message may have gone out with the response lost, as in session.RetryMiddleware
+                self._fail(job, e)
+                return
+            delay = OUTBOUND_BACKOFF * 2 ** job.attempts * (1 + random.random())
+            self._retry(job, delay, e)
+            return
+        except Exception as e:
+            self._fail(job, e)
+            return
+        finally:
+            deactivate(token)
+
+        if job.per_chat:
+            self.stats['sent'] += 1
+            if job.delete_after is not None:
+                deletion_scheduler.schedule_message(result, job.delete_after)
+        else:
+            self.stats['deleted'] += 1
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _retry(self, job: _Job, delay: float, error: Exception):
+        job.attempts += 1
+        if job.attempts > self.max_retries:
+            self._fail(job, error)
+            return
+        self.stats['retries'] += 1
+        heapq.heappush(self._delayed, (time.monotonic() + delay, job))
+        self._wakeup.set()
+
+    def _fail(self, job: _Job, error: Exception):
+        self.stats['failed'] += 1
+        logger.error("Outbound request failed: %s, chat_id=%s", error, job.chat_id,
+                     extra={'event': 'outbound_failed', 'chat_id': job.chat_id})
+        if not job.future.done():
+            job.future.set_exception(error)
+            # Nobody is required to await the future, don't warn about it
+            job.future.exception()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            self._running.add(job)
+            try:
+                await self._execute(job)
+            finally:
+                self._running.discard(job)
+
+    def start(self, bot: Bot):
+        if self._tasks:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _waiting(self, deadline: float, throttled_sends: bool) -> bool:
+        if self._ready_sends or self._ready_deletes or self._running:
+            return True
+        return any(ready_at <= deadline and (throttled_sends or not job.per_chat) for ready_at, job in self._delayed)
+
+    async def drain(self, timeout: float = 5, throttled_sends: bool = True) -> bool:
+        """
+        Flush pending notices and wait until queued jobs are done, return
+        whether none are left. Jobs delayed past the timeout stay queued, and
+        with throttled_sends=False so do sends held back by a chat's limit.
+        """
+        for key in list(self._notices):
+            self._flush_notice(key)
+        deadline = time.monotonic() + timeout
+        while self._waiting(deadline, throttled_sends):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return not self._delayed
+
+    async def stop(self, drain_timeout: float = 5):
+        """
+        Flush pending notices and give queued jobs a chance to finish. Deletes
+        left after that are handed to the deletion scheduler, which persists
+        them for the next run; sends left are dropped.
+        """
+        await self.drain(drain_timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        jobs = [*self._running, *self._ready_deletes, *self._ready_sends, *(job for _, job in self._delayed)]
+        self._running.clear()
+        self._ready_deletes.clear()
+        self._ready_sends.clear()
+        self._delayed.clear()
+        deletes = sends = 0
+        for job in jobs:
+            if job.message_ids is None:
+                sends += 1
+            else:
+                for message_id in job.message_ids:
+                    deletion_scheduler.schedule(job.chat_id, message_id, 0)
+                deletes += len(job.message_ids)
+            job.future.cancel()
+        if jobs:
+            logger.warning("Outbound stopped with %s deletions handed to the scheduler and %s sends dropped",
+                           deletes, sends)
+
+
+# Shared dispatcher instance
+outbound = OutboundDispatcher()
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from collections import deque
+from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types.update import UpdateTypeLookupError
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from config import PIPELINE_CONCURRENCY, PIPELINE_MAX_PENDING, PIPELINE_MAX_LANE_DEPTH
+from logger import logger
+from metrics import metrics
+
+# Seconds getUpdates waits for new updates
+POLL_TIMEOUT = 30
+# getUpdates returns at most this many updates
+POLL_LIMIT = 100
+POLL_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=30.0, factor=1.5, jitter=0.1)
+
+
+def update_chat_id(data: dict) -> int:
+    """Chat a raw update belongs to, the user for chat-less updates like inline queries"""
+    for key, value in data.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+    return 0
+
+
+def event_chat_id(update: types.Update) -> int:
+    """Chat an update belongs to, the user for chat-less updates like inline queries"""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return 0
+    chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+    return user.id if user is not None else 0
+
+
+class ChatLanes:
+    """
+    Process updates of one chat in arrival order, different chats concurrently.
+    At most `concurrency` updates are processed at once. The lanes are
+    saturated once `max_pending` updates are queued in total or
+    `max_lane_depth` in one chat, and stay so until a quarter of the total
+    capacity is free again; producers pause in wait_for_room().
+    """
+
+    def __init__(self, process, concurrency: int = PIPELINE_CONCURRENCY,
+                 max_pending: int = PIPELINE_MAX_PENDING, max_lane_depth: int = PIPELINE_MAX_LANE_DEPTH):
+        self.processed = 0
+        self.pending = 0
+        self.max_pending = max_pending
+        self.max_lane_depth = max_lane_depth
+        self._resume_at = max_pending - max(1, max_pending // 4)
+        self._process = process  # async callable(update), an Update or a raw update dict
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self._lanes = {}  # chat_id -> deque of (update, enqueued_at)
+        self._deep_lanes = 0  # lanes holding max_lane_depth updates or more
+        self._tasks = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._room = asyncio.Event()
+        self._room.set()
+
+    def __len__(self):
+        return self.pending
+
+    @property
+    def saturated(self) -> bool:
+        return not self._room.is_set()
+
+    def _update_room(self):
+        if self.pending >= self.max_pending or self._deep_lanes > 0:
+            self._room.clear()
+        elif self.pending <= self._resume_at:
+            self._room.set()
+
+    def submit(self, chat_id: int, update):
+        self.pending += 1
+        metrics.pipeline_pending.value += 1
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = deque()
+            self._idle.clear()
+            task = asyncio.create_task(self._drain(chat_id, lane))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        lane.append((update, time.perf_counter()))
+        metrics.lane_depth.observe(len(lane))
+        if len(lane) == self.max_lane_depth:
+            self._deep_lanes += 1
+        self._update_room()
+
+    async def _run(self, update):
+        try:
+            await self._process(update)
+        except Exception as e:
+            update_id = update.get('update_id') if isinstance(update, dict) else update.update_id
+            logger.error("Error processing update %s: %s", update_id, e, exc_info=True)
+
+    async def _drain(self, chat_id: int, lane: deque):
+        semaphore = self._semaphore
+        while lane:
+            update, enqueued_at = lane[0]
+            if semaphore is not None:
+                async with semaphore:
+                    metrics.lane_wait.observe(time.perf_counter() - enqueued_at)
+                    await self._run(update)
+            else:
+                metrics.lane_wait.observe(time.perf_counter() - enqueued_at)
+                await self._run(update)
+            if len(lane) == self.max_lane_depth:
+                self._deep_lanes -= 1
+            lane.popleft()
+            self.processed += 1
+            self.pending -= 1
+            metrics.pipeline_pending.value -= 1
+            self._update_room()
+        del self._lanes[chat_id]
+        if not self._lanes:
+            self._idle.set()
+
+    async def wait_for_room(self):
+        """Wait until the lanes can take more updates"""
+        await self._room.wait()
+
+    async def join(self):
+        """Wait until every submitted update is processed"""
+        await self._idle.wait()
+
+    async def cancel(self):
+        """Drop queued updates and cancel the ones being processed"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        metrics.pipeline_pending.value -= self.pending
+        self.pending = 0
+        self._lanes.clear()
+        self._deep_lanes = 0
+        self._idle.set()
+        self._room.set()
+
+
+class UpdatePipeline:
+    """
+    Long polling through ChatLanes: updates of a chat are handled one at a
+    time and in order, with a global limit on concurrent handlers. getUpdates
+    is only called while the lanes have room and asks for no more updates than
+    fit, the rest waits on Telegram's side.
+    """
+
+    def __init__(self, dp: Dispatcher, concurrency: int = PIPELINE_CONCURRENCY,
+                 max_pending: int = PIPELINE_MAX_PENDING, max_lane_depth: int = PIPELINE_MAX_LANE_DEPTH):
+        self.dp = dp
+        self.lanes = ChatLanes(self._process, concurrency, max_pending, max_lane_depth)
+        self._bot = None
+        self._context = {}
+
+    async def _process(self, update: types.Update):
+        await self.dp.feed_update(self._bot, update, **self._context)
+
+    def submit(self, update: types.Update):
+        self.lanes.submit(event_chat_id(update), update)
+
+    async def poll(self, bot: Bot, allowed_updates: list = None, timeout: int = POLL_TIMEOUT, **context):
+        """Fetch and submit updates until cancelled"""
+        self._bot = bot
+        self._context = context
+        lanes = self.lanes
+        dedup = self.dp.get('update_dedup')
+        backoff = Backoff(config=POLL_BACKOFF)
+        # Wait longer than the long poll itself before treating the request as timed out
+        request_timeout = int(bot.session.timeout + timeout) if bot.session.timeout else None
+        offset = None
+        while True:
+            if lanes.saturated:
+                paused = time.perf_counter()
+                await lanes.wait_for_room()
+                metrics.polling_paused.inc(amount=time.perf_counter() - paused)
+            limit = max(1, min(POLL_LIMIT, lanes.max_pending - lanes.pending))
+            try:
+                updates = await bot.get_updates(offset=offset, limit=limit, timeout=timeout,
+                                                allowed_updates=allowed_updates, request_timeout=request_timeout)
+            except TelegramRetryAfter as e:
+                logger.error("getUpdates flood control, retrying in %s s", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                logger.error("Error polling updates: %s, retrying in %.1f s", e, backoff.next_delay)
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            if dedup is not None and updates:
+                # Queued updates must not count as handled after a crash
+                await dedup.expect(bot, [update.update_id for update in updates])
+            for update in updates:
+                self.submit(update)
+            if updates:
+                offset = updates[-1].update_id + 1
+
+    async def stop(self, drain_timeout: float = 5):
+        """Give queued updates a chance to finish, then cancel the rest"""
+        try:
+            async with asyncio.timeout(drain_timeout):
+                await self.lanes.join()
+        except TimeoutError:
+            logger.error("Update pipeline not drained, %s updates lost", len(self.lanes))
+        await self.lanes.cancel()
@@ -0,0 +1,184 @@
+import asyncio
+import cProfile
+import io
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from config import PROFILE_DIR, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL
+from logger import logger
+from tracing import slowest_traces
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+
+def _report_path(directory: str, prefix: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}")
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread, counting identical stacks"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str) -> str:
+        """Collapsed stacks for flame graph tools in path.folded, a summary in path.txt"""
+        with open(f"{path}.folded", 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        with open(f"{path}.txt", 'w') as f:
+            f.write(f"{self.samples} samples every {self.interval * 1000:g} ms\n\n")
+            for title, counter in (('own', own), ('total', total)):
+                f.write(f"{'samples':>8} {'%':>6}  {title}\n")
+                for function, count in counter.most_common(40):
+                    f.write(f"{count:8} {100 * count / max(self.samples, 1):6.1f}  {function}\n")
+                f.write('\n')
+        return f"{path}.txt"
+
+
+class Profiler:
+    """
+    One profiling run at a time over the whole process for a number of
+    seconds: 'cprofile' traces every call, 'sample' looks at the event loop
+    thread's stack every few milliseconds, cheaper and closer to wall time.
+    Reports go to `directory`, start() returns a task resolving to the path.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, seconds: float = PROFILE_DEFAULT_SECONDS, mode: str = 'cprofile') -> asyncio.Task:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"unknown mode {mode}, expected one of {', '.join(PROFILE_MODES)}")
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"duration must be between 0 and {PROFILE_MAX_SECONDS} seconds")
+        if self.running:
+            raise RuntimeError("profiling is already running")
+        self._task = asyncio.create_task(self._run(seconds, mode))
+        self._task.add_done_callback(self._done)
+        return self._task
+
+    @staticmethod
+    def _done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Profiling failed: %s", task.exception())
+
+    async def _run(self, seconds: float, mode: str) -> str:
+        logger.info("Profiling (%s) for %s seconds", mode, seconds)
+        path = _report_path(self.directory, f"profile-{mode}")
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            report = await asyncio.to_thread(self._write_cprofile, profile, path)
+        else:
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+            report = await asyncio.to_thread(sampler.write, path)
+        logger.info("Profile written to %s", report)
+        return report
+
+    @staticmethod
+    def _write_cprofile(profile: cProfile.Profile, path: str) -> str:
+        """Raw stats in path.prof for snakeviz and the like, the top functions in path.txt"""
+        profile.dump_stats(f"{path}.prof")
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(40)
+        with open(f"{path}.txt", 'w') as f:
+            f.write(text.getvalue())
+        return f"{path}.txt"
+
+
+def dump_traces(traces: list = None, directory: str = PROFILE_DIR) -> str:
+    """
+    Write the slowest updates with their span trees, as text and JSON; returns the text file.
+    Off the loop thread pass `traces`, a snapshot of slowest_traces taken on it.
+    """
+    if traces is None:
+        traces = slowest_traces.slowest()
+    path = _report_path(directory, 'traces')
+    with open(f"{path}.json", 'w') as f:
+        json.dump([trace.as_dict() for trace in traces], f, ensure_ascii=False, indent=1)
+    with open(f"{path}.txt", 'w') as f:
+        f.write(f"{len(traces)} slowest of {slowest_traces.traced} updates\n\n")
+        f.write('\n\n'.join(trace.render() for trace in traces))
+    logger.info("Slowest updates written to %s", path)
+    return f"{path}.txt"
+
+
+def install_signal_handlers(loop: asyncio.AbstractEventLoop = None):
+    """SIGUSR1 profiles for PROFILE_DEFAULT_SECONDS, SIGUSR2 writes the slowest updates"""
+    loop = loop or asyncio.get_running_loop()
+
+    def start_profile():
+        try:
+            profiler.start()
+        except RuntimeError as e:
+            logger.warning("SIGUSR1 ignored: %s", e)
+
+    def write_traces():
+        try:
+            dump_traces()
+        except OSError as e:
+            logger.error("Could not write traces: %s", e)
+
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, start_profile)
+        loop.add_signal_handler(signal.SIGUSR2, write_traces)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        # Windows, or not in the main thread
+        logger.info("Profiling signals are not available")
+
+
+# Shared profiler instance
+profiler = Profiler()
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import OrderedDict
+from config import MESSAGE_COOLDOWN_MINUTES, MAX_MESSAGES_BEFORE_COOLDOWN, RATE_LIMIT_MAX_KEYS
+from logger import logger
+from storage import StateStore, state_store
+
+# Expired entries checked per hit by the incremental sweep
+SWEEP_STEP = 8
+# Store namespace of post stamps, keyed by "chat_id:thread_id:user_id"
+NAMESPACE = 'rate'
+
+
+def _encode_key(key) -> str:
+    return ':'.join(map(str, key))
+
+
+def _decode_key(key: str) -> tuple:
+    return tuple(int(part) for part in key.split(':'))
+
+
+class RateLimiter:
+    """
+    Sliding-window post limiter keyed by (chat_id, thread_id, user_id).
+    A key may post `limit` messages within any `window` seconds.
+    Each key keeps only the monotonic timestamps of its accepted posts
+    inside the window, stored as a tuple of at most `limit` floats.
+    Changes are mirrored to the state store as unix timestamps.
+    """
+
+    def __init__(self, limit: int = MAX_MESSAGES_BEFORE_COOLDOWN,
+                 window: float = MESSAGE_COOLDOWN_MINUTES * 60,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS, store: StateStore = state_store):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.store = store
+        # Converts monotonic stamps to unix time and back
+        self._clock_offset = time.time() - time.monotonic()
+        self._restore_task = None
+        # Longest window seen, entries idle for longer than this are expired
+        self._max_window = window
+        # key -> stamps, least recently written first
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _persist(self, key, stamps: tuple):
+        offset = self._clock_offset
+        self.store.put(NAMESPACE, _encode_key(key), [stamp + offset for stamp in stamps])
+
+    def _forget(self, key):
+        self.store.delete(NAMESPACE, _encode_key(key))
+
+    def _sweep(self, now: float, budget: int):
+        """Drop expired entries from the least recently written end"""
+        entries = self._entries
+        cutoff = now - self._max_window
+        while entries and budget:
+            key, stamps = next(iter(entries.items()))
+            if stamps[-1] > cutoff:
+                break
+            del entries[key]
+            self._forget(key)
+            budget -= 1
+
+    def hit(self, key, limit: int = None, window: float = None) -> bool:
+        """Record a post for key, return False if it exceeds the limit"""
+        limit = self.limit if limit is None else limit
+        window = self.window if window is None else window
+        if window > self._max_window:
+            self._max_window = window
+        now = time.monotonic()
+        self._sweep(now, SWEEP_STEP)
+
+        stamps = self._entries.get(key)
+        if stamps is None:
+            stamps = ()
+        else:
+            cutoff = now - window
+            if stamps[0] <= cutoff:
+                stamps = tuple(stamp for stamp in stamps if stamp > cutoff)
+            if len(stamps) >= limit:
+                return False
+
+        stamps = self._entries[key] = stamps[-(limit - 1):] + (now,) if limit > 1 else (now,)
+        self._entries.move_to_end(key)
+        self._persist(key, stamps)
+        if len(self._entries) > self.max_keys:
+            self._forget(self._entries.popitem(last=False)[0])
+        return True
+
+    def refund(self, key):
+        """Forget the latest accepted post for key, e.g. after it was removed"""
+        stamps = self._entries.get(key)
+        if stamps is None:
+            return
+        if len(stamps) > 1:
+            self._entries[key] = stamps[:-1]
+            self._persist(key, stamps[:-1])
+        else:
+            del self._entries[key]
+            self._forget(key)
+
+    def remaining(self, key, limit: int = None, window: float = None) -> int:
+        """Number of posts key may still send in the current window"""
+        limit = self.limit if limit is None else limit
+        window = self.window if window is None else window
+        stamps = self._entries.get(key)
+        if stamps is None:
+            return limit
+        cutoff = time.monotonic() - window
+        return max(0, limit - sum(1 for stamp in stamps if stamp > cutoff))
+
+    def sweep(self):
+        """Drop all expired entries"""
+        self._sweep(time.monotonic(), -1)
+
+    async def restore(self, window: float = None, owns_chat=None):
+        """
+        Load stamps saved by a previous run. Keys hit since startup keep
+        their live state, entries older than window are dropped from the store.
+        owns_chat(chat_id) limits the restore to the chats of this shard.
+        """
+        window = self._max_window if window is None else max(window, self._max_window)
+        self._max_window = window
+        offset = self._clock_offset
+        restored = 0
+        try:
+            async for chunk in self.store.load(NAMESPACE):
+                cutoff = time.monotonic() - window
+                for encoded, values in chunk:
+                    key = _decode_key(encoded)
+                    if key in self._entries or (owns_chat is not None and not owns_chat(key[0])):
+                        continue
+                    stamps = tuple(value - offset for value in values if value - offset > cutoff)
+                    if not stamps or len(self._entries) >= self.max_keys:
+                        self.store.delete(NAMESPACE, encoded)
+                        continue
+                    # Restored posts are older than live ones, keep them at the expiring end
+                    self._entries[key] = stamps
+                    self._entries.move_to_end(key, last=False)
+                    restored += 1
+        except Exception as e:
+            logger.error("Error restoring rate limit entries: %s", e)
+        logger.info("Restored %s rate limit entries", restored)
+
+    def start_restore(self, window: float = None, owns_chat=None):
+        """Run restore() in the background, the limiter works meanwhile"""
+        if self._restore_task is None:
+            self._restore_task = asyncio.create_task(self.restore(window, owns_chat))
+
+    async def stop(self):
+        if self._restore_task is not None:
+            self._restore_task.cancel()
+            try:
+                await self._restore_task
+            except asyncio.CancelledError:
+                pass
+            self._restore_task = None
+
+
+# Shared limiter instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,117 @@
+import re
+from typing import NamedTuple
+from config import REQUIRED_HASHTAGS, MIN_PRICE, SALE_HASHTAG
+
+# Verdict reasons
+REASON_HASHTAGS = 'hashtags'
+REASON_PRICE = 'price'
+REASON_COOLDOWN = 'cooldown'  # decided by the rate limiter, not by RuleEngine
+REASON_DUPLICATE = 'duplicate'  # decided by the duplicate detector
+
+# Price tokenizer for lowercased message text. Alternatives are tried in order,
+# so phone numbers are consumed before their digits can be read as a price.
+# The leading lookahead lets the matcher skip words without trying each branch.
+_TOKEN_RE = re.compile(r"""
+    (?=[+(\dцзп])
+    (?:
+    (?P<phone>
+        \+\d{1,3}[\ \-]?\(?\d{2,3}\)?[\ \-]?\d{3}[\ \-]?\d{2}[\ \-]?\d{2}(?!\d)
+      | \(?0\d{2}\)?[\ \-]?\d{3}[\ \-]?\d{2}[\ \-]?\d{2}(?!\d)
+      | \d{10,}
+    )
+  | (?P<keyword>(?<!\w)(?:ціна|ціну|ціною|за|по)(?!\w)[\s:=\-–—]*)
+  | (?P<num>\d{1,3}(?:[\ \u00a0]\d{3})+(?!\d)|\d+(?:[.,]\d+)?)
+    \s*
+    (?P<unit>[kк](?!\w)|тис(?:\.|\w*)|грн\.?|грив\w*|uah(?!\w)|₴)?
+    )
+""", re.VERBOSE)
+
+_THOUSAND_UNITS = ('k', 'к', 'т')
+
+
+class Verdict(NamedTuple):
+    """Result of checking a message against the rules"""
+    allowed: bool
+    reason: str = None
+    price: int = None
+    hashtags: frozenset = frozenset()
+
+
+def _parse_number(num: str, unit: str) -> int:
+    """Convert a number token and its optional unit to an integer price"""
+    num = num.replace(' ', '').replace('\u00a0', '')
+    thousands = bool(unit) and unit[0] in _THOUSAND_UNITS
+    integer, sep, fraction = num.replace(',', '.').partition('.')
+    if sep and len(fraction) == 3 and not thousands:
+        # "3,500" / "3.500" is a thousands separator, not a fraction
+        return int(integer + fraction)
+    value = float(num.replace(',', '.')) if sep else int(num)
+    return int(value * 1000) if thousands else int(value)
+
+
+def _scan_price(text: str) -> int:
+    """
+    Tokenize lowercased text once and pick the price, 0 if not found: the first
+    number after a price keyword, else the first one with a currency or
+    thousands suffix, else the first bare number. Years, mileage or model
+    numbers elsewhere in the text don't override it.
+    """
+    unit_price = None
+    plain_price = None
+    keyword_end = -1
+    for match in _TOKEN_RE.finditer(text):
+        _, keyword, num, unit = match.groups()
+        if keyword:
+            keyword_end = match.end()
+        elif num:
+            price = int(num) if not unit and num.isdigit() else _parse_number(num, unit)
+            if match.start() == keyword_end:
+                # "ціна 3000", "за 2к", "2 шт по 3000"
+                return price
+            if unit:
+                if unit_price is None:
+                    unit_price = price
+            elif plain_price is None:
+                plain_price = price
+    if unit_price is not None:
+        return unit_price
+    return plain_price or 0
+
+
+def extract_price(text: str) -> int:
+    """
+    Extract price from message text, handling different formats:
+    - Plain numbers: 3000, 3 000, 3,500
+    - With currency: 3000грн, 3000 грн, 3000₴, 3000 гривень
+    - Short format: 3k, 3к, 3.5k, 3 тис
+    - After a keyword: ціна 3000, за 3000, по 3000
+    Phone numbers are ignored. Returns 0 if no valid price found
+    """
+    return _scan_price(text.lower())
+
+
+class RuleEngine:
+    """Hashtag and price rules of a topic, compiled once"""
+
+    def __init__(self, hashtags=REQUIRED_HASHTAGS, min_price: int = MIN_PRICE, sale_hashtag: str = SALE_HASHTAG):
+        self.hashtags = tuple(tag.lower() for tag in hashtags)
+        self.min_price = min_price
+        self.sale_hashtag = sale_hashtag.lower()
+        # One alternation for the whole tag set, longest first so prefixes don't shadow
+        self._required = re.compile('|'.join(
+            re.escape(tag) for tag in sorted(set(self.hashtags), key=len, reverse=True)
+        ))
+
+    def check(self, text: str) -> Verdict:
+        """Check message text against hashtag and minimum price rules"""
+        text = text.lower()
+        found = frozenset(self._required.findall(text))
+        if not found:
+            return Verdict(False, REASON_HASHTAGS, None, found)
+        if self.sale_hashtag not in found:
+            return Verdict(True, None, None, found)
+        # Prices only matter for sale posts, so the tokenizer runs only for them
+        price = _scan_price(text)
+        if price < self.min_price:
+            return Verdict(False, REASON_PRICE, price, found)
+        return Verdict(True, None, price, found)
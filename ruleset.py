@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import time
+import tomllib
+from dataclasses import dataclass
+from types import MappingProxyType
+from config import RULES_FILE, RULES_RELOAD_INTERVAL, NOTICE_TEMPLATES, WELCOME_MESSAGE
+from logger import logger
+from topics import TopicSettings, topic_registry
+
+# Values templates are rendered with when a rules file is validated
+_SAMPLE_NOTICE = {'usernames': '@user', 'cooldown_minutes': 60, 'max_messages': 3, 'hashtags': '#продам',
+                  'min_price': 3000}
+_SAMPLE_WELCOME = {'username': '@user'}
+# Settings a rules file may set, with the type each must have
+_SETTINGS = {
+    'hashtags': list,
+    'sale_hashtag': str,
+    'min_price': int,
+    'cooldown_minutes': int,
+    'max_messages': int,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Ruleset:
+    """
+    Validated and compiled moderation rules. Snapshots are never changed,
+    a reload builds a new one and swaps it in.
+    """
+    defaults: TopicSettings
+    notices: MappingProxyType  # kind -> (single user, several users) templates
+    welcome_message: str
+    source: str
+    loaded_at: float
+
+    def summary(self) -> dict:
+        """Flat view of the rules, used to report what a reload changed"""
+        values = self.defaults.to_dict()
+        values['hashtags'] = ', '.join(values['hashtags'])
+        values['welcome_message'] = self.welcome_message
+        for kind, (single, multiple) in self.notices.items():
+            values[f"notices.{kind}.single"] = single
+            values[f"notices.{kind}.plural"] = multiple
+        return values
+
+
+def _render(template, name: str, sample: dict) -> str:
+    if not isinstance(template, str) or not template.strip():
+        raise ValueError(f"{name} must be a non-empty string")
+    try:
+        template.format(**sample)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"{name} is not a valid template: {e!r}") from None
+    return template
+
+
+def parse_rules(data: dict, source: str = 'config.py') -> Ruleset:
+    """Build a ruleset from parsed rules file contents, raise ValueError if they are invalid"""
+    data = dict(data)
+    settings = {}
+    for name, kind in _SETTINGS.items():
+        if name not in data:
+            continue
+        value = data.pop(name)
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise ValueError(f"{name} must be of type {kind.__name__}")
+        settings[name] = value
+    if 'hashtags' in settings:
+        if not all(isinstance(tag, str) for tag in settings['hashtags']):
+            raise ValueError("hashtags must be a non-empty list of #tags")
+        settings['hashtags'] = tuple(settings['hashtags'])
+    defaults = TopicSettings(**settings)
+    defaults.validate()
+
+    notices = dict(NOTICE_TEMPLATES)
+    for kind, templates in data.pop('notices', {}).items():
+        if kind not in NOTICE_TEMPLATES:
+            raise ValueError(f"Unknown notice: {kind}")
+        if isinstance(templates, dict):
+            templates = (templates.get('single'), templates.get('plural', templates.get('single')))
+        if not isinstance(templates, (list, tuple)) or len(templates) != 2:
+            raise ValueError(f"notices.{kind} must have single and plural templates")
+        notices[kind] = (_render(templates[0], f"notices.{kind}.single", _SAMPLE_NOTICE),
+                         _render(templates[1], f"notices.{kind}.plural", _SAMPLE_NOTICE))
+    welcome = _render(data.pop('welcome_message', WELCOME_MESSAGE), 'welcome_message', _SAMPLE_WELCOME)
+    if data:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(data))}")
+    return Ruleset(defaults, MappingProxyType(notices), welcome, source, time.time())
+
+
+def load_rules(path: str) -> Ruleset:
+    """Read a TOML or JSON rules file, config.py defaults if there is no file"""
+    if not os.path.exists(path):
+        return parse_rules({})
+    with open(path, 'rb') as f:
+        content = f.read()
+    try:
+        data = json.loads(content) if path.endswith('.json') else tomllib.loads(content.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cannot parse {path}: {e}") from None
+    if not isinstance(data, dict):
+        raise ValueError(f"{path} must contain a table of settings")
+    return parse_rules(data, path)
+
+
+def diff(old: Ruleset, new: Ruleset) -> list:
+    """(name, old value, new value) of every setting that differs"""
+    before, after = old.summary(), new.summary()
+    return [(name, before.get(name), value) for name, value in after.items() if before.get(name) != value]
+
+
+class RuleBook:
+    """
+    Holds the current ruleset and reloads it from `path` when the file
+    changes. Readers take `rulebook.current` once per use; the attribute is
+    only ever replaced by a fully built snapshot.
+    """
+
+    def __init__(self, path: str = RULES_FILE):
+        self.path = path
+        self.current = parse_rules({})
+        self._stamp = None
+        self._task = None
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self) -> list:
+        """Load the rules file and swap it in, return the changes. Raises ValueError and keeps the old rules"""
+        self._stamp = self._file_stamp()
+        ruleset = load_rules(self.path)
+        changes = diff(self.current, ruleset)
+        topic_registry.set_defaults(ruleset.defaults)
+        self.current = ruleset
+        if changes:
+            logger.info("Rules reloaded from %s: %s", ruleset.source, ', '.join(name for name, _, _ in changes))
+        return changes
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self._file_stamp() == self._stamp:
+                continue
+            try:
+                self.reload()
+            except ValueError as e:
+                logger.error("Rules not reloaded, keeping the current ones: %s", e)
+
+    def start(self, interval: float = RULES_RELOAD_INTERVAL):
+        """Load the rules and check the file for changes every `interval` seconds"""
+        try:
+            self.reload()
+        except ValueError as e:
+            logger.error("Invalid rules file, using config.py defaults: %s", e)
+        if self._task is None and interval:
+            self._task = asyncio.create_task(self._watch(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+# Shared rule book instance
+rulebook = RuleBook()
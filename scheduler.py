@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import time
+from collections import defaultdict
+from aiogram import types
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from config import DELETE_BATCH_SIZE, DELETE_RETRY_BACKOFF, DELETE_MAX_RETRIES
+from logger import logger
+from storage import StateStore, state_store
+
+# Store namespace of pending jobs, keyed by "chat_id:message_id"
+NAMESPACE = 'deletions'
+
+
+class DeletionScheduler:
+    """
+    Single-task scheduler for deferred message deletions. A job stays in the
+    store until its batch is deleted, failed batches are retried with backoff.
+    """
+
+    def __init__(self, store: StateStore = state_store, batch_size: int = DELETE_BATCH_SIZE,
+                 retry_backoff: float = DELETE_RETRY_BACKOFF, max_retries: int = DELETE_MAX_RETRIES):
+        self.store = store
+        self.batch_size = batch_size
+        self.retry_backoff = retry_backoff
+        self.max_retries = max_retries
+        # Heap of (due unix time, chat_id, message_id); wall clock so jobs survive restarts
+        self._heap = []
+        # (chat_id, message_id) -> failed attempts, for jobs being retried
+        self._attempts = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # async callable(chat_id, message_ids) performing the bulk deletion
+        self._delete_messages = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float):
+        """Queue message for deletion after delay seconds"""
+        job = (time.time() + delay, chat_id, message_id)
+        heapq.heappush(self._heap, job)
+        self.store.put(NAMESPACE, f"{chat_id}:{message_id}", job[0])
+        # Wake the runner if this job is now the earliest one
+        if self._heap[0] is job:
+            self._wakeup.set()
+
+    def schedule_message(self, message: types.Message, delay: float):
+        self.schedule(message.chat.id, message.message_id, delay)
+
+    def pop_due(self, now: float = None) -> dict:
+        """Take due jobs off the queue and group their message ids per chat, they stay in the store"""
+        now = time.time() if now is None else now
+        due = defaultdict(list)
+        while self._heap and self._heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            due[chat_id].append(message_id)
+        return due
+
+    async def flush_due(self) -> int:
+        """Delete all due messages in bulk batches per chat, return how many were deleted"""
+        batches = []
+        for chat_id, message_ids in self.pop_due().items():
+            for i in range(0, len(message_ids), self.batch_size):
+                batches.append(self._delete_batch(chat_id, message_ids[i:i + self.batch_size]))
+        return sum(await asyncio.gather(*batches))
+
+    async def _delete_batch(self, chat_id: int, message_ids: list) -> int:
+        try:
+            await self._delete_messages(chat_id, message_ids)
+        except (TelegramNetworkError, TelegramServerError, TelegramRetryAfter) as e:
+            self._retry(chat_id, message_ids, e)
+            return 0
+        except Exception as e:
+            # e.g. the messages are too old to be deleted, retrying won't help
+            logger.error("Error deleting scheduled messages: %s, chat_id=%s, count=%s", e, chat_id, len(message_ids))
+            deleted = 0
+        else:
+            deleted = len(message_ids)
+        self._forget(chat_id, message_ids)
+        return deleted
+
+    def _retry(self, chat_id: int, message_ids: list, error: Exception):
+        attempts = max(self._attempts.get((chat_id, message_id), 0) for message_id in message_ids) + 1
+        if attempts > self.max_retries:
+            logger.error("Giving up on scheduled deletion: %s, chat_id=%s, count=%s", error, chat_id, len(message_ids))
+            self._forget(chat_id, message_ids)
+            return
+        delay = self.retry_backoff * 2 ** (attempts - 1)
+        logger.warning("Scheduled deletion failed: %s, chat_id=%s, count=%s, retrying in %.0f s",
+                       error, chat_id, len(message_ids), delay)
+        for message_id in message_ids:
+            self._attempts[(chat_id, message_id)] = attempts
+            self.schedule(chat_id, message_id, delay)
+
+    def _forget(self, chat_id: int, message_ids: list):
+        for message_id in message_ids:
+            self._attempts.pop((chat_id, message_id), None)
+            self.store.delete(NAMESPACE, f"{chat_id}:{message_id}")
+
+    def load(self, owns_chat=None):
+        """Restore pending jobs saved by a previous run, only for chats owns_chat accepts if given"""
+        try:
+            jobs = []
+            for key, due in self.store.items(NAMESPACE):
+                chat_id, message_id = key.split(':')
+                if owns_chat is None or owns_chat(int(chat_id)):
+                    jobs.append((due, int(chat_id), int(message_id)))
+        except Exception as e:
+            logger.error("Error loading pending deletions: %s", e)
+            return
+        # Merge with jobs already in memory without duplicating them
+        self._heap = list(set(self._heap).union(jobs))
+        heapq.heapify(self._heap)
+        logger.info("Loaded %s pending deletions", len(self._heap))
+
+    async def _run(self):
+        while True:
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    async with asyncio.timeout(timeout):
+                        await self._wakeup.wait()
+                except TimeoutError:
+                    pass
+            self._wakeup.clear()
+            await self.flush_due()
+
+    def start(self, delete_messages, owns_chat=None):
+        """
+        Load persisted jobs and start the runner task.
+        delete_messages(chat_id, message_ids) is awaited for every due batch
+        and raises if the messages were not deleted.
+        """
+        if self._task is not None:
+            return
+        self._delete_messages = delete_messages
+        self._wakeup = asyncio.Event()
+        self.load(owns_chat)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the runner, pending jobs and batches in flight stay in the store"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Shared scheduler instance
+deletion_scheduler = DeletionScheduler()
@@ -0,0 +1,88 @@
+import asyncio
+import random
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from config import (
+    BOT_TOKEN, BOT_API_URL, BOT_API_LOCAL, SESSION_POOL_SIZE, SESSION_KEEPALIVE, SESSION_DNS_TTL,
+    SESSION_TIMEOUT, SESSION_METHOD_TIMEOUTS, SESSION_MAX_RETRIES, SESSION_BACKOFF, SESSION_MAX_RETRY_AFTER
+)
+from logger import logger
+
+# Methods that may have taken effect when the response was lost, not retried on network errors
+_UNSAFE_PREFIXES = ('send', 'forward', 'copy')
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware retrying transient failures with jittered exponential
+    backoff. Short flood waits are slept through; longer ones and exhausted
+    retries are raised to the caller, e.g. the outbound queue that paces its
+    buckets on them.
+    """
+
+    def __init__(self, max_retries: int = SESSION_MAX_RETRIES, backoff: float = SESSION_BACKOFF,
+                 max_retry_after: float = SESSION_MAX_RETRY_AFTER):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = method.__api_method__
+        attempt = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                delay = e.retry_after + random.uniform(0, self.backoff)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries or name.lower().startswith(_UNSAFE_PREFIXES):
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                logger.warning("%s failed: %s, retrying in %.2f s", name, e, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+class TunedSession(AiohttpSession):
+    """
+    AiohttpSession with a sized keep-alive connection pool, cached DNS
+    lookups and a timeout per API method. An explicit request_timeout, as
+    getUpdates passes, still takes precedence.
+    """
+
+    def __init__(self, api: TelegramAPIServer = PRODUCTION, pool_size: int = SESSION_POOL_SIZE,
+                 keepalive: float = SESSION_KEEPALIVE, dns_ttl: int = SESSION_DNS_TTL,
+                 timeout: float = SESSION_TIMEOUT, method_timeouts: dict = None, retry: bool = True):
+        super().__init__(api=api, limit=pool_size, timeout=timeout)
+        self._connector_init.update(keepalive_timeout=keepalive, ttl_dns_cache=dns_ttl)
+        if api.base.startswith('http://'):
+            # No TLS to a local Bot API server
+            self._connector_init.pop('ssl', None)
+        self.method_timeouts = SESSION_METHOD_TIMEOUTS if method_timeouts is None else method_timeouts
+        if retry:
+            self.middleware(RetryMiddleware())
+
+    async def make_request(self, bot: Bot, method, timeout: int = None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        return await super().make_request(bot, method, timeout)
+
+
+def api_server(url: str = BOT_API_URL, is_local: bool = BOT_API_LOCAL) -> TelegramAPIServer:
+    """Telegram's servers, or a self-hosted Bot API server at `url`"""
+    if not url:
+        return PRODUCTION
+    return TelegramAPIServer.from_base(url.rstrip('/'), is_local=is_local)
+
+
+def create_bot(token: str = BOT_TOKEN, api_url: str = BOT_API_URL, **kwargs) -> Bot:
+    """Bot using a TunedSession, kwargs are passed to the session"""
+    session = TunedSession(api=api_server(api_url), **kwargs)
+    if api_url:
+        logger.info("Using Bot API server at %s", api_url)
+    return Bot(token=token, session=session)
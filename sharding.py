@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import multiprocessing
+import queue
+import secrets
+from bisect import bisect
+from collections import defaultdict
+import aiohttp
+from aiogram import Dispatcher, types
+from aiohttp import web
+from config import (
+    BOT_TOKEN, BOT_API_URL, SHARD_WORKERS, SHARD_REPLICAS, SHARD_INBOX_SIZE, METRICS_PORT, OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_GLOBAL_BURST, OUTBOUND_DELETE_RATE, OUTBOUND_DELETE_BURST, WEBHOOK_BASE_URL, WEBHOOK_PATH,
+    WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+)
+from logger import logger
+from handlers import create_dispatcher, router
+from outbound import outbound
+from pipeline import POLL_TIMEOUT, ChatLanes, update_chat_id
+from session import api_server, create_bot
+from webhook import SECRET_HEADER
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hashing of chat ids onto shards, each shard placed at `replicas` points"""
+
+    def __init__(self, shards: int, replicas: int = SHARD_REPLICAS):
+        points = sorted((_hash(f"{shard}:{replica}"), shard) for shard in range(shards) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+        self._cache = {}
+
+    def shard(self, chat_id: int) -> int:
+        shard = self._cache.get(chat_id)
+        if shard is None:
+            if len(self._cache) > 100_000:
+                self._cache.clear()
+            index = bisect(self._points, _hash(str(chat_id))) % len(self._points)
+            shard = self._cache[chat_id] = self._shards[index]
+        return shard
+
+
+def run_worker(index: int, total: int, inbox, events, api_url: str = BOT_API_URL):
+    """Worker process entry point"""
+    asyncio.run(_worker(index, total, inbox, events, api_url))
+
+
+async def _worker(index: int, total: int, inbox, events, api_url: str = BOT_API_URL):
+    bot = create_bot(api_url=api_url)
+    # Workers share the bot, a persisted update mark of one would hide updates of the others
+    dp = create_dispatcher(persist_updates=False, metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    # The Bot API limit is per bot, shards split it
+    outbound.set_global_rate(OUTBOUND_GLOBAL_RATE / total, max(1, OUTBOUND_GLOBAL_BURST / total))
+    outbound.set_delete_rate(OUTBOUND_DELETE_RATE / total, max(1, OUTBOUND_DELETE_BURST / total))
+
+    ring = HashRing(total)
+    await dp.emit_startup(bot=bot, owns_chat=lambda chat_id: ring.shard(chat_id) == index)
+
+    async def process(data: dict):
+        update = types.Update.model_validate(data, context={'bot': bot})
+        await dp.feed_update(bot, update)
+
+    lanes = ChatLanes(process)
+    loop = asyncio.get_running_loop()
+    events.put(('ready', index, 0))
+    logger.info("Shard %s/%s started", index + 1, total)
+    try:
+        while True:
+            # Leave batches in the inbox while this shard is behind
+            await lanes.wait_for_room()
+            batch = await loop.run_in_executor(None, inbox.get)
+            if batch is None:
+                break
+            for data in batch:
+                lanes.submit(update_chat_id(data), data)
+        await lanes.join()
+        events.put(('done', index, lanes.processed))
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+class ShardCoordinator:
+    """
+    Receives updates in one process and hands them to worker processes,
+    every chat always to the same worker. Workers own the moderation state
+    of their chats and keep updates of a chat in order. Worker inboxes are
+    bounded, a full one holds back polling until the worker catches up.
+    """
+
+    def __init__(self, workers: int = SHARD_WORKERS, api_url: str = BOT_API_URL, inbox_size: int = SHARD_INBOX_SIZE):
+        self.workers = workers
+        self.api_url = api_url
+        self.ring = HashRing(workers)
+        context = multiprocessing.get_context('spawn')
+        self._inboxes = [context.Queue(inbox_size) for _ in range(workers)]
+        self._events = context.Queue()
+        self._processes = [
+            context.Process(target=run_worker, args=(index, workers, inbox, self._events, api_url),
+                            name=f"shard-{index}", daemon=True)
+            for index, inbox in enumerate(self._inboxes)
+        ]
+
+    async def dispatch(self, updates: list):
+        """Send raw updates to their shards, one batch per shard, waiting while an inbox is full"""
+        batches = defaultdict(list)
+        for data in updates:
+            batches[self.ring.shard(update_chat_id(data))].append(data)
+        for shard, batch in batches.items():
+            await self._put(shard, batch)
+
+    async def _put(self, shard: int, item):
+        inbox = self._inboxes[shard]
+        while True:
+            try:
+                inbox.put_nowait(item)
+                return
+            except queue.Full:
+                self._check_workers()
+                await asyncio.sleep(0.05)
+
+    def _check_workers(self):
+        failed = [process.name for process in self._processes if process.exitcode not in (None, 0)]
+        if failed:
+            raise RuntimeError(f"Shard workers exited: {', '.join(failed)}")
+
+    def _next_event(self) -> tuple:
+        while True:
+            try:
+                return self._events.get(timeout=1)
+            except queue.Empty:
+                self._check_workers()
+
+    async def _wait_events(self, kind: str) -> dict:
+        """Collect one event of the given kind from every worker"""
+        loop = asyncio.get_running_loop()
+        results = {}
+        while len(results) < self.workers:
+            event, index, value = await loop.run_in_executor(None, self._next_event)
+            if event == kind:
+                results[index] = value
+        return results
+
+    async def start(self):
+        """Start workers and wait until all of them are ready"""
+        for process in self._processes:
+            process.start()
+        await self._wait_events('ready')
+
+    async def drain(self) -> dict:
+        """Let workers finish queued updates, return updates processed per worker"""
+        for shard in range(self.workers):
+            await self._put(shard, None)
+        return await self._wait_events('done')
+
+    async def join(self, timeout: float = 30):
+        """Wait for drained workers to shut down"""
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+
+    async def stop(self) -> dict:
+        """Drain workers and wait for them to shut down"""
+        processed = await self.drain()
+        await self.join()
+        return processed
+
+    async def poll(self, token: str = BOT_TOKEN, allowed_updates: list = None):
+        """
+        Long-poll getUpdates and dispatch the raw updates. The next request,
+        which confirms the offset, waits until the batch is in the inboxes.
+        """
+        url = api_server(self.api_url).api_url(token, 'getUpdates')
+        offset = None
+        async with aiohttp.ClientSession() as session:
+            while True:
+                params = {'timeout': POLL_TIMEOUT, 'allowed_updates': allowed_updates}
+                if offset is not None:
+                    params['offset'] = offset
+                try:
+                    async with session.post(url, json=params, timeout=aiohttp.ClientTimeout(POLL_TIMEOUT + 10)) as response:
+                        payload = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logger.error("Error polling updates: %s", e)
+                    await asyncio.sleep(1)
+                    continue
+                if not payload.get('ok'):
+                    logger.error("getUpdates failed: %s", payload.get('description'))
+                    await asyncio.sleep((payload.get('parameters') or {}).get('retry_after', 1))
+                    continue
+                updates = payload['result']
+                if updates:
+                    offset = updates[-1]['update_id'] + 1
+                    await self.dispatch(updates)
+
+    def webhook_app(self, secret: str = None) -> web.Application:
+        """aiohttp application accepting webhook requests and dispatching them"""
+
+        async def handle(request: web.Request) -> web.Response:
+            if secret is not None and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret):
+                return web.Response(status=401)
+            try:
+                data = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            await self.dispatch([data])
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, handle)
+        return app
+
+
+async def run(workers: int, webhook: bool):
+    # Resolves the update types the handlers use; the router is only attached here in this process
+    dp = Dispatcher()
+    dp.include_router(router)
+    allowed_updates = dp.resolve_used_update_types()
+    if webhook and not WEBHOOK_BASE_URL:
+        logger.error("No WEBHOOK_BASE_URL or VERCEL_URL found in environment variables")
+        return
+
+    coordinator = ShardCoordinator(workers)
+    await coordinator.start()
+    try:
+        if not webhook:
+            await coordinator.poll(allowed_updates=allowed_updates)
+            return
+        secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        runner = web.AppRunner(coordinator.webhook_app(secret))
+        await runner.setup()
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        async with create_bot() as bot:
+            await bot.set_webhook(f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=secret,
+                                  allowed_updates=allowed_updates)
+        logger.info("Webhook set, dispatching to %s shards", workers)
+        await asyncio.Event().wait()
+    finally:
+        await coordinator.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the bot with updates sharded over worker processes')
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    parser.add_argument('--webhook', action='store_true', help='receive updates by webhook instead of polling')
+    args = parser.parse_args()
+    asyncio.run(run(args.workers, args.webhook))
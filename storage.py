@@ -0,0 +1,275 @@
+import asyncio
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_BATCH_SIZE, STATE_SYNCHRONOUS
+)
+from logger import logger
+
+# Marks a pending deletion in the write-behind buffer
+_DELETED = object()
+
+
+class StateStore(ABC):
+    """
+    Key-value store for bot state, grouped by namespace.
+    Keys are strings, values anything JSON-serializable.
+    get() and items() may block, they are for startup; while updates are
+    handled read with fetch() and load().
+    """
+
+    @abstractmethod
+    def get(self, namespace: str, key: str):
+        """Value of a key, None if it is not set"""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value):
+        pass
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        pass
+
+    @abstractmethod
+    def items(self, namespace: str):
+        """Iterate over (key, value) pairs of a namespace"""
+
+    async def fetch(self, namespace: str, key: str):
+        """get() without blocking the loop"""
+        return self.get(namespace, key)
+
+    async def load(self, namespace: str, chunk_size: int = 2000):
+        """Yield (key, value) pairs of a namespace in chunks without blocking the loop"""
+        chunk = []
+        for item in self.items(namespace):
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+                await asyncio.sleep(0)
+        if chunk:
+            yield chunk
+
+    async def start(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MemoryStore(StateStore):
+    """Process-local store, state is lost on restart"""
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, namespace: str, key: str):
+        return self._data.get(namespace, {}).get(key)
+
+    def put(self, namespace: str, key: str, value):
+        self._data.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace: str, key: str):
+        self._data.get(namespace, {}).pop(key, None)
+
+    def items(self, namespace: str):
+        return iter(list(self._data.get(namespace, {}).items()))
+
+
+class SqliteStore(StateStore):
+    """
+    SQLite store in WAL mode with write-behind batching. put() and delete()
+    only update an in-memory buffer; a background task commits the buffer
+    every flush_interval seconds, or sooner once batch_size changes pile up,
+    on a dedicated writer thread.
+    """
+
+    def __init__(self, path: str = STATE_DB_PATH, flush_interval: float = STATE_FLUSH_INTERVAL,
+                 batch_size: int = STATE_BATCH_SIZE, synchronous: str = STATE_SYNCHRONOUS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.synchronous = synchronous
+        self.writes = 0
+        self._pending = {}  # (namespace, key) -> value or _DELETED
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state-writer')
+        self._writer = None
+        self._reader = None
+        self._full = asyncio.Event()
+        self._task = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    def open(self):
+        """Open connections and create the schema"""
+        if self._writer is not None:
+            return
+        self._writer = self._connect()
+        self._writer.execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'PRIMARY KEY (namespace, key)) WITHOUT ROWID'
+        )
+        self._reader = self._connect()
+
+    def _check_open(self):
+        if self._reader is None:
+            raise RuntimeError("SqliteStore is not started, reads need start() first")
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, namespace: str, key: str):
+        row = conn.execute('SELECT value FROM state WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, namespace: str, key: str):
+        """Blocking read on the loop thread, for startup"""
+        self._check_open()
+        value = self._pending.get((namespace, key))
+        if value is _DELETED:
+            return None
+        if value is not None:
+            return value
+        return self._select(self._reader, namespace, key)
+
+    async def fetch(self, namespace: str, key: str):
+        """Read on the writer thread, after any batch being committed"""
+        self._check_open()
+        value = self._pending.get((namespace, key))
+        if value is _DELETED:
+            return None
+        if value is not None:
+            return value
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._select, self._writer, namespace, key)
+
+    def put(self, namespace: str, key: str, value):
+        self._pending[(namespace, key)] = value
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def delete(self, namespace: str, key: str):
+        self._pending[(namespace, key)] = _DELETED
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def items(self, namespace: str):
+        """Committed rows merged with the not yet written buffer, a blocking read for startup"""
+        self._check_open()
+        pending = {key: value for (ns, key), value in self._pending.items() if ns == namespace}
+        cursor = self._reader.execute('SELECT key, value FROM state WHERE namespace = ?', (namespace,))
+        for key, value in cursor:
+            if key not in pending:
+                yield key, json.loads(value)
+        for key, value in pending.items():
+            if value is not _DELETED:
+                yield key, value
+
+    def _fetch_chunk(self, cursor: sqlite3.Cursor, size: int) -> list:
+        return [(key, json.loads(value)) for key, value in cursor.fetchmany(size)]
+
+    async def load(self, namespace: str, chunk_size: int = 2000):
+        """Stream committed rows, read and decoded on the writer thread"""
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(self._executor, self._connect)
+        try:
+            cursor = await loop.run_in_executor(
+                self._executor, conn.execute, 'SELECT key, value FROM state WHERE namespace = ?', (namespace,)
+            )
+            while True:
+                rows = await loop.run_in_executor(self._executor, self._fetch_chunk, cursor, chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await loop.run_in_executor(self._executor, conn.close)
+
+    def _write_batch(self, batch: dict):
+        upserts = []
+        deletes = []
+        for (namespace, key), value in batch.items():
+            if value is _DELETED:
+                deletes.append((namespace, key))
+            else:
+                upserts.append((namespace, key, json.dumps(value, ensure_ascii=False)))
+        conn = self._writer
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT INTO state (namespace, key, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value',
+                upserts
+            )
+            conn.executemany('DELETE FROM state WHERE namespace = ? AND key = ?', deletes)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    async def flush(self):
+        """Commit buffered changes"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+            self.writes += len(batch)
+        except Exception as e:
+            logger.error("Error writing state batch of %s changes: %s", len(batch), e)
+            # Keep the batch for the next attempt without overwriting newer changes
+            batch.update(self._pending)
+            self._pending = batch
+
+    async def _run(self):
+        while True:
+            try:
+                async with asyncio.timeout(self.flush_interval):
+                    await self._full.wait()
+            except TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.open)
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer task and commit what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._writer is not None:
+            await self.flush()
+            self._writer.close()
+            self._reader.close()
+            self._writer = None
+            self._reader = None
+
+
+def create_store(backend: str = STATE_BACKEND) -> StateStore:
+    if backend == 'sqlite':
+        return SqliteStore()
+    if backend == 'memory':
+        return MemoryStore()
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+# Shared store instance
+state_store = create_store()
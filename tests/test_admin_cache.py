@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+import admin_cache as admin_cache_module
+from admin_cache import AdminCache
+
+CHAT = -100
+
+
+class FakeBot:
+    def __init__(self, admins=None):
+        self.admins = admins  # None makes getChatAdministrators fail
+        self.calls = []
+
+    async def get_chat_administrators(self, chat_id):
+        self.calls.append('admins')
+        await asyncio.sleep(0)
+        if self.admins is None:
+            raise RuntimeError('admin list not available')
+        return [SimpleNamespace(user=SimpleNamespace(id=user_id)) for user_id in self.admins]
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls.append('member')
+        return SimpleNamespace(status='administrator' if user_id == 1 else 'member')
+
+
+class FakeLogger:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message, *args, **kwargs):
+        self.errors.append(message % args)
+
+
+def test_concurrent_misses_share_one_call():
+    bot = FakeBot(admins=[1])
+    cache = AdminCache()
+
+    async def scenario():
+        return await asyncio.gather(*(cache.is_admin(bot, CHAT, user_id) for user_id in (1, 2, 3)))
+
+    assert asyncio.run(scenario()) == [True, False, False]
+    assert bot.calls == ['admins']
+    assert asyncio.run(cache.is_admin(bot, CHAT, 1))
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'chats': 1}
+
+
+def test_failed_load_is_cached_and_logged_once(monkeypatch):
+    fake_logger = FakeLogger()
+    monkeypatch.setattr(admin_cache_module, 'logger', fake_logger)
+    bot = FakeBot()
+    cache = AdminCache(failure_ttl=60)
+
+    async def scenario():
+        first = await asyncio.gather(*(cache.is_admin(bot, CHAT, user_id) for user_id in (1, 2)))
+        later = [await cache.is_admin(bot, CHAT, user_id) for user_id in (1, 2, 3)]
+        return first + later
+
+    assert asyncio.run(scenario()) == [True, False, True, False, False]
+    # One failed load, every check falls back to getChatMember
+    assert bot.calls.count('admins') == 1
+    assert bot.calls.count('member') == 5
+    assert len(fake_logger.errors) == 1
+
+    # Once the failure expires the list is tried again
+    cache._failed[CHAT] = 0
+    bot.admins = [1]
+    assert asyncio.run(cache.is_admin(bot, CHAT, 1))
+    assert bot.calls.count('admins') == 2
+    assert not cache._failed
@@ -0,0 +1,116 @@
+import json
+import pytest
+from audit import Replay, audit, iter_batches, iter_messages
+from duplicates import signature
+from rules import REASON_COOLDOWN, REASON_DUPLICATE, REASON_PRICE
+from topics import TopicSettings
+
+LISTING = '#продам iPhone 13 128GB, стан ідеальний, повний комплект, ціна 15000 грн, Київ'
+
+
+def message(message_id: int, text, date: int = 1_700_000_000, from_id: str = 'user1', **extra) -> dict:
+    return {'id': message_id, 'type': 'message', 'date': '2023-11-14T22:13:20', 'date_unixtime': str(date),
+            'from': 'Name', 'from_id': from_id, 'text': text, **extra}
+
+
+def write_export(tmp_path, data: dict) -> str:
+    path = tmp_path / 'result.json'
+    # Indented like Telegram Desktop writes it
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding='utf-8')
+    return str(path)
+
+
+# Text that looks like the parser's own markers
+TRICKY = ['#продам "messages": [ ] }, {"id": 5', [{'type': 'bold', 'text': '#куплю'}, ' ціна, 3000']]
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 4096])
+def test_single_chat_export(tmp_path, read_size):
+    messages = [message(n, TRICKY[n % 2]) for n in range(1, 6)]
+    path = write_export(tmp_path, {'name': 'Барахолка', 'type': 'public_supergroup', 'id': 123, 'messages': messages})
+    parsed = list(iter_messages(path, read_size))
+    assert parsed == [((123, 'Барахолка'), item) for item in messages]
+
+
+@pytest.mark.parametrize('read_size', [1, 7, 4096])
+def test_full_export_keeps_chats_apart(tmp_path, read_size):
+    chats = [
+        {'name': 'A', 'type': 'private_supergroup', 'id': 1, 'messages': [message(1, 'x'), message(2, 'y')]},
+        {'name': None, 'type': 'private_group', 'id': 2, 'messages': []},
+        {'name': 'C "quoted"', 'type': 'public_supergroup', 'id': 3, 'messages': [message(1, TRICKY[0])]},
+    ]
+    data = {'about': 'Here is the data you requested.',
+            'personal_information': {'user_id': 99, 'first_name': 'Op'},
+            'chats': {'about': 'chats', 'list': chats}}
+    parsed = [(chat, item['id']) for chat, item in iter_messages(write_export(tmp_path, data), read_size)]
+    assert parsed == [((1, 'A'), 1), ((1, 'A'), 2), ((3, 'C "quoted"'), 1)]
+
+
+def test_truncated_export_fails(tmp_path):
+    path = tmp_path / 'result.json'
+    path.write_text('{"id": 1, "messages": [{"id": 1, "type": "message", "text": "abc', encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_messages(str(path), 8))
+
+
+def test_batches_keep_text_messages(tmp_path):
+    messages = [
+        message(1, [{'type': 'hashtag', 'text': '#продам'}, ' стілець']),
+        {'id': 2, 'type': 'service', 'date': '2023-11-14T22:13:20', 'action': 'join_group_by_link'},
+        message(3, ''),
+        message(4, 'без дати'),
+        message(5, 'текст', date=1_700_000_100),
+    ]
+    del messages[3]['date_unixtime']
+    path = write_export(tmp_path, {'name': 'A', 'type': 'public_supergroup', 'id': 1, 'messages': messages})
+    batches = list(iter_batches(path, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    items = [item for batch in batches for item in batch]
+    assert [(item[0], item[4]) for item in items] == [(1, '#продам стілець'), (4, 'без дати'), (5, 'текст')]
+    assert items[2][1] == 1_700_000_100
+    # Older exports only have the local ISO date
+    assert isinstance(items[1][1], int)
+    assert items[0][5:] == (1, 'A')
+
+
+def test_replay_limits_posts_per_chat_and_user():
+    replay = Replay(TopicSettings(max_messages=2, cooldown_minutes=1), duplicates=False)
+
+    def verdict(date, from_id='u1', chat_id=1, reason=None):
+        return replay.verdict((date, date, from_id, 'Name', 'text', chat_id, 'A'), reason, None)
+
+    assert verdict(0) == 'allowed'
+    # Deleted posts don't count towards the limit
+    assert verdict(1, reason=REASON_PRICE) == REASON_PRICE
+    assert verdict(2) == 'allowed'
+    assert verdict(3) == REASON_COOLDOWN
+    assert verdict(4, from_id='u2') == 'allowed'
+    assert verdict(5, chat_id=2) == 'allowed'
+    # The first post left the window
+    assert verdict(60) == 'allowed'
+
+
+def test_replay_finds_duplicates_per_chat():
+    replay = Replay(TopicSettings(), cooldown=False)
+    sig = signature(LISTING)
+
+    def verdict(message_id, chat_id):
+        return replay.verdict((message_id, message_id, 'u1', 'Name', LISTING, chat_id, 'A'), None, sig)
+
+    assert verdict(1, chat_id=1) == 'allowed'
+    assert verdict(2, chat_id=2) == 'allowed'
+    assert verdict(3, chat_id=1) == REASON_DUPLICATE
+
+
+def test_audit_report(tmp_path):
+    messages = [message(1, LISTING), message(2, '#продам стілець 10 грн', date=1_700_000_001),
+                message(3, 'просто питання', date=1_700_000_002)]
+    path = write_export(tmp_path, {'name': 'A', 'type': 'public_supergroup', 'id': 1, 'messages': messages})
+    output = str(tmp_path / 'report.jsonl')
+    counts = audit(path, output, TopicSettings(min_price=100), workers=1, removed_only=True)
+    assert sum(counts.values()) == 3
+    assert counts['allowed'] == 1
+    with open(output, encoding='utf-8') as f:
+        rows = [json.loads(line) for line in f]
+    assert [row['id'] for row in rows] == [2, 3]
+    assert rows[0]['verdict'] == REASON_PRICE and rows[0]['price'] == 10 and rows[0]['chat_id'] == 1
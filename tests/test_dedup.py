@@ -0,0 +1,129 @@
+import asyncio
+from dedup import NAMESPACE, UpdateDedupMiddleware, UpdateWindow
+from storage import MemoryStore
+
+
+def test_seen_remembers_ids():
+    window = UpdateWindow(size=4)
+    assert not window.seen(10)
+    assert window.seen(10)
+    assert not window.seen(11)
+    assert window.seen(10)
+    assert len(window) == 2
+
+
+def test_out_of_order_ids():
+    window = UpdateWindow(size=4)
+    for update_id in (12, 10, 11):
+        assert not window.seen(update_id)
+    for update_id in (10, 11, 12):
+        assert window.seen(update_id)
+
+
+def test_ring_forgets_oldest():
+    window = UpdateWindow(size=3)
+    for update_id in (1, 2, 3, 4):
+        assert not window.seen(update_id)
+    assert len(window) == 3
+    # 1 was pushed out by 4
+    assert not window.seen(1)
+    assert window.seen(3)
+    assert window.seen(4)
+
+
+def test_repeated_id_keeps_its_slot():
+    window = UpdateWindow(size=2)
+    window.seen(1)
+    window.seen(1)
+    window.seen(2)
+    assert window.seen(1)
+    assert window.seen(2)
+
+
+def test_floor_counts_as_seen():
+    window = UpdateWindow(size=100, floor=500)
+    assert window.handled == 500
+    assert window.seen(500)
+    assert window.seen(401)
+    # Further below the floor than the window, or above it
+    assert not window.seen(400)
+    assert not window.seen(501)
+    assert len(window) == 2
+
+
+def test_floor_after_id_reset():
+    # update_ids start over from a lower value, new ones are not mistaken for old
+    window = UpdateWindow(size=100, floor=1_000_000)
+    assert not window.seen(5)
+    assert window.seen(5)
+
+
+def test_mark_waits_for_unfinished_updates():
+    window = UpdateWindow(100)
+    for update_id in (10, 11, 12):
+        window.begin(update_id)
+    assert window.finish(12)
+    assert window.handled == 9
+    assert not window.finish(11)
+    assert window.finish(10)
+    assert window.handled == 12
+
+
+def test_mark_follows_resets():
+    window = UpdateWindow(100, floor=500)
+    window.begin(7)
+    assert window.finish(7)
+    assert window.handled == 7
+
+
+class FakeBot:
+    id = 1
+    token = '1:TEST'
+
+
+class FakeUpdate:
+    def __init__(self, update_id):
+        self.update_id = update_id
+
+
+def test_out_of_order_completion_across_restart():
+    store = MemoryStore()
+    bot = FakeBot()
+
+    async def first_run():
+        middleware = UpdateDedupMiddleware(size=100, store=store)
+        release = {update_id: asyncio.Event() for update_id in (10, 11, 12)}
+
+        async def handler(event, data):
+            await release[event.update_id].wait()
+
+        # 13 is received but still queued in its chat lane
+        await middleware.expect(bot, [10, 11, 12, 13])
+        tasks = {update_id: asyncio.create_task(middleware(handler, FakeUpdate(update_id), {'bot': bot}))
+                 for update_id in (10, 11, 12)}
+        await asyncio.sleep(0)
+        release[12].set()
+        await tasks[12]
+        marks = [store.get(NAMESPACE, '1')]
+        release[10].set()
+        await tasks[10]
+        marks.append(store.get(NAMESPACE, '1'))
+        # Crash: 11 is still running, 13 never started
+        tasks[11].cancel()
+        await asyncio.gather(tasks[11], return_exceptions=True)
+        return marks
+
+    async def second_run():
+        middleware = UpdateDedupMiddleware(size=100, store=store)
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+
+        for update_id in (10, 11, 12, 13):
+            await middleware(handler, FakeUpdate(update_id), {'bot': bot})
+        return handled
+
+    assert asyncio.run(first_run()) == [9, 10]
+    # 12 is handled twice, but no unfinished update is lost
+    assert asyncio.run(second_run()) == [11, 12, 13]
@@ -0,0 +1,72 @@
+from array import array
+from duplicates import BINS, ROWS, DuplicateDetector, DuplicateIndex, signature, similarity
+
+LISTING = '#продам iPhone 13 128GB, стан ідеальний, повний комплект, ціна 15000 грн, Київ'
+OTHER = '#продам дитячу коляску Cybex у гарному стані, колір сірий, самовивіз з Львова'
+
+
+def make_sig(changed: int = 0, base: int = 0) -> bytes:
+    """Signature sharing all but the last `changed` values with make_sig(0), the first band always matches"""
+    values = [base + i for i in range(BINS)]
+    for i in range(BINS - changed, BINS):
+        values[i] += 1000
+    return array('I', values).tobytes()
+
+
+def test_short_texts_have_no_signature():
+    assert signature('#продам 3000') is None
+
+
+def test_hashtags_punctuation_and_case_are_ignored():
+    assert signature(LISTING) == signature(LISTING.upper().replace('#продам', '#куплю').replace(',', ' !'))
+    assert similarity(signature(LISTING), signature(OTHER)) < 0.5
+
+
+def test_threshold():
+    near = make_sig(changed=ROWS * 2)  # 24 of 32 values shared
+    score = similarity(make_sig(), near)
+    assert score == 0.75
+    at = DuplicateIndex(threshold=0.75)
+    at.add(make_sig(), user_id=1, message_id=10, now=0)
+    assert at.find(near, now=1) == (0.75, 1, 10)
+    above = DuplicateIndex(threshold=0.8)
+    above.add(make_sig(), user_id=1, message_id=10, now=0)
+    assert above.find(near, now=1) is None
+
+
+def test_best_match_wins():
+    index = DuplicateIndex(threshold=0.5)
+    index.add(make_sig(changed=12), user_id=1, message_id=10, now=0)
+    index.add(make_sig(changed=4), user_id=2, message_id=11, now=0)
+    assert index.find(make_sig(), now=1).message_id == 11
+
+
+def test_window_expiry():
+    index = DuplicateIndex(window=3600)
+    index.add(make_sig(), user_id=1, message_id=10, now=0)
+    assert index.find(make_sig(), now=3599) is not None
+    # Expired entries are skipped by find and dropped by the next add
+    assert index.find(make_sig(), now=3600) is None
+    index.add(make_sig(base=5000), user_id=2, message_id=11, now=3600)
+    assert len(index) == 1
+
+
+def test_per_topic_cap_evicts_oldest():
+    index = DuplicateIndex(max_entries=3)
+    for n in range(4):
+        index.add(make_sig(base=n * 5000), user_id=n, message_id=n, now=n)
+    assert len(index) == 3
+    assert index.find(make_sig(base=0), now=4) is None
+    assert index.find(make_sig(base=5000), now=4).message_id == 1
+
+
+def test_detector_keeps_topics_apart():
+    detector = DuplicateDetector(max_entries=10)
+    assert detector.check(-100, 7, LISTING, user_id=1, message_id=10) is None
+    assert detector.check(-100, 8, LISTING, user_id=2, message_id=11) is None
+    match = detector.check(-100, 7, LISTING + '!', user_id=3, message_id=12)
+    assert match is not None and match.message_id == 10 and match.similarity == 1.0
+    # Duplicates are not indexed, the topic still holds only the original
+    assert len(detector) == 2
+    detector.forget(-100, 7)
+    assert detector.check(-100, 7, LISTING, user_id=3, message_id=13) is None
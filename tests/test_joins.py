@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+import joins as joins_module
+from joins import RAID_WINDOW, JoinCoalescer
+
+CHAT = -100
+
+
+class FakeOutbound:
+    def __init__(self):
+        self.sent = []
+        self.deleted = []
+
+    def send(self, chat_id, text, thread_id=None, **kwargs):
+        self.sent.append(text)
+
+    def delete_many(self, chat_id, message_ids, **kwargs):
+        self.deleted.extend(message_ids)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(joins_module, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def fake_outbound(monkeypatch):
+    fake = FakeOutbound()
+    monkeypatch.setattr(joins_module, 'outbound', fake)
+    return fake
+
+
+def run(coalescer: JoinCoalescer, steps):
+    """Call steps(coalescer) on a running loop, then flush what is pending"""
+    async def scenario():
+        steps(coalescer)
+        coalescer.flush_all()
+    asyncio.run(scenario())
+
+
+def test_joins_of_a_window_get_one_welcome(clock, fake_outbound):
+    def steps(coalescer):
+        coalescer.add(CHAT, 7, 1, ['@a'])
+        coalescer.add(CHAT, 7, 2, ['@b', '@a'])
+        coalescer.add(CHAT, 7, 3, [], anonymous=1)
+
+    run(JoinCoalescer(window=60), steps)
+    assert fake_outbound.deleted == [1, 2, 3]
+    assert len(fake_outbound.sent) == 1
+    assert '@a, @b, новий учасник' in fake_outbound.sent[0]
+
+
+def test_raid_drops_welcomes_but_deletes_service_messages(clock, fake_outbound):
+    coalescer = JoinCoalescer(window=60, raid_threshold=3, raid_cooldown=300)
+
+    def steps(coalescer):
+        coalescer.add(CHAT, 7, 1, ['@a', '@b'])
+        # The third and fourth join within a minute cross the threshold
+        coalescer.add(CHAT, 7, 2, ['@c', '@d'])
+        assert coalescer.in_raid(CHAT)
+
+    run(coalescer, steps)
+    # Welcomes collected before the raid was detected are dropped too
+    assert fake_outbound.sent == []
+    assert fake_outbound.deleted == [1, 2]
+
+    # Each burst extends the raid, welcomes resume only after a quiet cooldown
+    clock[0] += 200
+    run(coalescer, lambda coalescer: coalescer.add(CHAT, 7, 3, ['@e', '@f', '@g', '@h']))
+    clock[0] += 299
+    assert coalescer.in_raid(CHAT)
+    clock[0] += 1
+    run(coalescer, lambda coalescer: coalescer.add(CHAT, 7, 4, ['@i']))
+    assert not coalescer.in_raid(CHAT)
+    assert fake_outbound.deleted == [1, 2, 3, 4]
+    assert len(fake_outbound.sent) == 1 and '@i' in fake_outbound.sent[0]
+
+
+def test_joins_spread_over_minutes_are_no_raid(clock, fake_outbound):
+    coalescer = JoinCoalescer(window=60, raid_threshold=3)
+
+    def steps(coalescer):
+        for message_id in range(10):
+            coalescer.add(CHAT, 7, message_id, [f"@u{message_id}", f"@v{message_id}"])
+            clock[0] += RAID_WINDOW
+
+    run(coalescer, steps)
+    assert not coalescer.in_raid(CHAT)
+    assert len(fake_outbound.sent) == 1
+
+
+def test_idle_chats_are_forgotten(clock, fake_outbound):
+    coalescer = JoinCoalescer(window=60, max_chats=2)
+
+    def steps(coalescer):
+        for chat_id in (1, 2, 3):
+            coalescer.add(chat_id, None, 1, ['@a'])
+
+    run(coalescer, steps)
+    # Chats with a pending welcome are kept over max_chats
+    assert len(coalescer) == 3
+    clock[0] += RAID_WINDOW
+    run(coalescer, lambda coalescer: coalescer.add(4, None, 1, ['@a']))
+    assert len(coalescer) == 1
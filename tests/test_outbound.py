@@ -0,0 +1,176 @@
+import asyncio
+import pytest
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import SendMessage
+import outbound as outbound_module
+from outbound import PRIORITY_CLEANUP, PRIORITY_MODERATION, PRIORITY_NOTICE, OutboundDispatcher, TokenBucket
+from scheduler import DeletionScheduler
+from storage import MemoryStore
+
+CHAT = -100
+
+
+class FakeBot:
+    """Records API calls in the order they are made"""
+
+    def __init__(self, fail_sends: int = 0, fail_deletes: int = 0):
+        self.calls = []
+        self.fail_sends = fail_sends
+        self.fail_deletes = fail_deletes
+
+    async def send_message(self, chat_id, text, message_thread_id=None, reply_parameters=None):
+        self.calls.append(('send', chat_id, text))
+        if self.fail_sends:
+            self.fail_sends -= 1
+            raise TelegramNetworkError(SendMessage(chat_id=chat_id, text=text), 'timeout')
+        return text
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(('delete', chat_id, message_id))
+        if self.fail_deletes:
+            self.fail_deletes -= 1
+            raise TelegramNetworkError(SendMessage(chat_id=chat_id, text=''), 'timeout')
+        return True
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(('delete_many', chat_id, list(message_ids)))
+        return True
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.updated = 0.0
+    for _ in range(3):
+        assert bucket.delay(0.0) == 0
+        bucket.consume()
+    assert bucket.delay(0.0) == pytest.approx(0.5)
+    assert bucket.delay(0.5) == 0
+    # Refill stops at capacity
+    assert bucket.delay(100.0) == 0
+    assert bucket.tokens == 3
+
+
+def test_bucket_block():
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.block(60)
+    assert bucket.delay(bucket.blocked_until - 1) == pytest.approx(1)
+
+
+def test_jobs_run_in_priority_order():
+    async def scenario():
+        dispatcher = OutboundDispatcher(workers=1)
+        bot = FakeBot()
+        dispatcher.delete(CHAT, 1, priority=PRIORITY_CLEANUP)
+        dispatcher.send(CHAT, 'notice', priority=PRIORITY_NOTICE)
+        dispatcher.delete(CHAT, 2, priority=PRIORITY_MODERATION)
+        dispatcher.send(CHAT, 'reply')
+        dispatcher.start(bot)
+        assert await dispatcher.drain(1)
+        await dispatcher.stop()
+        return bot.calls
+
+    calls = run(scenario())
+    # Deletes first, each kind in priority order, then in submission order
+    assert calls == [('delete', CHAT, 2), ('delete', CHAT, 1), ('send', CHAT, 'reply'), ('send', CHAT, 'notice')]
+
+
+def test_sends_progress_during_delete_backlog():
+    async def scenario():
+        dispatcher = OutboundDispatcher(delete_rate=1, delete_burst=1, workers=2)
+        bot = FakeBot()
+        for message_id in range(50):
+            dispatcher.delete(CHAT, message_id)
+        sent = dispatcher.send(CHAT, 'welcome')
+        dispatcher.start(bot)
+        await asyncio.wait_for(sent, 1)
+        left = len(dispatcher)
+        await dispatcher.stop(drain_timeout=0)
+        return left
+
+    # The send went out while nearly all deletes still wait for their budget
+    assert run(scenario()) >= 45
+
+
+def test_chat_limit_does_not_block_other_chats():
+    async def scenario():
+        dispatcher = OutboundDispatcher(chat_rate=0.01, chat_burst=1, workers=1)
+        bot = FakeBot()
+        dispatcher.send(CHAT, 'first')
+        dispatcher.send(CHAT, 'throttled')
+        other = dispatcher.send(CHAT - 1, 'other chat')
+        dispatcher.start(bot)
+        await asyncio.wait_for(other, 1)
+        await dispatcher.stop(drain_timeout=0)
+        return bot.calls
+
+    assert run(scenario()) == [('send', CHAT, 'first'), ('send', CHAT - 1, 'other chat')]
+
+
+def test_notices_are_coalesced():
+    async def scenario():
+        dispatcher = OutboundDispatcher(coalesce_window=0.05)
+        bot = FakeBot()
+        dispatcher.start(bot)
+        for username in ('@a', '@b', '@a'):
+            dispatcher.notify(CHAT, 7, 'price', username, min_price=3000)
+        dispatcher.notify(CHAT, 8, 'price', '@c', min_price=3000)
+        await asyncio.sleep(0.1)
+        assert await dispatcher.drain(1)
+        await dispatcher.stop()
+        return bot.calls, dispatcher.stats['coalesced']
+
+    calls, coalesced = run(scenario())
+    texts = sorted(text for _, _, text in calls)
+    assert len(texts) == 2
+    assert texts[0].startswith('@a, @b, ') and texts[1].startswith('@c, ')
+    assert coalesced == 2
+
+
+def test_network_error_fails_send_but_retries_delete(monkeypatch):
+    monkeypatch.setattr(outbound_module, 'OUTBOUND_BACKOFF', 0.001)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher()
+        bot = FakeBot(fail_sends=1, fail_deletes=1)
+        sent = dispatcher.send(CHAT, 'hello')
+        deleted = dispatcher.delete(CHAT, 5)
+        dispatcher.start(bot)
+        assert await dispatcher.drain(1)
+        await dispatcher.stop()
+        with pytest.raises(TelegramNetworkError):
+            sent.result()
+        return bot.calls, deleted.result(), dispatcher.stats
+
+    calls, deleted, stats = run(scenario())
+    # The send may have gone out with the response lost, it's not repeated
+    assert calls.count(('send', CHAT, 'hello')) == 1
+    assert calls.count(('delete', CHAT, 5)) == 2
+    assert deleted is True
+    assert stats['failed'] == 1 and stats['retries'] == 1
+
+
+def test_stop_hands_unfinished_deletes_to_scheduler(monkeypatch):
+    scheduler = DeletionScheduler(store=MemoryStore())
+    monkeypatch.setattr(outbound_module, 'deletion_scheduler', scheduler)
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(delete_rate=0.01, delete_burst=1, chat_rate=0.01, chat_burst=1)
+        bot = FakeBot()
+        dispatcher.delete(CHAT, 1)
+        dispatcher.delete(CHAT, 2)
+        dispatcher.delete_many(CHAT, [3, 4])
+        dispatcher.send(CHAT, 'first')
+        dropped = dispatcher.send(CHAT, 'throttled')
+        dispatcher.start(bot)
+        await dispatcher.stop(drain_timeout=0.1)
+        return bot.calls, dropped, len(dispatcher)
+
+    calls, dropped, left = run(scenario())
+    assert ('delete', CHAT, 1) in calls
+    assert left == 0 and dropped.cancelled()
+    assert sorted(message_id for _, _, message_id in scheduler._heap) == [2, 3, 4]
+    assert sorted(key for key, _ in scheduler.store.items('deletions')) == ['-100:2', '-100:3', '-100:4']
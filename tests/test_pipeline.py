@@ -0,0 +1,121 @@
+import asyncio
+from pipeline import ChatLanes, update_chat_id
+
+
+def test_update_chat_id():
+    assert update_chat_id({'update_id': 1, 'message': {'chat': {'id': -100}, 'from': {'id': 5}}}) == -100
+    assert update_chat_id({'update_id': 1, 'callback_query': {'from': {'id': 5}, 'message': {'chat': {'id': -7}}}}) == -7
+    assert update_chat_id({'update_id': 1, 'inline_query': {'from': {'id': 5}}}) == 5
+    assert update_chat_id({'update_id': 1}) == 0
+
+
+def test_chat_order_and_concurrency_limit():
+    async def scenario():
+        done = []
+        running = 0
+        peak = 0
+
+        async def process(update):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01 if update[1] == 0 else 0)
+            running -= 1
+            done.append(update)
+
+        lanes = ChatLanes(process, concurrency=2, max_pending=100, max_lane_depth=100)
+        for n in range(3):
+            for chat_id in (1, 2, 3):
+                lanes.submit(chat_id, (chat_id, n))
+        await lanes.join()
+        return done, peak, lanes.processed, len(lanes)
+
+    done, peak, processed, pending = asyncio.run(scenario())
+    for chat_id in (1, 2, 3):
+        assert [n for chat, n in done if chat == chat_id] == [0, 1, 2]
+    assert peak == 2
+    assert (processed, pending) == (9, 0)
+
+
+def test_failed_update_does_not_stop_its_lane():
+    async def scenario():
+        done = []
+
+        async def process(update):
+            if update['update_id'] == 1:
+                raise ValueError('broken')
+            done.append(update['update_id'])
+
+        lanes = ChatLanes(process)
+        for update_id in (1, 2):
+            lanes.submit(1, {'update_id': update_id})
+        await lanes.join()
+        return done
+
+    assert asyncio.run(scenario()) == [2]
+
+
+def test_saturated_until_a_quarter_is_free():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def process(update):
+            await gate.wait()
+
+        lanes = ChatLanes(process, concurrency=0, max_pending=8, max_lane_depth=100)
+        for chat_id in range(7):
+            lanes.submit(chat_id, chat_id)
+        states = [lanes.saturated]
+        lanes.submit(7, 7)
+        states.append(lanes.saturated)
+        waiter = asyncio.create_task(lanes.wait_for_room())
+        gate.set()
+        # Room again once pending drops to 6, before every update is done
+        await asyncio.wait_for(waiter, 1)
+        states.append(len(lanes) <= 6)
+        await lanes.join()
+        states.append(lanes.saturated)
+        return states
+
+    assert asyncio.run(scenario()) == [False, True, True, False]
+
+
+def test_deep_lane_saturates():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def process(update):
+            await gate.wait()
+
+        lanes = ChatLanes(process, max_pending=100, max_lane_depth=3)
+        lanes.submit(1, 'a')
+        lanes.submit(1, 'b')
+        lanes.submit(2, 'c')
+        states = [lanes.saturated]
+        lanes.submit(1, 'd')
+        states.append(lanes.saturated)
+        gate.set()
+        await lanes.join()
+        states.append(lanes.saturated)
+        return states
+
+    assert asyncio.run(scenario()) == [False, True, False]
+
+
+def test_cancel_drops_queued_updates():
+    async def scenario():
+        started = []
+
+        async def process(update):
+            started.append(update)
+            await asyncio.sleep(10)
+
+        lanes = ChatLanes(process, concurrency=1, max_pending=2, max_lane_depth=100)
+        for update in range(3):
+            lanes.submit(update, update)
+        await asyncio.sleep(0)
+        await lanes.cancel()
+        await asyncio.wait_for(lanes.join(), 1)
+        return started, len(lanes), lanes.saturated
+
+    assert asyncio.run(scenario()) == ([0], 0, False)
@@ -0,0 +1,125 @@
+import pytest
+import rate_limiter
+from rate_limiter import NAMESPACE, RateLimiter
+from storage import MemoryStore
+
+KEY = (-100, 7, 1)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(clock):
+    return RateLimiter(limit=3, window=60, max_keys=100, store=MemoryStore())
+
+
+def test_limit_within_window(limiter, clock):
+    for _ in range(3):
+        assert limiter.hit(KEY)
+        clock.now += 1
+    assert not limiter.hit(KEY)
+    assert limiter.remaining(KEY) == 0
+
+
+def test_window_slides(limiter, clock):
+    for _ in range(3):
+        assert limiter.hit(KEY)
+        clock.now += 10
+    assert not limiter.hit(KEY)
+    # The first post leaves the window, one slot frees up
+    clock.now = 1000.0 + 60
+    assert limiter.hit(KEY)
+    assert not limiter.hit(KEY)
+    clock.now = 1000.0 + 80
+    assert limiter.remaining(KEY) == 2
+
+
+def test_denied_hit_is_not_recorded(limiter, clock):
+    for _ in range(3):
+        limiter.hit(KEY)
+    for _ in range(5):
+        assert not limiter.hit(KEY)
+    clock.now += 60
+    assert limiter.remaining(KEY) == 3
+
+
+def test_keys_are_independent(limiter):
+    for _ in range(3):
+        limiter.hit(KEY)
+    assert not limiter.hit(KEY)
+    assert limiter.hit((-100, 7, 2))
+    assert limiter.hit((-100, 8, 1))
+
+
+def test_refund_frees_a_slot(limiter, clock):
+    for _ in range(3):
+        limiter.hit(KEY)
+        clock.now += 1
+    limiter.refund(KEY)
+    assert limiter.remaining(KEY) == 1
+    assert limiter.hit(KEY)
+    assert not limiter.hit(KEY)
+
+
+def test_refund_drops_the_latest_post(limiter, clock):
+    limiter.hit(KEY)
+    clock.now += 30
+    limiter.hit(KEY)
+    limiter.refund(KEY)
+    # Only the first post is left, it expires 60 s after it was made
+    clock.now = 1000.0 + 60
+    assert limiter.remaining(KEY) == 3
+
+
+def test_refund_last_post_forgets_key(limiter):
+    limiter.hit(KEY)
+    limiter.refund(KEY)
+    assert len(limiter) == 0
+    assert list(limiter.store.items(NAMESPACE)) == []
+
+
+def test_refund_unknown_key(limiter):
+    limiter.refund(KEY)
+    assert len(limiter) == 0
+    assert limiter.remaining(KEY) == 3
+
+
+def test_per_call_limit_and_window(limiter, clock):
+    assert limiter.hit(KEY, limit=1, window=600)
+    assert not limiter.hit(KEY, limit=1, window=600)
+    clock.now += 300
+    assert not limiter.hit(KEY, limit=1, window=600)
+    clock.now += 300
+    assert limiter.hit(KEY, limit=1, window=600)
+
+
+def test_state_is_persisted(limiter, clock):
+    limiter.hit(KEY)
+    clock.now += 5
+    limiter.hit(KEY)
+    stored = limiter.store.get(NAMESPACE, '-100:7:1')
+    assert len(stored) == 2
+    assert stored[1] - stored[0] == pytest.approx(5)
+
+
+def test_max_keys_evicts_least_recent(clock):
+    limiter = RateLimiter(limit=1, window=60, max_keys=2, store=MemoryStore())
+    for user_id in (1, 2, 3):
+        assert limiter.hit((-100, 7, user_id))
+    assert len(limiter) == 2
+    # The first key was evicted and may post again
+    assert limiter.hit((-100, 7, 1))
+    assert limiter.store.get(NAMESPACE, '-100:7:2') is None
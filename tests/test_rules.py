@@ -0,0 +1,84 @@
+import pytest
+from rules import REASON_HASHTAGS, REASON_PRICE, RuleEngine, extract_price
+
+
+@pytest.mark.parametrize('text, price', [
+    ('3000', 3000),
+    ('3 000 грн', 3000),
+    ('3\u00a0000 грн', 3000),
+    ('1 500 000 грн', 1_500_000),
+    ('3,500', 3500),
+    ('3.500', 3500),
+    ('3000грн', 3000),
+    ('3000₴', 3000),
+    ('5000 uah', 5000),
+    ('3k', 3000),
+    ('3к', 3000),
+    ('3.5k', 3500),
+    ('3,5к', 3500),
+    ('3 тис', 3000),
+    ('no price', 0),
+])
+def test_price_formats(text, price):
+    assert extract_price(text) == price
+
+
+@pytest.mark.parametrize('text, price', [
+    ('телефон +380 67 123 45 67 ціна 2500', 2500),
+    ('(067) 123-45-67, ціна 4000', 4000),
+    ('0671234567 3000', 3000),
+    ('380671234567 ціна 900', 900),
+])
+def test_phone_numbers_are_not_prices(text, price):
+    assert extract_price(text) == price
+
+
+@pytest.mark.parametrize('text, price', [
+    ('2 шт по 3000', 3000),
+    ('продам за 2,5к', 2500),
+    ('ціна: 4500, стан 10/10', 4500),
+    ('рік 2021, пробіг 80000, ціна - 1 500 грн', 1500),
+])
+def test_number_after_keyword_is_the_price(text, price):
+    assert extract_price(text) == price
+
+
+def test_number_with_unit_wins_over_bare_numbers():
+    assert extract_price('iphone 13, 128 gb, ціна 5000 грн') == 5000
+    assert extract_price('ціна 900 грн, пробіг 120000') == 900
+    assert extract_price('2020 рік, 500 грн') == 500
+
+
+@pytest.mark.parametrize('text, price', [
+    ('#продам 500 гривень, стан 10/10, 2020 рік', 500),
+    ('#продам 700 гривні, 2019 рік', 700),
+    ('#продам 1 гривня', 1),
+])
+def test_written_out_currency(text, price):
+    assert extract_price(text) == price
+
+
+def test_first_bare_number_is_the_price():
+    # A larger year, mileage or model number later on must not raise the price
+    assert extract_price('#продам 500, стан 10/10, 2020 рік') == 500
+    assert extract_price('#продам велосипед 800 пробіг 15000') == 800
+
+
+def test_larger_number_does_not_pass_min_price():
+    verdict = RuleEngine(min_price=3000).check('#продам 500 гривень, стан 10/10, 2020 рік')
+    assert not verdict.allowed and verdict.reason == REASON_PRICE and verdict.price == 500
+
+
+def test_check_requires_a_hashtag():
+    verdict = RuleEngine().check('продам телефон 5000')
+    assert not verdict.allowed and verdict.reason == REASON_HASHTAGS
+
+
+def test_check_price_only_for_sale_posts():
+    engine = RuleEngine(min_price=3000)
+    assert engine.check('#продам ціна 5000').allowed
+    assert engine.check('#ПРОДАМ 3к').price == 3000
+    verdict = engine.check('#продам ціна 2000')
+    assert not verdict.allowed and verdict.reason == REASON_PRICE and verdict.price == 2000
+    verdict = engine.check('#куплю за 100')
+    assert verdict.allowed and verdict.price is None
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+from aiogram.methods import DeleteMessages
+from scheduler import NAMESPACE, DeletionScheduler
+from storage import MemoryStore
+
+CHAT = -100
+
+
+class Deleter:
+    """deleteMessages stand-in failing the first `failures` calls with `error`"""
+
+    def __init__(self, failures: int = 0, error=TelegramNetworkError):
+        self.calls = []
+        self.failures = failures
+        self.error = error
+
+    async def __call__(self, chat_id, message_ids):
+        self.calls.append((chat_id, list(message_ids)))
+        if self.failures:
+            self.failures -= 1
+            raise self.error(DeleteMessages(chat_id=chat_id, message_ids=message_ids), 'failed')
+
+
+def stored(scheduler: DeletionScheduler) -> list:
+    return sorted(key for key, _ in scheduler.store.items(NAMESPACE))
+
+
+def test_pop_due_groups_per_chat_and_keeps_store_rows():
+    scheduler = DeletionScheduler(store=MemoryStore())
+    scheduler.schedule(CHAT, 1, 0)
+    scheduler.schedule(CHAT - 1, 2, 0)
+    scheduler.schedule(CHAT, 3, 0)
+    scheduler.schedule(CHAT, 4, 60)
+    due = scheduler.pop_due()
+    assert due == {CHAT: [1, 3], CHAT - 1: [2]}
+    assert len(scheduler) == 1
+    # Rows go only once the messages are deleted
+    assert stored(scheduler) == ['-100:1', '-100:3', '-100:4', '-101:2']
+
+
+def test_flush_due_batches_and_forgets_deleted():
+    async def scenario():
+        scheduler = DeletionScheduler(store=MemoryStore(), batch_size=2)
+        scheduler._delete_messages = deleter = Deleter()
+        for message_id in range(5):
+            scheduler.schedule(CHAT, message_id, 0)
+        scheduler.schedule(CHAT, 10, 60)
+        return scheduler, deleter, await scheduler.flush_due()
+
+    scheduler, deleter, deleted = asyncio.run(scenario())
+    assert deleted == 5
+    assert deleter.calls == [(CHAT, [0, 1]), (CHAT, [2, 3]), (CHAT, [4])]
+    assert stored(scheduler) == ['-100:10']
+
+
+def test_failed_batch_is_retried_with_backoff():
+    async def scenario():
+        scheduler = DeletionScheduler(store=MemoryStore(), retry_backoff=30)
+        scheduler._delete_messages = deleter = Deleter(failures=1)
+        scheduler.schedule(CHAT, 1, 0)
+        scheduler.schedule(CHAT, 2, 0)
+        deleted = await scheduler.flush_due()
+        return scheduler, deleter, deleted
+
+    scheduler, deleter, deleted = asyncio.run(scenario())
+    assert deleted == 0
+    assert stored(scheduler) == ['-100:1', '-100:2']
+    # Back in the queue, due after the backoff
+    assert len(scheduler) == 2
+    assert not scheduler.pop_due()
+    assert 25 < scheduler._heap[0][0] - time.time() <= 30
+
+    # Once the backoff is over the batch goes through and the rows are gone
+    scheduler._heap = [(0, chat_id, message_id) for _, chat_id, message_id in scheduler._heap]
+    assert asyncio.run(scheduler.flush_due()) == 2
+    assert deleter.calls == [(CHAT, [1, 2])] * 2
+    assert stored(scheduler) == []
+    assert scheduler._attempts == {}
+
+
+def test_gives_up_after_max_retries():
+    async def scenario():
+        scheduler = DeletionScheduler(store=MemoryStore(), retry_backoff=0, max_retries=2)
+        scheduler._delete_messages = deleter = Deleter(failures=10)
+        scheduler.schedule(CHAT, 1, 0)
+        for _ in range(4):
+            await scheduler.flush_due()
+        return scheduler, deleter
+
+    scheduler, deleter = asyncio.run(scenario())
+    assert len(deleter.calls) == 3
+    assert len(scheduler) == 0 and stored(scheduler) == []
+
+
+def test_permanent_error_is_not_retried():
+    async def scenario():
+        scheduler = DeletionScheduler(store=MemoryStore())
+        scheduler._delete_messages = deleter = Deleter(failures=1, error=TelegramBadRequest)
+        scheduler.schedule(CHAT, 1, 0)
+        deleted = await scheduler.flush_due()
+        return scheduler, deleter, deleted
+
+    scheduler, deleter, deleted = asyncio.run(scenario())
+    assert deleted == 0
+    assert len(scheduler) == 0 and stored(scheduler) == []
+
+
+def test_load_restores_owned_jobs_without_duplicates():
+    store = MemoryStore()
+    previous = DeletionScheduler(store=store)
+    previous.schedule(CHAT, 1, 60)
+    previous.schedule(CHAT - 1, 2, 60)
+    scheduler = DeletionScheduler(store=store)
+    # Already queued by this run, e.g. handed over before the load
+    scheduler._heap = [job for job in previous._heap if job[1] == CHAT]
+    scheduler.load(owns_chat=lambda chat_id: chat_id == CHAT)
+    assert [(chat_id, message_id) for _, chat_id, message_id in scheduler._heap] == [(CHAT, 1)]
+
+
+def test_runner_deletes_when_due():
+    async def scenario():
+        scheduler = DeletionScheduler(store=MemoryStore())
+        deleter = Deleter()
+        scheduler.start(deleter)
+        scheduler.schedule(CHAT, 1, 0.05)
+        await asyncio.sleep(0.02)
+        early = list(deleter.calls)
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+        return scheduler, early, deleter.calls
+
+    scheduler, early, calls = asyncio.run(scenario())
+    assert early == []
+    assert calls == [(CHAT, [1])]
+    assert stored(scheduler) == []
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+from storage import MemoryStore, SqliteStore, StateStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_incomplete_backend_cannot_be_created():
+    class NoItems(StateStore):
+        def get(self, namespace, key):
+            return None
+
+        def put(self, namespace, key, value):
+            pass
+
+        def delete(self, namespace, key):
+            pass
+
+    with pytest.raises(TypeError):
+        NoItems()
+
+
+def test_memory_store_fetch():
+    store = MemoryStore()
+    store.put('ns', 'a', [1, 2])
+    assert run(store.fetch('ns', 'a')) == [1, 2]
+    assert run(store.fetch('ns', 'b')) is None
+
+
+def test_reads_need_start(tmp_path):
+    store = SqliteStore(str(tmp_path / 'state.db'))
+    with pytest.raises(RuntimeError):
+        store.get('ns', 'a')
+    with pytest.raises(RuntimeError):
+        list(store.items('ns'))
+
+
+def test_write_behind_and_restart(tmp_path):
+    path = str(tmp_path / 'state.db')
+
+    async def first_run():
+        store = SqliteStore(path, flush_interval=60)
+        await store.start()
+        store.put('ns', 'a', {'x': 1})
+        store.put('ns', 'b', 'кирилиця')
+        store.put('other', 'a', 3)
+        # Buffered, not written yet, but visible to reads
+        assert store.writes == 0
+        assert store.get('ns', 'a') == {'x': 1}
+        await store.flush()
+        assert store.writes == 3
+        store.delete('ns', 'a')
+        store.put('ns', 'c', 4)
+        assert store.get('ns', 'a') is None
+        assert sorted(store.items('ns')) == [('b', 'кирилиця'), ('c', 4)]
+        # stop() commits what is left
+        await store.stop()
+
+    async def second_run():
+        store = SqliteStore(path)
+        await store.start()
+        try:
+            loaded = [item for chunk in [chunk async for chunk in store.load('ns', chunk_size=1)] for item in chunk]
+            return sorted(store.items('ns')), sorted(loaded), await store.fetch('other', 'a')
+        finally:
+            await store.stop()
+
+    run(first_run())
+    items, loaded, other = run(second_run())
+    assert items == loaded == [('b', 'кирилиця'), ('c', 4)]
+    assert other == 3
+
+
+def test_full_buffer_commits_early(tmp_path):
+    async def scenario():
+        store = SqliteStore(str(tmp_path / 'state.db'), flush_interval=60, batch_size=10)
+        await store.start()
+        for i in range(10):
+            store.put('ns', str(i), i)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if store.writes:
+                break
+        writes = store.writes
+        await store.stop()
+        return writes
+
+    assert run(scenario()) == 10
+
+
+def test_fetch_sees_pending_and_committed(tmp_path):
+    async def scenario():
+        store = SqliteStore(str(tmp_path / 'state.db'), flush_interval=60)
+        await store.start()
+        store.put('ns', 'a', 1)
+        pending = await store.fetch('ns', 'a')
+        await store.flush()
+        committed = await store.fetch('ns', 'a')
+        store.delete('ns', 'a')
+        deleted = await store.fetch('ns', 'a')
+        await store.stop()
+        return pending, committed, deleted
+
+    assert run(scenario()) == (1, 1, None)
+
+
+def test_failed_batch_is_kept_without_overwriting_newer_changes(tmp_path, monkeypatch):
+    async def scenario():
+        store = SqliteStore(str(tmp_path / 'state.db'), flush_interval=60)
+        await store.start()
+        write_batch = store._write_batch
+        calls = []
+
+        def failing_once(batch):
+            calls.append(dict(batch))
+            if len(calls) == 1:
+                # A newer change arrives while the batch is being written
+                store.put('ns', 'a', 'new')
+                raise OSError('disk full')
+            write_batch(batch)
+
+        monkeypatch.setattr(store, '_write_batch', failing_once)
+        store.put('ns', 'a', 'old')
+        store.put('ns', 'b', 'kept')
+        await store.flush()
+        assert store.writes == 0
+        await store.flush()
+        result = sorted(store.items('ns'))
+        await store.stop()
+        return result, calls
+
+    result, calls = run(scenario())
+    assert result == [('a', 'new'), ('b', 'kept')]
+    assert calls[1] == {('ns', 'a'): 'new', ('ns', 'b'): 'kept'}
@@ -0,0 +1,196 @@
+from dataclasses import dataclass, field, replace
+from aiogram import types
+from aiogram.filters import BaseFilter
+from config import (
+    REQUIRED_HASHTAGS, MIN_PRICE, SALE_HASHTAG, MESSAGE_COOLDOWN_MINUTES, MAX_MESSAGES_BEFORE_COOLDOWN
+)
+from logger import logger
+from rules import RuleEngine
+from storage import StateStore, state_store
+
+# Store namespace of moderated topics, keyed by "chat_id:thread_id"
+NAMESPACE = 'topics'
+
+
+@dataclass(frozen=True, slots=True)
+class TopicSettings:
+    """Moderation rules of a single topic"""
+    hashtags: tuple = tuple(REQUIRED_HASHTAGS)
+    min_price: int = MIN_PRICE
+    cooldown_minutes: int = MESSAGE_COOLDOWN_MINUTES
+    max_messages: int = MAX_MESSAGES_BEFORE_COOLDOWN
+    sale_hashtag: str = SALE_HASHTAG
+    # Compiled hashtag and price rules, built once per settings instance
+    rules: RuleEngine = field(init=False, repr=False, compare=False)
+    # Values for the violation notice templates
+    notice_params: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'rules', RuleEngine(self.hashtags, self.min_price, self.sale_hashtag))
+        object.__setattr__(self, 'notice_params', {
+            'cooldown_minutes': self.cooldown_minutes,
+            'max_messages': self.max_messages,
+            'hashtags': ', '.join(self.hashtags),
+            'min_price': self.min_price,
+        })
+
+    def validate(self):
+        """Raise ValueError unless the rules can work, shared by /resale_topic and the rules file"""
+        if not self.hashtags or not all(isinstance(tag, str) and tag.startswith('#') and len(tag) > 1
+                                        for tag in self.hashtags):
+            raise ValueError("hashtags must be a non-empty list of #tags")
+        for name in ('min_price', 'cooldown_minutes'):
+            if getattr(self, name) < 0:
+                raise ValueError(f"{name} must not be negative")
+        if self.max_messages < 1:
+            raise ValueError("max_messages must be at least 1")
+        # Otherwise the price check would never run
+        if self.sale_hashtag.lower() not in self.rules.hashtags:
+            raise ValueError(f"sale_hashtag {self.sale_hashtag} is not one of the hashtags")
+
+    @property
+    def cooldown_seconds(self) -> int:
+        return self.cooldown_minutes * 60
+
+    def to_dict(self) -> dict:
+        return {
+            'hashtags': list(self.hashtags),
+            'min_price': self.min_price,
+            'cooldown_minutes': self.cooldown_minutes,
+            'max_messages': self.max_messages,
+            'sale_hashtag': self.sale_hashtag,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TopicSettings':
+        return cls(**_decode(data))
+
+    @staticmethod
+    def parse_args(args: str) -> dict:
+        """
+        Settings changed by command arguments like
+        "min_price=5000 cooldown=30 max_messages=2 hashtags=#продаю,#куплю sale_hashtag=#продаю"
+        Raises ValueError on unknown keys or values that aren't numbers; the
+        settings they result in are checked by validate().
+        """
+        changes = {}
+        for item in (args or '').split():
+            key, sep, value = item.partition('=')
+            if not sep or not value:
+                raise ValueError(f"Invalid argument: {item}")
+            if key == 'hashtags':
+                tags = tuple(tag if tag.startswith('#') else f"#{tag}" for tag in value.split(',') if tag)
+                if not tags:
+                    raise ValueError("Empty hashtag list")
+                changes['hashtags'] = tags
+            elif key == 'sale_hashtag':
+                changes['sale_hashtag'] = value if value.startswith('#') else f"#{value}"
+            elif key in ('min_price', 'cooldown', 'max_messages'):
+                changes['cooldown_minutes' if key == 'cooldown' else key] = int(value)
+            else:
+                raise ValueError(f"Unknown setting: {key}")
+        return changes
+
+    def with_args(self, args: str) -> 'TopicSettings':
+        """Return copy updated from command arguments, see parse_args. Raises ValueError if it is invalid"""
+        settings = replace(self, **self.parse_args(args))
+        settings.validate()
+        return settings
+
+
+def _decode(data: dict) -> dict:
+    """Settings from their JSON form"""
+    data = dict(data)
+    if 'hashtags' in data:
+        data['hashtags'] = tuple(data['hashtags'])
+    return data
+
+
+class TopicRegistry:
+    """
+    Moderated topics keyed by (chat_id, thread_id), mirrored to the state store.
+    A topic stores only the settings overridden by /resale_topic, the rest
+    comes from the defaults; effective settings are rebuilt when they change.
+    """
+
+    def __init__(self, store: StateStore = state_store, defaults: TopicSettings = None):
+        self.store = store
+        self.defaults = defaults or TopicSettings()
+        self._overrides = {}
+        self._topics = {}
+
+    def __len__(self):
+        return len(self._topics)
+
+    def __iter__(self):
+        return iter(self._topics.items())
+
+    def get(self, chat_id: int, thread_id: int):
+        return self._topics.get((chat_id, thread_id))
+
+    def overrides(self, chat_id: int, thread_id: int) -> dict:
+        return dict(self._overrides.get((chat_id, thread_id), {}))
+
+    def set(self, chat_id: int, thread_id: int, overrides: dict = None) -> TopicSettings:
+        """Moderate a topic with the given overrides of the defaults, return its settings. Raises ValueError if invalid"""
+        overrides = dict(overrides or {})
+        settings = replace(self.defaults, **overrides)
+        settings.validate()
+        self._overrides[(chat_id, thread_id)] = overrides
+        self._topics[(chat_id, thread_id)] = settings
+        self.store.put(NAMESPACE, f"{chat_id}:{thread_id}", overrides)
+        return settings
+
+    def remove(self, chat_id: int, thread_id: int) -> bool:
+        self.store.delete(NAMESPACE, f"{chat_id}:{thread_id}")
+        self._overrides.pop((chat_id, thread_id), None)
+        return self._topics.pop((chat_id, thread_id), None) is not None
+
+    def set_defaults(self, defaults: TopicSettings):
+        """
+        Rebuild every topic on new defaults, swapping them in at once.
+        Raises ValueError, changing nothing, if a topic's overrides don't work with them.
+        """
+        topics = {}
+        for (chat_id, thread_id), overrides in self._overrides.items():
+            settings = replace(defaults, **overrides)
+            try:
+                settings.validate()
+            except ValueError as e:
+                raise ValueError(f"topic {chat_id}:{thread_id}: {e}") from None
+            topics[(chat_id, thread_id)] = settings
+        self.defaults = defaults
+        self._topics = topics
+
+    def load(self):
+        """Restore topics saved by a previous run"""
+        for key, data in self.store.items(NAMESPACE):
+            try:
+                chat_id, thread_id = key.split(':')
+                overrides = _decode(data)
+                settings = replace(self.defaults, **overrides)
+                settings.validate()
+                self._overrides[(int(chat_id), int(thread_id))] = overrides
+                self._topics[(int(chat_id), int(thread_id))] = settings
+            except Exception as e:
+                logger.error("Error loading topic %s: %s", key, e)
+        logger.info("Loaded %s moderated topics", len(self._topics))
+
+
+# Shared registry instance
+topic_registry = TopicRegistry()
+
+
+class ModeratedTopic(BaseFilter):
+    """Match text messages in a registered topic and pass its settings as `topic`"""
+
+    def __init__(self, registry: TopicRegistry = topic_registry):
+        self.registry = registry
+
+    async def __call__(self, message: types.Message):
+        if not message.text or not message.message_thread_id:
+            return False
+        settings = self.registry.get(message.chat.id, message.message_thread_id)
+        if settings is None:
+            return False
+        return {'topic': settings}
@@ -0,0 +1,215 @@
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from config import TRACE_ENABLED, TRACE_SLOWEST
+
+# Trace of the running update, None outside of one
+_current = ContextVar('trace', default=None)
+
+
+class Trace:
+    """
+    Span tree of one update: (name, depth, start offset, duration) per span,
+    in seconds. Spans nest by `depth`, which only the update's own task moves.
+    """
+    __slots__ = ('update', 'started_at', 'started', 'duration', 'loop_lag', 'depth', 'spans')
+
+    def __init__(self, update: Update):
+        self.update = update
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.loop_lag = None
+        self.depth = 0
+        self.spans = []
+
+    @property
+    def update_type(self) -> str:
+        # Only looked up for the traces that are shown, it scans every field
+        try:
+            return self.update.event_type
+        except UpdateTypeLookupError:
+            return 'unknown'
+
+    def finish(self, loop_lag: float = None):
+        self.duration = time.perf_counter() - self.started
+        self.loop_lag = loop_lag
+
+    def as_dict(self) -> dict:
+        return {
+            'update_id': self.update.update_id,
+            'type': self.update_type,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'loop_lag_ms': round(self.loop_lag * 1000, 3) if self.loop_lag is not None else None,
+            'spans': [{'name': name, 'depth': depth, 'start_ms': round(start * 1000, 3),
+                       'duration_ms': round(duration * 1000, 3)}
+                      for name, depth, start, duration in sorted(self.spans, key=lambda span: span[2])],
+        }
+
+    def render(self) -> str:
+        """Indented span tree, spans ending after the update (queued sends and deletes) included"""
+        header = f"update {self.update.update_id} {self.update_type} {self.duration * 1000:.1f} ms"
+        if self.loop_lag is not None:
+            header += f", loop lag {self.loop_lag * 1000:.1f} ms"
+        lines = [header]
+        for name, depth, start, duration in sorted(self.spans, key=lambda span: span[2]):
+            lines.append(f"{'  ' * (depth + 1)}{name} +{start * 1000:.1f} {duration * 1000:.1f} ms")
+        return '\n'.join(lines)
+
+
+class _Span:
+    __slots__ = ('name', 'trace', 'depth', 'start')
+
+    def __init__(self, name: str, trace: Trace):
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        trace = self.trace
+        self.depth = trace.depth
+        trace.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        trace = self.trace
+        trace.depth = self.depth
+        trace.spans.append((self.name, self.depth, self.start - trace.started, end - self.start))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str):
+    """Context manager timing a block as a span of the current update, free outside of one"""
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(name, trace)
+
+
+def current_trace():
+    return _current.get()
+
+
+def activate(trace: Trace):
+    """Make `trace` current in this context, e.g. for a queued job of its update; returns a reset token"""
+    return _current.set(trace)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+class SlowestTraces:
+    """The `size` slowest finished updates, in a bounded min-heap"""
+
+    def __init__(self, size: int = TRACE_SLOWEST):
+        self.size = size
+        self.traced = 0
+        self._heap = []  # (duration, seq, trace)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, trace: Trace):
+        self.traced += 1
+        item = (trace.duration, next(self._seq), trace)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        elif trace.duration > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def slowest(self, count: int = None) -> list:
+        traces = [trace for _, _, trace in sorted(self._heap, reverse=True)]
+        return traces[:count] if count is not None else traces
+
+    def clear(self):
+        self._heap.clear()
+
+
+# Shared buffer of the slowest updates
+slowest_traces = SlowestTraces()
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware giving every update a trace, kept if it is among
+    the slowest. The event loop lag at the end is noted from `loop_lag`, a
+    gauge of metrics.py, so that contention can be told from slow calls.
+    """
+
+    def __init__(self, buffer: SlowestTraces = slowest_traces, loop_lag=None):
+        self.buffer = buffer
+        self.loop_lag = loop_lag
+
+    async def __call__(self, handler, event, data):
+        trace = Trace(event)
+        token = _current.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            _current.reset(token)
+            trace.finish(self.loop_lag.value if self.loop_lag is not None else None)
+            self.buffer.add(trace)
+
+
+class HandlerSpanMiddleware(BaseMiddleware):
+    """Inner middleware adding a span per handler call"""
+
+    async def __call__(self, handler, event, data):
+        with span(data['handler'].callback.__name__):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware adding a span per Bot API request. Requests of queued
+    jobs may overlap within one update, so they are leaves that leave the
+    depth alone.
+    """
+
+    async def __call__(self, make_request, bot: Bot, method):
+        trace = _current.get()
+        if trace is None:
+            return await make_request(bot, method)
+        depth = trace.depth
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            trace.spans.append((f"api.{method.__api_method__}", depth, start - trace.started,
+                                time.perf_counter() - start))
+
+
+def setup_tracing(dp: Dispatcher, loop_lag=None, enabled: bool = TRACE_ENABLED):
+    """Register the tracing middlewares, the session one on the bot in use at startup"""
+    if not enabled:
+        return
+    dp.update.outer_middleware(TracingMiddleware(loop_lag=loop_lag))
+    handler_middleware = HandlerSpanMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ('update', 'error'):
+            observer.middleware(handler_middleware)
+
+    async def on_startup(bot: Bot):
+        if not any(isinstance(middleware, TracingRequestMiddleware) for middleware in bot.session.middleware):
+            bot.session.middleware(TracingRequestMiddleware())
+
+    dp.startup.register(on_startup)
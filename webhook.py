@@ -0,0 +1,111 @@
+import asyncio
+import hmac
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+from config import WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS, WEBHOOK_DROP_POLICY
+from logger import logger
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEW = 'drop_new'
+REJECT = 'reject'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookReceiver:
+    """
+    Acknowledges webhook requests immediately and hands updates to a worker pool
+    through a bounded queue. When the queue is full the drop policy decides
+    whether the oldest update is discarded, the new one is discarded, or the
+    request is answered with 503 so Telegram redelivers it later.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = None,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS,
+                 drop_policy: str = WEBHOOK_DROP_POLICY):
+        if drop_policy not in (DROP_OLDEST, DROP_NEW, REJECT):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.queue_size = queue_size
+        self.workers = workers
+        self.drop_policy = drop_policy
+        self.received = 0
+        self.dropped = 0
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """aiohttp handler for POST requests from Telegram"""
+        if self.secret is not None:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret):
+                return web.Response(status=401)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            logger.error("Received non-JSON webhook request")
+            return web.Response(status=400)
+
+        self.received += 1
+        if self._queue.full():
+            if self.drop_policy == REJECT:
+                return web.Response(status=503)
+            self.dropped += 1
+            if self.drop_policy == DROP_NEW:
+                logger.error("Webhook queue full, dropped update %s", data.get('update_id'),
+                             extra={'event': 'update_dropped'})
+                return web.Response()
+            dropped = self._queue.get_nowait()
+            self._queue.task_done()
+            logger.error("Webhook queue full, dropped update %s", dropped.get('update_id'),
+                         extra={'event': 'update_dropped'})
+        self._queue.put_nowait(data)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            data = await self._queue.get()
+            try:
+                update = types.Update.model_validate(data, context={'bot': self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error("Error processing webhook update %s: %s", data.get('update_id'), e, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 5):
+        """Give workers a chance to finish queued updates, then cancel them"""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                logger.error("Webhook queue not drained, %s updates lost", self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def setup(self, app: web.Application, path: str):
+        """Register the webhook route and tie workers to the app lifecycle"""
+        app.router.add_post(path, self.handle)
+
+        async def on_startup(_):
+            await self.start()
+
+        async def on_shutdown(_):
+            await self.stop()
+
+        app.on_startup.append(on_startup)
+        app.on_shutdown.append(on_shutdown)